@@ -0,0 +1,79 @@
+"""
+Throughput of each pitch-shift quality tier (dsp.PITCH_SHIFT_QUALITIES), measured offline.
+
+Runs the same ProcessingGraph stages a render uses, block by block, over decoded audio (a
+file given with --input, otherwise a synthetic mix) and reports how many times faster than
+realtime each tier renders on one core. Usage:
+
+    python benchmark_pitch_tiers.py [--input track.webm] [--seconds 60] [--frequency 432]
+"""
+import argparse
+import asyncio
+import subprocess
+import time
+
+import numpy as np
+
+from dsp import PITCH_SHIFT_QUALITIES, ProcessingGraph, calculate_pitch_factor
+from dsp_executor import dsp_executor
+from streaming import OUTPUT_CHANNELS, OUTPUT_SAMPLE_RATE, STREAM_BLOCK_FRAMES
+
+
+def load_audio(path: str, seconds: float) -> np.ndarray:
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-i', path, '-t', str(seconds),
+        '-f', 'f32le', '-ac', str(OUTPUT_CHANNELS), '-ar', str(OUTPUT_SAMPLE_RATE), 'pipe:1',
+    ]
+    pcm = subprocess.run(command, check=True, capture_output=True).stdout
+    return np.frombuffer(pcm, dtype=np.float32).reshape(-1, OUTPUT_CHANNELS)
+
+
+def synthetic_audio(seconds: float) -> np.ndarray:
+    # A chord plus a little noise, so the phase vocoders have something music-like to chew on
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * OUTPUT_SAMPLE_RATE)) / OUTPUT_SAMPLE_RATE
+    mono = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63, 440.0)) * 0.15
+    mono += rng.normal(0, 0.02, len(t))
+    return np.stack([mono, np.roll(mono, 441)], axis=1).astype(np.float32)
+
+
+async def render_seconds(audio: np.ndarray, effect: str, pitch_factor: float) -> tuple[float, int]:
+    graph = ProcessingGraph.compile([(effect, {"pitch_factor": pitch_factor})], OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS)
+    frames = 0
+    start = time.perf_counter()
+    try:
+        for i in range(0, len(audio), STREAM_BLOCK_FRAMES):
+            frames += len(await graph.process(audio[i:i + STREAM_BLOCK_FRAMES]))
+        async for block in graph.flush():
+            frames += len(block)
+    finally:
+        graph.close()
+    return time.perf_counter() - start, frames
+
+
+async def main(args):
+    audio = load_audio(args.input, args.seconds) if args.input else synthetic_audio(args.seconds)
+    duration = len(audio) / OUTPUT_SAMPLE_RATE
+    pitch_factor = calculate_pitch_factor(args.frequency)
+    print(f"{duration:.1f}s of audio, {args.frequency:g} Hz (pitch factor {pitch_factor:.5f}), {STREAM_BLOCK_FRAMES}-frame blocks")
+    print(f"{'quality':<10} {'effect':<12} {'seconds':>8} {'x realtime':>11} {'ms/block':>9} {'out/in frames':>14}")
+    blocks = -(-len(audio) // STREAM_BLOCK_FRAMES)
+    for quality, effect in PITCH_SHIFT_QUALITIES.items():
+        results = [await render_seconds(audio, effect, pitch_factor) for _ in range(args.repeat)]
+        elapsed, frames = min(results)
+        print(f"{quality:<10} {effect:<12} {elapsed:8.2f} {duration / elapsed:11.1f} {1000 * elapsed / blocks:9.1f} {frames / len(audio):14.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Audio file to decode (default: synthetic)")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Length of audio to render")
+    parser.add_argument("--frequency", type=float, default=432.0, help="Target frequency in Hz")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per tier; the fastest is reported")
+    args = parser.parse_args()
+    dsp_executor.workers = 1  # One core per render, as under load
+    dsp_executor.start()
+    try:
+        asyncio.run(main(args))
+    finally:
+        dsp_executor.shutdown()
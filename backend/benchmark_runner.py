@@ -1,317 +1,386 @@
+import argparse
 import asyncio
 import aiohttp
+import csv
+import itertools
+import random
 import time
 import json
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
 
 # --- Configuration ---
 BASE_URL = "http://localhost:8000"  # Ensure your FastAPI server is running here
 AUDIO_TEST_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"  # A reasonably short audio for testing
 DEFAULT_TARGET_FREQUENCY = 440.0 * (2**(4/12)) # Example: Tune A4 up by 4 semitones
-CONCURRENCY_LEVELS = [1, 5, 10] # Number of concurrent users/requests
+CONCURRENCY_LEVELS = [1, 5, 10] # Closed loop: number of concurrent users, each sending its next request when the last one finishes
 REQUESTS_PER_CONCURRENCY_LEVEL = 20 # Total requests to make for each concurrency level
+ARRIVAL_RATES = [0.05, 0.1, 0.2, 0.5] # Open loop: requests per second, arriving as a Poisson process regardless of responses
+OPEN_LOOP_DURATION_SECONDS = 60 # Arrivals are generated for this long at each rate
+FREQUENCY_STEP_HZ = 0.1 # Render cache resolution: each render request gets its own frequency so it isn't a cache hit
+FREQUENCY_STEPS = 1000 # Distinct frequencies cycled through (up to +100 Hz)
+RESOURCE_SAMPLE_INTERVAL_SECONDS = 0.5 # How often server RSS and CPU are scraped from /metrics
+TTFB_SLO_MS = 2000 # An open-loop rate counts as sustained if it serves everything with p99 time-to-first-byte under this
+
+SCENARIOS = {
+    # name: (endpoint, target frequency, AI preset)
+    "/get_audio_info": ("get_audio_info", None, False),
+    "/process_audio (baseline)": ("process_audio", None, False),
+    "/process_audio (pitch shift)": ("process_audio", DEFAULT_TARGET_FREQUENCY, False),
+    "/process_audio (AI preset)": ("process_audio", None, True),
+    "/process_audio (pitch shift + AI preset)": ("process_audio", DEFAULT_TARGET_FREQUENCY, True),
+}
+
+render_counter = itertools.count() # Shared across scenarios, so no two renders share a cache entry
+
+class RequestResult(NamedTuple):
+    ok: bool
+    status: int # HTTP status, 0 if the request never got a response
+    ttfb_ms: float # Time to the first byte of the body, measured like latency_ms
+    latency_ms: float # Total time, from when the request was due (open loop) or sent (closed loop)
+    bytes_received: int
+    render_cache: Optional[str] # X-Render-Cache: miss, hit, coalesced or preview
 
 # --- Helper Functions ---
 
-async def fetch_get_audio_info(session: aiohttp.ClientSession, url: str) -> Tuple[Dict[str, Any] | None, float]:
+async def fetch_get_audio_info(session: aiohttp.ClientSession, url: str, started: float) -> tuple[RequestResult, Optional[Dict[str, Any]]]:
     """Fetches audio info from the /get_audio_info endpoint."""
-    start_time = time.perf_counter()
     payload = {"url": url}
     try:
         async with session.post(f"{BASE_URL}/get_audio_info", json=payload) as response:
-            response_json = await response.json()
-            end_time = time.perf_counter()
-            latency = (end_time - start_time) * 1000  # milliseconds
-            if response.status == 200 and response_json.get("audio_stream_url"):
-                return response_json, latency
-            else:
+            body = await response.read()
+            ttfb_ms = (time.perf_counter() - started) * 1000 # Small JSON body: first byte and last byte arrive together
+            latency = (time.perf_counter() - started) * 1000  # milliseconds
+            response_json = json.loads(body) if body else {}
+            ok = response.status == 200 and bool(response_json.get("audio_stream_url"))
+            if not ok:
                 print(f"Error in /get_audio_info: {response.status}, {response_json.get('detail')}")
-                return None, latency
+            return RequestResult(ok, response.status, ttfb_ms, latency, len(body), None), response_json if ok else None
     except Exception as e:
-        end_time = time.perf_counter()
-        latency = (end_time - start_time) * 1000
+        latency = (time.perf_counter() - started) * 1000
         print(f"Exception in /get_audio_info: {e}")
-        return None, latency
+        return RequestResult(False, 0, latency, latency, 0, None), None
 
 async def fetch_process_audio(
     session: aiohttp.ClientSession,
     audio_stream_url: str,
     target_frequency: float | None,
-    ai_preset: bool
-) -> Tuple[bool, float, int]:
+    ai_preset: bool,
+    started: float
+) -> RequestResult:
     """Calls the /process_audio endpoint and consumes the stream."""
-    start_time = time.perf_counter()
     payload = {
         "audio_stream_url": audio_stream_url,
         "target_frequency": target_frequency,
         "ai_preset": ai_preset
     }
     bytes_received = 0
+    ttfb_ms = None
     try:
         async with session.post(f"{BASE_URL}/process_audio", json=payload) as response:
             if response.status == 200:
-                async for chunk in response.content.iter_chunked(8192):
+                async for chunk in response.content.iter_any():
+                    if ttfb_ms is None:
+                        ttfb_ms = (time.perf_counter() - started) * 1000
                     bytes_received += len(chunk)
-                end_time = time.perf_counter()
-                latency = (end_time - start_time) * 1000  # milliseconds
+                latency = (time.perf_counter() - started) * 1000  # milliseconds
                 if bytes_received == 0:
                     print(f"Warning: /process_audio for {audio_stream_url} returned 0 bytes.")
-                    # Try to get error detail if available
-                    try:
-                        error_detail = await response.json()
-                        print(f"Error detail from server: {error_detail.get('detail')}")
-                    except:
-                        pass # Ignore if not json
-                    return False, latency, bytes_received
-                return True, latency, bytes_received
+                return RequestResult(bytes_received > 0, response.status, ttfb_ms or latency, latency, bytes_received, response.headers.get("X-Render-Cache"))
             else:
                 error_detail = await response.text()
-                end_time = time.perf_counter()
-                latency = (end_time - start_time) * 1000
-                print(f"Error in /process_audio: {response.status}, {error_detail}")
-                return False, latency, bytes_received
+                latency = (time.perf_counter() - started) * 1000
+                if response.status != 503: # Admission control turning requests away is expected under overload; counted separately
+                    print(f"Error in /process_audio: {response.status}, {error_detail}")
+                return RequestResult(False, response.status, latency, latency, bytes_received, None)
     except Exception as e:
-        end_time = time.perf_counter()
-        latency = (end_time - start_time) * 1000
+        latency = (time.perf_counter() - started) * 1000
         print(f"Exception in /process_audio: {e}")
-        return False, latency, bytes_received
+        return RequestResult(False, 0, ttfb_ms or latency, latency, bytes_received, None)
+
+# --- Server resource sampling ---
+
+def parse_server_resources(metrics_text: str) -> tuple[float, float]:
+    """(resident bytes, CPU seconds) of the whole server: the app process, its DSP workers and exited ffmpeg children."""
+    from prometheus_client.parser import text_string_to_metric_families
+    rss_bytes = 0.0
+    cpu_seconds = 0.0
+    for family in text_string_to_metric_families(metrics_text):
+        for sample in family.samples:
+            if sample.name in ("process_resident_memory_bytes", "lambro_dsp_worker_rss_bytes"):
+                rss_bytes += sample.value
+            elif sample.name in ("process_cpu_seconds_total", "lambro_child_cpu_seconds_total"):
+                cpu_seconds += sample.value
+    return rss_bytes, cpu_seconds
+
+async def sample_server_resources(session: aiohttp.ClientSession, stop: asyncio.Event) -> List[tuple[float, float, float]]:
+    """Scrapes /metrics until `stop` is set. Returns (time, RSS bytes, CPU seconds) samples, empty if the server has no /metrics."""
+    samples = []
+    while True:
+        try:
+            async with session.get(f"{BASE_URL}/metrics") as response:
+                if response.status != 200:
+                    print(f"    Server has no /metrics ({response.status}); not sampling RSS/CPU")
+                    return samples
+                samples.append((time.perf_counter(), *parse_server_resources(await response.text())))
+        except Exception as e:
+            print(f"    Could not sample /metrics: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=RESOURCE_SAMPLE_INTERVAL_SECONDS)
+            return samples
+        except asyncio.TimeoutError:
+            pass
+
+def summarize_resources(samples: List[tuple[float, float, float]]) -> Dict[str, Optional[float]]:
+    if len(samples) < 2:
+        return {"peak_rss_mb": None, "avg_rss_mb": None, "avg_cpu_cores": None}
+    rss = [rss_bytes for _, rss_bytes, _ in samples]
+    elapsed = samples[-1][0] - samples[0][0]
+    return {
+        "peak_rss_mb": max(rss) / 1024**2,
+        "avg_rss_mb": float(np.mean(rss)) / 1024**2,
+        "avg_cpu_cores": (samples[-1][2] - samples[0][2]) / elapsed if elapsed > 0 else None,
+    }
+
+# --- Load generation ---
+
+async def closed_loop(send: Callable[[float], Awaitable[RequestResult]], concurrency: int, total_requests: int) -> List[RequestResult]:
+    """At most `concurrency` requests in flight: each worker sends its next request as soon as the last one finishes."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> RequestResult:
+        async with semaphore:
+            return await send(time.perf_counter())
+
+    return await asyncio.gather(*(one() for _ in range(total_requests)))
+
+async def open_loop(send: Callable[[float], Awaitable[RequestResult]], rate: float, duration: float, seed: int = 0) -> List[RequestResult]:
+    """
+    Requests arrive as a Poisson process at `rate` per second for `duration` seconds, whether or
+    not earlier ones have finished. Latency counts from when each request was due, so a
+    lagging client can't hide server slowness (no coordinated omission).
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    due = start
+    tasks = []
+    while True:
+        due += rng.expovariate(rate)
+        if due - start > duration:
+            break
+        await asyncio.sleep(max(due - time.perf_counter(), 0))
+        tasks.append(asyncio.create_task(send(due)))
+    return await asyncio.gather(*tasks)
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
 
 async def run_benchmark_scenario(
     scenario_name: str,
-    concurrency: int,
-    total_requests: int,
+    mode: str,
+    load: float,
     target_frequency: float | None,
     ai_preset: bool,
-    use_process_audio: bool = True
+    use_process_audio: bool = True,
+    total_requests: int = REQUESTS_PER_CONCURRENCY_LEVEL,
+    duration: float = OPEN_LOOP_DURATION_SECONDS,
+    unique_renders: bool = True,
 ) -> Dict[str, Any]:
-    """Runs a specific benchmark scenario with concurrent requests."""
-    print(f"\n--- Running Scenario: {scenario_name} | Concurrency: {concurrency} | Total Requests: {total_requests} ---")
-    latencies: List[float] = []
-    success_count = 0
-    failure_count = 0
-    bytes_transferred_list: List[int] = []
-
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        
+    """
+    Runs a scenario closed loop (`load` = concurrency) or open loop (`load` = arrivals per second).
+
+    With `unique_renders` every pitch-shifted request asks for a slightly different frequency,
+    so each one is really rendered instead of being served from the render cache. Scenarios
+    without a target frequency can't be varied that way; their X-Render-Cache counts show it.
+    """
+    load_label = f"concurrency {int(load)}" if mode == "closed" else f"{load:g} req/s"
+    print(f"\n--- Running Scenario: {scenario_name} | {mode} loop, {load_label} ---")
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None), connector=aiohttp.TCPConnector(limit=0)) as session:
         # First, get audio_info for all requests if process_audio is used
         # This simulates a more realistic workflow where info is fetched before processing
         initial_audio_info = None
         if use_process_audio:
             print(f"Fetching initial audio_info for {AUDIO_TEST_URL}...")
-            initial_audio_info, _ = await fetch_get_audio_info(session, AUDIO_TEST_URL)
+            _, initial_audio_info = await fetch_get_audio_info(session, AUDIO_TEST_URL, time.perf_counter())
             if not initial_audio_info:
                 print(f"Critical: Could not get audio_info for {AUDIO_TEST_URL}. Aborting scenario.")
-                return {
-                    "scenario_name": scenario_name,
-                    "concurrency": concurrency,
-                    "total_requests": total_requests,
-                    "successful_requests": 0,
-                    "failed_requests": total_requests,
-                    "avg_rps": 0,
-                    "avg_latency_ms": 0,
-                    "p50_latency_ms": 0,
-                    "p90_latency_ms": 0,
-                    "p99_latency_ms": 0,
-                    "error_rate_percent": 100,
-                    "avg_bytes_transferred": 0
-                }
+                return {"scenario_name": scenario_name, "mode": mode, "load": load, "aborted": True}
             print(f"Got audio_stream_url: {initial_audio_info['audio_stream_url']}")
 
+        async def send(started: float) -> RequestResult:
+            if not use_process_audio:
+                result, _ = await fetch_get_audio_info(session, AUDIO_TEST_URL, started)
+                return result
+            frequency = target_frequency
+            if unique_renders and frequency is not None:
+                frequency = target_frequency + FREQUENCY_STEP_HZ * (next(render_counter) % FREQUENCY_STEPS)
+            return await fetch_process_audio(session, initial_audio_info["audio_stream_url"], frequency, ai_preset, started)
 
-        for _ in range(total_requests):
-            if use_process_audio:
-                if initial_audio_info and initial_audio_info.get("audio_stream_url"):
-                    task = asyncio.ensure_future(fetch_process_audio(
-                        session,
-                        initial_audio_info["audio_stream_url"],
-                        target_frequency,
-                        ai_preset
-                    ))
-                else: # Should not happen due to check above, but as a safeguard
-                    failure_count +=1
-                    latencies.append(0) # Or some indicator of pre-failure
-                    continue 
-            else: # /get_audio_info scenario
-                task = asyncio.ensure_future(fetch_get_audio_info(session, AUDIO_TEST_URL))
-            tasks.append(task)
-
+        stop_sampling = asyncio.Event()
+        sampler = asyncio.create_task(sample_server_resources(session, stop_sampling))
         start_run_time = time.perf_counter()
-        print(f"    Launching {len(tasks)} requests for {scenario_name} at concurrency {concurrency}...")
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        end_run_time = time.perf_counter()
-        print(f"    All {len(tasks)} requests for {scenario_name} at concurrency {concurrency} completed.")
-        
-        total_run_duration = end_run_time - start_run_time
-
-        for result in results:
-            if isinstance(result, Exception):
-                failure_count += 1
-                # We don't have latency if an exception occurred before timing
-            elif use_process_audio:
-                success, latency, bytes_received = result
-                latencies.append(latency)
-                bytes_transferred_list.append(bytes_received)
-                if success and bytes_received > 0 : # Ensure stream was not empty
-                    success_count += 1
-                else:
-                    failure_count += 1
-            else: # /get_audio_info
-                info, latency = result
-                latencies.append(latency)
-                if info:
-                    success_count += 1
-                else:
-                    failure_count += 1
-    
-    # Calculate statistics
-    actual_completed_requests = success_count + failure_count
-    avg_rps = actual_completed_requests / total_run_duration if total_run_duration > 0 else 0
-    avg_latency_ms = np.mean(latencies) if latencies else 0
-    p50_latency_ms = np.percentile(latencies, 50) if latencies else 0
-    p90_latency_ms = np.percentile(latencies, 90) if latencies else 0
-    p99_latency_ms = np.percentile(latencies, 99) if latencies else 0
-    error_rate_percent = (failure_count / actual_completed_requests) * 100 if actual_completed_requests > 0 else 0
-    avg_bytes_transferred = np.mean(bytes_transferred_list) if bytes_transferred_list else 0
-
-
-    print(f"    Completed: {actual_completed_requests}, Success: {success_count}, Fail: {failure_count}")
-    print(f"    Avg RPS: {avg_rps:.2f}")
-    print(f"    Avg Latency: {avg_latency_ms:.2f} ms")
-    print(f"    P50 Latency: {p50_latency_ms:.2f} ms")
-    print(f"    P90 Latency: {p90_latency_ms:.2f} ms")
-    print(f"    P99 Latency: {p99_latency_ms:.2f} ms")
-    if use_process_audio:
-        print(f"    Avg Bytes Transferred: {avg_bytes_transferred:.2f}")
+        if mode == "closed":
+            results = await closed_loop(send, int(load), total_requests)
+        else:
+            results = await open_loop(send, load, duration)
+        total_run_duration = time.perf_counter() - start_run_time
+        stop_sampling.set()
+        resources = summarize_resources(await sampler)
 
+    # Calculate statistics
+    successes = [r for r in results if r.ok]
+    latencies = [r.latency_ms for r in successes]
+    ttfbs = [r.ttfb_ms for r in successes]
+    rejected = sum(1 for r in results if r.status == 503)
+    completed = len(results)
+    cache_counts: Dict[str, int] = {}
+    for r in successes:
+        if r.render_cache:
+            cache_counts[r.render_cache] = cache_counts.get(r.render_cache, 0) + 1
 
-    return {
+    summary = {
         "scenario_name": scenario_name,
-        "concurrency": concurrency,
-        "total_requests": total_requests, # This is the attempted number
-        "completed_requests": actual_completed_requests,
-        "successful_requests": success_count,
-        "failed_requests": failure_count,
-        "avg_rps": avg_rps,
-        "avg_latency_ms": avg_latency_ms,
-        "p50_latency_ms": p50_latency_ms,
-        "p90_latency_ms": p90_latency_ms,
-        "p99_latency_ms": p99_latency_ms,
-        "error_rate_percent": error_rate_percent,
-        "avg_bytes_transferred": avg_bytes_transferred if use_process_audio else None
+        "mode": mode,
+        "load": load,
+        "offered_rps": load if mode == "open" else None,
+        "total_requests": completed,
+        "successful_requests": len(successes),
+        "failed_requests": completed - len(successes),
+        "rejected_requests": rejected,
+        "duration_s": total_run_duration,
+        "throughput_rps": len(successes) / total_run_duration if total_run_duration > 0 else 0,
+        "avg_latency_ms": float(np.mean(latencies)) if latencies else 0,
+        "p50_latency_ms": percentile(latencies, 50),
+        "p90_latency_ms": percentile(latencies, 90),
+        "p99_latency_ms": percentile(latencies, 99),
+        "p50_ttfb_ms": percentile(ttfbs, 50),
+        "p90_ttfb_ms": percentile(ttfbs, 90),
+        "p99_ttfb_ms": percentile(ttfbs, 99),
+        "error_rate_percent": (completed - len(successes)) / completed * 100 if completed else 0,
+        "avg_bytes_transferred": float(np.mean([r.bytes_received for r in successes])) if successes and use_process_audio else None,
+        "render_cache": cache_counts,
+        **resources,
     }
 
-async def main():
-    print("Starting benchmark process...")
-    all_results: List[Dict[str, Any]] = []
+    print(f"    Completed: {completed}, Success: {len(successes)}, Fail: {summary['failed_requests']} (503: {rejected})")
+    print(f"    Throughput: {summary['throughput_rps']:.3f} req/s over {total_run_duration:.1f}s")
+    print(f"    Latency p50/p90/p99: {summary['p50_latency_ms']:.0f} / {summary['p90_latency_ms']:.0f} / {summary['p99_latency_ms']:.0f} ms")
+    print(f"    TTFB    p50/p90/p99: {summary['p50_ttfb_ms']:.0f} / {summary['p90_ttfb_ms']:.0f} / {summary['p99_ttfb_ms']:.0f} ms")
+    if cache_counts:
+        print(f"    Render cache: {cache_counts}")
+    if resources["avg_cpu_cores"] is not None:
+        print(f"    Server: {resources['avg_cpu_cores']:.2f} CPU cores, RSS peak {resources['peak_rss_mb']:.0f} MB")
+    return summary
 
-    # --- Scenario 1: /get_audio_info only ---
-    for conc in CONCURRENCY_LEVELS:
-        num_req = REQUESTS_PER_CONCURRENCY_LEVEL // conc # Adjust requests to keep total work somewhat similar
-        if num_req == 0: num_req = 1 
-        result = await run_benchmark_scenario(
-            scenario_name="/get_audio_info",
-            concurrency=conc,
-            total_requests=num_req * conc, # Ensure it's a multiple of concurrency for easier batching
-            target_frequency=None,
-            ai_preset=False,
-            use_process_audio=False
-        )
-        all_results.append(result)
-
-    # --- Scenario 2: /process_audio (no pitch shift, no AI preset) ---
-    for conc in CONCURRENCY_LEVELS:
-        num_req = REQUESTS_PER_CONCURRENCY_LEVEL // conc
-        if num_req == 0: num_req = 1
-        result = await run_benchmark_scenario(
-            scenario_name="/process_audio (baseline)",
-            concurrency=conc,
-            total_requests=num_req * conc,
-            target_frequency=None,
-            ai_preset=False
-        )
-        all_results.append(result)
-
-    # --- Scenario 3: /process_audio (with pitch shift) ---
-    for conc in CONCURRENCY_LEVELS:
-        num_req = REQUESTS_PER_CONCURRENCY_LEVEL // conc
-        if num_req == 0: num_req = 1
-        result = await run_benchmark_scenario(
-            scenario_name="/process_audio (pitch shift)",
-            concurrency=conc,
-            total_requests=num_req * conc,
-            target_frequency=DEFAULT_TARGET_FREQUENCY,
-            ai_preset=False
-        )
-        all_results.append(result)
-
-    # --- Scenario 4: /process_audio (with AI preset) ---
-    for conc in CONCURRENCY_LEVELS:
-        num_req = REQUESTS_PER_CONCURRENCY_LEVEL // conc
-        if num_req == 0: num_req = 1
-        result = await run_benchmark_scenario(
-            scenario_name="/process_audio (AI preset)",
-            concurrency=conc,
-            total_requests=num_req * conc,
-            target_frequency=None,
-            ai_preset=True
-        )
-        all_results.append(result)
-    
-    # --- Scenario 5: /process_audio (with pitch shift AND AI preset) ---
-    for conc in CONCURRENCY_LEVELS:
-        num_req = REQUESTS_PER_CONCURRENCY_LEVEL // conc
-        if num_req == 0: num_req = 1
-        result = await run_benchmark_scenario(
-            scenario_name="/process_audio (pitch shift + AI preset)",
-            concurrency=conc,
-            total_requests=num_req * conc,
-            target_frequency=DEFAULT_TARGET_FREQUENCY,
-            ai_preset=True
-        )
-        all_results.append(result)
+def sustained_capacity(points: List[Dict[str, Any]], ttfb_slo_ms: float) -> Optional[float]:
+    """
+    Highest open-loop arrival rate the server kept up with: no failures or 503s, and p99
+    time-to-first-byte within the SLO (playback starts on the first byte). Closed-loop runs
+    can't tell this, since their load backs off as the server slows down.
+    """
+    sustained = [
+        p["offered_rps"] for p in points
+        if p["mode"] == "open" and p["total_requests"] and p["failed_requests"] == 0 and p["p99_ttfb_ms"] <= ttfb_slo_ms
+    ]
+    return max(sustained) if sustained else None
 
-    print("\nAll benchmark scenarios completed.")
+# --- Reports ---
 
-    # --- Generate Markdown Report ---
-    print("Generating Markdown report...")
-    report_path = "benchmark_report.md"
-    header = (
-        "| Scenario                            | Concurrency | Total Req. | Completed | Success | Failed | Avg RPS | Avg Latency (ms) | P50 Latency (ms) | P90 Latency (ms) | P99 Latency (ms) | Error Rate (%) | Avg Bytes Recv. |\n"
-        "|-------------------------------------|-------------|------------|-----------|---------|--------|---------|------------------|------------------|------------------|------------------|----------------|-----------------|\n"
-    )
-    report_md = header
+def format_optional(value: Optional[float], fmt: str) -> str:
+    return "N/A" if value is None else format(value, fmt)
 
-    for res in all_results:
-        # Defensive check for res structure
-        if not isinstance(res, dict):
-            print(f"Skipping malformed result item: {res}")
-            continue
+def write_reports(all_results: List[Dict[str, Any]], report_path: str, curves_path: str, results_path: str, ttfb_slo_ms: float = TTFB_SLO_MS):
+    results = [r for r in all_results if not r.get("aborted")]
+    report_md = (
+        "| Scenario | Mode | Load | Req. | Success | Failed (503) | Throughput (req/s) | P50 / P90 / P99 Latency (ms) | P50 / P99 TTFB (ms) | Render cache | Server CPU (cores) | Server RSS peak (MB) |\n"
+        "|---|---|---|---|---|---|---|---|---|---|---|---|\n"
+    )
+    for res in results:
+        load = f"{int(res['load'])} users" if res["mode"] == "closed" else f"{res['load']:g} req/s"
+        cache = ", ".join(f"{k} {v}" for k, v in sorted(res["render_cache"].items())) or "-"
+        report_md += (
+            f"| {res['scenario_name']} | {res['mode']} | {load} | {res['total_requests']} | {res['successful_requests']} | "
+            f"{res['failed_requests']} ({res['rejected_requests']}) | {res['throughput_rps']:.3f} | "
+            f"{res['p50_latency_ms']:.0f} / {res['p90_latency_ms']:.0f} / {res['p99_latency_ms']:.0f} | "
+            f"{res['p50_ttfb_ms']:.0f} / {res['p99_ttfb_ms']:.0f} | {cache} | "
+            f"{format_optional(res['avg_cpu_cores'], '.2f')} | {format_optional(res['peak_rss_mb'], '.0f')} |\n"
+        )
 
+    capacities = []
+    for name in dict.fromkeys(r["scenario_name"] for r in results):
+        capacity = sustained_capacity([r for r in results if r["scenario_name"] == name], ttfb_slo_ms)
+        if capacity is not None or any(r["mode"] == "open" for r in results if r["scenario_name"] == name):
+            capacities.append(f"| {name} | {format_optional(capacity, 'g')} |\n")
+    if capacities:
         report_md += (
-            f"| {res.get('scenario_name', 'Unknown Scenario'):<35} | "
-            f"{res.get('concurrency', 0):<11} | "
-            f"{res.get('total_requests', 0):<10} | "
-            f"{res.get('completed_requests', 0):<9} | "
-            f"{res.get('successful_requests', 0):<7} | "
-            f"{res.get('failed_requests', 0):<6} | "
-            f"{res.get('avg_rps', 0.0):.2f}       | " 
-            f"{res.get('avg_latency_ms', 0.0):.2f}            | "
-            f"{res.get('p50_latency_ms', 0.0):.2f}            | "
-            f"{res.get('p90_latency_ms', 0.0):.2f}            | "
-            f"{res.get('p99_latency_ms', 0.0):.2f}            | "
-            f"{res.get('error_rate_percent', 0.0):.2f}             | "
-            f"{res.get('avg_bytes_transferred', 'N/A') if res.get('avg_bytes_transferred') is not None else 'N/A':<15} |\n"
+            "\nSustained capacity: the highest open-loop arrival rate served without failures and with "
+            f"p99 time-to-first-byte under {ttfb_slo_ms:g} ms.\n\n| Scenario | Capacity (req/s) |\n|---|---|\n"
+            + "".join(capacities)
         )
-    
-    print(report_md)
 
+    print(report_md)
     with open(report_path, "w") as f:
         f.write(report_md)
     print(f"Report also saved to {report_path}")
+
+    # Throughput vs latency: one row per (scenario, load) point, ready to plot
+    curve_fields = [
+        "scenario_name", "mode", "load", "offered_rps", "throughput_rps", "p50_latency_ms", "p90_latency_ms", "p99_latency_ms",
+        "p50_ttfb_ms", "p99_ttfb_ms", "error_rate_percent", "avg_cpu_cores", "peak_rss_mb",
+    ]
+    with open(curves_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=curve_fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Throughput vs latency curves saved to {curves_path}")
+
+    with open(results_path, "w") as f:
+        json.dump(all_results, f, indent=2)
+    print(f"Raw results saved to {results_path}")
+
+async def main(args):
+    print("Starting benchmark process...")
+    all_results: List[Dict[str, Any]] = []
+
+    for scenario_name in args.scenarios:
+        endpoint, target_frequency, ai_preset = SCENARIOS[scenario_name]
+        use_process_audio = endpoint == "process_audio"
+        if args.mode in ("closed", "both"):
+            for conc in args.concurrency:
+                all_results.append(await run_benchmark_scenario(
+                    scenario_name, "closed", conc, target_frequency, ai_preset, use_process_audio,
+                    total_requests=max(args.requests, conc), unique_renders=not args.allow_cache_hits,
+                ))
+        if args.mode in ("open", "both"):
+            for rate in args.rates:
+                all_results.append(await run_benchmark_scenario(
+                    scenario_name, "open", rate, target_frequency, ai_preset, use_process_audio,
+                    duration=args.duration, unique_renders=not args.allow_cache_hits,
+                ))
+
+    print("\nAll benchmark scenarios completed.")
+    print("Generating Markdown report...")
+    write_reports(all_results, args.report, args.curves, args.results, args.ttfb_slo_ms)
     print("Benchmark process finished.")
 
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load test a running backend: closed-loop (N users) and open-loop (Poisson arrivals) scenarios.")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--audio-url", default=AUDIO_TEST_URL, help="Page URL passed to /get_audio_info")
+    parser.add_argument("--mode", choices=["closed", "open", "both"], default="both")
+    parser.add_argument("--concurrency", type=lambda v: [int(n) for n in v.split(",")], default=CONCURRENCY_LEVELS, help="Closed-loop user counts, e.g. 1,5,10")
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_CONCURRENCY_LEVEL, help="Requests per closed-loop level")
+    parser.add_argument("--rates", type=lambda v: [float(n) for n in v.split(",")], default=ARRIVAL_RATES, help="Open-loop arrival rates in req/s, e.g. 0.1,0.2,0.5")
+    parser.add_argument("--duration", type=float, default=OPEN_LOOP_DURATION_SECONDS, help="Seconds of arrivals per open-loop rate")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), metavar="SCENARIO")
+    parser.add_argument("--ttfb-slo-ms", type=float, default=TTFB_SLO_MS, help="p99 time-to-first-byte a rate must meet to count towards capacity")
+    parser.add_argument("--allow-cache-hits", action="store_true", help="Repeat the same frequency, so renders after the first are cache hits")
+    parser.add_argument("--report", default="benchmark_report.md")
+    parser.add_argument("--curves", default="benchmark_curves.csv")
+    parser.add_argument("--results", default="benchmark_results.json")
+    args = parser.parse_args()
+    BASE_URL = args.base_url.rstrip("/")
+    AUDIO_TEST_URL = args.audio_url
+    asyncio.run(main(args))
@@ -0,0 +1,490 @@
+"""
+Hermetic benchmark suite: runs offline on one machine and compares builds against a baseline.
+
+Sources are synthetic tracks (or files given with --fixture) encoded as opus (webm), m4a and
+wav, served by a local stand-in HTTP server with Range support. End-to-end numbers come from
+the real app in a child process whose yt-dlp extractor is stubbed to point at that server.
+
+Benchmarks, each at every --lengths track length (seconds of audio):
+    decode/<format>/<n>s        download + ffmpeg decode, the production path
+    resample/wav/<n>s           decode to PREVIEW_SAMPLE_RATE, the preview path's resampling
+    pitch/<quality>/<n>s        each pitch-shift tier (dsp.PITCH_SHIFT_QUALITIES)
+    encode/<format>/<n>s        PCM16 for wav, the streaming ffmpeg encoder for the rest
+    e2e/...                     /get_audio_info and /process_audio against the app
+
+Results are JSON; with --baseline every timing is compared against a stored run, and the
+exit status is 1 if anything regressed beyond its threshold. Usage:
+
+    python benchmark_suite.py run [--lengths 10,60,180] [--output results.json]
+                                  [--baseline benchmark_baseline.json] [--threshold 0.15 --threshold e2e/=0.5]
+    python benchmark_suite.py compare results.json --baseline benchmark_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import numpy as np
+
+SOURCE_FORMATS = {
+    # name: (file extension, ffmpeg codec options), roughly what YouTube serves
+    "opus": ("webm", ["-c:a", "libopus", "-b:a", "128k"]),
+    "m4a": ("m4a", ["-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"]),
+    "wav": ("wav", ["-c:a", "pcm_s16le"]),
+}
+ENCODE_FORMATS = ["wav", "opus", "aac", "mp3"]
+TIMING_FIELDS = ("seconds", "ttfb_seconds")  # Compared against the baseline; lower is better
+DEFAULT_THRESHOLD = 0.15  # Allowed slowdown as a fraction of the baseline
+DEFAULT_MIN_DELTA_SECONDS = 0.005  # Slowdowns smaller than this are noise, whatever the ratio
+SERVER_START_TIMEOUT_SECONDS = 30
+STUB_VIDEO_ID_PREFIX = "bench"
+
+
+# --- Fixtures and the stand-in media server ---
+
+def write_fixtures(directory: str, lengths: list[int], extra: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Encodes a synthetic track of each length in every SOURCE_FORMAT, reusing files from earlier
+    runs; `extra` files are transcoded the same way. Returns {track: {format: file name}}.
+    """
+    import soundfile as sf
+    from benchmark_pitch_tiers import synthetic_audio
+    from streaming import OUTPUT_SAMPLE_RATE
+
+    os.makedirs(directory, exist_ok=True)
+    sources = {}
+    for seconds in lengths:
+        master = os.path.join(directory, f"synthetic-{seconds}s.master.wav")
+        if not os.path.exists(master):
+            sf.write(master, synthetic_audio(seconds), OUTPUT_SAMPLE_RATE, subtype="PCM_16")
+        sources[f"{seconds}s"] = master
+    for path in extra:
+        sources[os.path.splitext(os.path.basename(path))[0]] = path
+
+    fixtures = {}
+    for track, source in sources.items():
+        fixtures[track] = {}
+        for name, (extension, codec_options) in SOURCE_FORMATS.items():
+            file_name = f"{track}.{extension}"
+            path = os.path.join(directory, file_name)
+            if not os.path.exists(path):
+                subprocess.run(
+                    ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', source, '-vn', *codec_options, path],
+                    check=True,
+                )
+            fixtures[track][name] = file_name
+    return fixtures
+
+
+def serve_media(directory: str, port: int):
+    """The stand-in for YouTube's media servers: static files with Range support."""
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_static("/", directory)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def serve_app(port: int, media_url: str, state_directory: str):
+    """Runs the real app with isolated caches and yt-dlp stubbed out (see stub_page_url)."""
+    os.environ.update({
+        "RENDER_CACHE_DIR": os.path.join(state_directory, "renders"),
+        "PCM_CACHE_DIR": os.path.join(state_directory, "pcm"),
+        "WAVEFORM_CACHE_DIR": os.path.join(state_directory, "waveforms"),
+        "AUDIO_INFO_CACHE_URL": "",
+        "AUDIO_INFO_CACHE_PATH": os.path.join(state_directory, "audio_info.sqlite3"),
+        "JOB_STORE_PATH": os.path.join(state_directory, "jobs.sqlite3"),
+        "PROFILE_DIR": os.path.join(state_directory, "profiles"),
+        "PREFETCH_ENABLED": "false",
+    })
+    import uvicorn
+    import main
+    from extraction import extraction_engine
+
+    async def extract(url: str) -> dict:
+        # Page URLs look like YouTube watch URLs (see stub_page_url) so canonicalization runs as usual
+        video_id = url.rsplit("v=", 1)[1]
+        seconds = int(video_id[len(STUB_VIDEO_ID_PREFIX):])
+        return {
+            "id": video_id,
+            "extractor_key": "Youtube",
+            "url": f"{media_url}/{seconds}s.{SOURCE_FORMATS['opus'][0]}",
+            "title": f"Benchmark track ({seconds}s)",
+            "duration": seconds,
+            "thumbnails": [],
+        }
+
+    async def warm_up():
+        pass
+
+    extraction_engine.extract = extract
+    extraction_engine.warm_up = warm_up
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def stub_page_url(seconds: int) -> str:
+    """A watch URL the stubbed extractor maps to the opus fixture of that length (YouTube IDs are 11 characters)."""
+    return f"https://www.youtube.com/watch?v={STUB_VIDEO_ID_PREFIX}{seconds:06d}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args: list[str], health_url: str) -> subprocess.Popen:
+    import urllib.request
+
+    # The app logs every request to stdout; errors still come through on stderr
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(health_url, timeout=1)
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server {args[0]} failed to start")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# --- Microbenchmarks (in this process) ---
+
+def result(runs: list[float], audio_seconds: Optional[float] = None, **extra) -> dict[str, Any]:
+    seconds = min(runs)  # The fastest run is the least disturbed by everything else on the machine
+    entry = {"seconds": round(seconds, 6), "runs": [round(run, 6) for run in runs]}
+    if audio_seconds:
+        entry["audio_seconds"] = audio_seconds
+        entry["x_realtime"] = round(audio_seconds / seconds, 2)
+    entry.update(extra)
+    return entry
+
+
+async def time_decode(url: str, **kwargs) -> float:
+    from streaming import decode_audio_blocks
+
+    started = time.perf_counter()
+    blocks = decode_audio_blocks(url, **kwargs)
+    try:
+        async for _ in blocks:
+            pass
+    finally:
+        await blocks.aclose()
+    return time.perf_counter() - started
+
+
+async def time_encode(audio: np.ndarray, format_name: str) -> float:
+    from dsp import PCM16Converter
+    from encoders import OUTPUT_FORMATS, StreamEncoder
+    from streaming import STREAM_BLOCK_FRAMES
+
+    output_format = OUTPUT_FORMATS[format_name]
+    started = time.perf_counter()
+    if output_format.codec is None:
+        to_pcm16 = PCM16Converter()
+        for i in range(0, len(audio), STREAM_BLOCK_FRAMES):
+            to_pcm16(audio[i:i + STREAM_BLOCK_FRAMES])
+        return time.perf_counter() - started
+    encoder = StreamEncoder(output_format, output_format.default_bitrate_kbps)
+    try:
+        for i in range(0, len(audio), STREAM_BLOCK_FRAMES):
+            await encoder.encode(audio[i:i + STREAM_BLOCK_FRAMES])
+        await encoder.finish()
+    finally:
+        await encoder.close()
+    return time.perf_counter() - started
+
+
+async def run_microbenchmarks(media_url: str, fixtures: dict, args) -> dict[str, dict]:
+    from benchmark_pitch_tiers import render_seconds, synthetic_audio
+    from downloader import source_downloader
+    from dsp import PITCH_SHIFT_QUALITIES, calculate_pitch_factor
+    from main import PREVIEW_SAMPLE_RATE
+    from streaming import OUTPUT_SAMPLE_RATE
+
+    results = {}
+    pitch_factor = calculate_pitch_factor(args.frequency)
+    await source_downloader.start()
+    try:
+        first_fixture = next(iter(fixtures.values()))
+        await time_decode(f"{media_url}/{first_fixture['wav']}")  # Warm-up: connection pool, page cache
+        for track, files in fixtures.items():
+            for name, file_name in files.items():
+                runs = [await time_decode(f"{media_url}/{file_name}") for _ in range(args.repeat)]
+                results[f"decode/{name}/{track}"] = result(runs, _track_seconds(track))
+                print(f"decode/{name}/{track}: {min(runs):.3f}s")
+            runs = [await time_decode(f"{media_url}/{files['wav']}", sample_rate=PREVIEW_SAMPLE_RATE) for _ in range(args.repeat)]
+            results[f"resample/wav/{track}"] = result(runs, _track_seconds(track), sample_rate=PREVIEW_SAMPLE_RATE)
+            print(f"resample/wav/{track}: {min(runs):.3f}s")
+    finally:
+        await source_downloader.close()
+
+    for seconds in args.lengths:
+        audio = synthetic_audio(seconds)
+        for quality, effect in PITCH_SHIFT_QUALITIES.items():
+            runs = [(await render_seconds(audio, effect, pitch_factor))[0] for _ in range(args.repeat)]
+            results[f"pitch/{quality}/{seconds}s"] = result(runs, seconds, frequency=args.frequency)
+            print(f"pitch/{quality}/{seconds}s: {min(runs):.3f}s ({seconds / min(runs):.1f}x realtime)")
+        for name in ENCODE_FORMATS:
+            runs = [await time_encode(audio, name) for _ in range(args.repeat)]
+            results[f"encode/{name}/{seconds}s"] = result(runs, seconds)
+            print(f"encode/{name}/{seconds}s: {min(runs):.3f}s")
+    return results
+
+
+def _track_seconds(track: str) -> Optional[float]:
+    return float(track[:-1]) if track.endswith("s") and track[:-1].isdigit() else None
+
+
+# --- End to end (against the app in a child process) ---
+
+async def timed_request(session, method: str, url: str, **kwargs) -> tuple[float, float, int]:
+    """(time to first body byte, total time, body bytes) of one request."""
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    async with session.request(method, url, **kwargs) as response:
+        if response.status != 200:
+            raise RuntimeError(f"{method} {url} -> {response.status}: {await response.text()}")
+        async for chunk in response.content.iter_any():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+    return first_byte or 0.0, time.perf_counter() - started, size
+
+
+async def run_end_to_end(app_url: str, args) -> dict[str, dict]:
+    import aiohttp
+
+    results = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        # Warm-up: the first canonicalization loads yt-dlp's extractor classes
+        await timed_request(session, "POST", f"{app_url}/get_audio_info", json={"url": stub_page_url(0)})
+        for seconds in args.lengths:  # The stubbed extractor only knows the synthetic tracks
+            track = f"{seconds}s"
+            page_url = stub_page_url(seconds)
+            _, miss, _ = await timed_request(session, "POST", f"{app_url}/get_audio_info", json={"url": page_url})
+            info_hits = [(await timed_request(session, "POST", f"{app_url}/get_audio_info", json={"url": page_url}))[1] for _ in range(args.repeat)]
+            results[f"e2e/audio_info/{track}/miss"] = result([miss])
+            results[f"e2e/audio_info/{track}/hit"] = result(info_hits)
+
+            async with session.post(f"{app_url}/get_audio_info", json={"url": page_url}) as response:
+                audio_stream_url = (await response.json())["audio_stream_url"]
+
+            def render(frequency: float):
+                payload = {"audio_stream_url": audio_stream_url, "target_frequency": frequency}
+                return timed_request(session, "POST", f"{app_url}/process_audio", json=payload)
+
+            # First render downloads and decodes; later ones at other frequencies start from the PCM
+            # cache; repeating a frequency is a render cache hit
+            ttfb, total, _ = await render(args.frequency)
+            results[f"e2e/process_audio/{track}/cold"] = result([total], seconds, ttfb_seconds=round(ttfb, 6))
+            warm = [await render(args.frequency + 0.1 * (i + 1)) for i in range(args.repeat)]
+            results[f"e2e/process_audio/{track}/pcm_warm"] = result(
+                [total for _, total, _ in warm], seconds, ttfb_seconds=round(min(ttfb for ttfb, _, _ in warm), 6),
+            )
+            hits = [await render(args.frequency) for _ in range(args.repeat)]
+            results[f"e2e/process_audio/{track}/hit"] = result(
+                [total for _, total, _ in hits], seconds, ttfb_seconds=round(min(ttfb for ttfb, _, _ in hits), 6),
+            )
+            print(f"e2e/{track}: audio_info miss {miss * 1000:.1f} ms, hit {min(info_hits) * 1000:.1f} ms; "
+                  f"process_audio cold {total:.2f}s (first byte {ttfb:.2f}s)")
+    return results
+
+
+# --- Baseline comparison ---
+
+def threshold_for(name: str, thresholds: dict[str, float], default: float) -> float:
+    """The threshold of the longest prefix of `name` with one, else `default`."""
+    matches = [prefix for prefix in thresholds if name.startswith(prefix)]
+    return thresholds[max(matches, key=len)] if matches else default
+
+
+def compare(current: dict, baseline: dict, thresholds: dict[str, float], default: float, min_delta: float) -> list[str]:
+    """Prints a comparison table and returns the regressions, if any."""
+    regressions = []
+    print(f"\n{'benchmark':<44} {'field':<13} {'baseline':>10} {'current':>10} {'change':>8}  limit")
+    for name, entry in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<44} {'':<13} {'-':>10} {'':>10} {'new':>8}")
+            continue
+        limit = threshold_for(name, thresholds, default)
+        for field in TIMING_FIELDS:
+            if field not in entry or not base.get(field):
+                continue
+            change = entry[field] / base[field] - 1
+            regressed = change > limit and entry[field] - base[field] > min_delta
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<44} {field:<13} {base[field]:10.4f} {entry[field]:10.4f} {change:+8.1%}  {limit:+.0%}{flag}")
+            if regressed:
+                regressions.append(f"{name} {field}: {base[field]:.4f}s -> {entry[field]:.4f}s ({change:+.1%}, limit {limit:+.0%})")
+    for name in sorted(set(baseline["results"]) - set(current["results"])):
+        print(f"{name:<44} {'':<13} {'':>10} {'-':>10} {'missing':>8}")
+    if current.get("machine") != baseline.get("machine"):
+        print("\nNote: the baseline was recorded on a different machine or toolchain; differences may not be regressions.")
+    return regressions
+
+
+def parse_thresholds(values: list[str]) -> tuple[float, dict[str, float]]:
+    """`0.2` sets the default; `prefix=0.5` sets it for benchmarks whose name starts with prefix."""
+    default, thresholds = DEFAULT_THRESHOLD, {}
+    for value in values:
+        prefix, _, fraction = value.rpartition("=")
+        if prefix:
+            thresholds[prefix] = float(fraction)
+        else:
+            default = float(fraction)
+    return default, thresholds
+
+
+def gate(current: dict, args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    default, thresholds = parse_thresholds(args.threshold)
+    regressions = compare(current, baseline, thresholds, default, args.min_delta_ms / 1000)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+# --- Entry points ---
+
+def machine_info() -> dict[str, Any]:
+    from config import _available_cores
+
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.splitlines()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "cores": _available_cores(),
+        "ffmpeg": ffmpeg[0] if ffmpeg else None,
+    }
+
+
+def run(args) -> int:
+    from dsp_executor import dsp_executor
+
+    fixtures_directory = args.fixtures_dir or os.path.join(tempfile.gettempdir(), "lambro-radio-benchmark", "fixtures")
+    fixtures = write_fixtures(fixtures_directory, args.lengths, args.fixture)
+    media_port = free_port()
+    media_url = f"http://127.0.0.1:{media_port}"
+    media_server = start_server(["serve-media", "--directory", fixtures_directory, "--port", str(media_port)], f"{media_url}/{fixtures[next(iter(fixtures))]['wav']}")
+    app_server = None
+    state_directory = tempfile.mkdtemp(prefix="lambro-radio-benchmark-")
+    results = {}
+    try:
+        if not args.skip_micro:
+            dsp_executor.workers = 1  # One core per render, as under load
+            dsp_executor.start()
+            try:
+                results.update(asyncio.run(run_microbenchmarks(media_url, fixtures, args)))
+            finally:
+                dsp_executor.shutdown()
+        if not args.skip_e2e:
+            app_port = free_port()
+            app_url = f"http://127.0.0.1:{app_port}"
+            app_server = start_server(["serve-app", "--port", str(app_port), "--media-url", media_url, "--state-dir", state_directory], f"{app_url}/health")
+            results.update(asyncio.run(run_end_to_end(app_url, args)))
+    finally:
+        if app_server is not None:
+            stop_server(app_server)
+        stop_server(media_server)
+        shutil.rmtree(state_directory, ignore_errors=True)
+
+    current = {
+        "version": 1,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "settings": {"lengths": args.lengths, "repeat": args.repeat, "frequency": args.frequency},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Results written to {args.output}")
+    return gate(current, args) if args.baseline else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_gate_arguments(command):
+        command.add_argument("--baseline", help="Stored results to compare against (e.g. benchmark_baseline.json)")
+        command.add_argument("--threshold", action="append", default=[], metavar="[PREFIX=]FRACTION",
+                             help=f"Allowed slowdown, default {DEFAULT_THRESHOLD}; PREFIX= scopes it, e.g. e2e/=0.5 (repeatable)")
+        command.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_SECONDS * 1000,
+                             help="Ignore slowdowns smaller than this, however large in relative terms")
+
+    run_command = commands.add_parser("run", help="Run the suite")
+    run_command.add_argument("--lengths", type=lambda value: [int(n) for n in value.split(",")], default=[10, 60, 180],
+                             help="Synthetic track lengths in seconds (default: 10,60,180)")
+    run_command.add_argument("--fixture", action="append", default=[], help="Extra audio file to benchmark decoding (repeatable)")
+    run_command.add_argument("--fixtures-dir", help="Where generated fixtures are kept between runs")
+    run_command.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest counts")
+    run_command.add_argument("--frequency", type=float, default=432.0, help="Target frequency in Hz")
+    run_command.add_argument("--output", help="Write results to this JSON file")
+    run_command.add_argument("--skip-micro", action="store_true", help="Only run the end-to-end benchmarks")
+    run_command.add_argument("--skip-e2e", action="store_true", help="Only run the microbenchmarks")
+    add_gate_arguments(run_command)
+
+    compare_command = commands.add_parser("compare", help="Compare a stored result file against a baseline")
+    compare_command.add_argument("results")
+    add_gate_arguments(compare_command)
+
+    media_command = commands.add_parser("serve-media")  # Internal: the stand-in media server
+    media_command.add_argument("--directory", required=True)
+    media_command.add_argument("--port", type=int, required=True)
+
+    app_command = commands.add_parser("serve-app")  # Internal: the app with a stubbed extractor
+    app_command.add_argument("--port", type=int, required=True)
+    app_command.add_argument("--media-url", required=True)
+    app_command.add_argument("--state-dir", required=True)
+
+    args = parser.parse_args()
+    if args.command == "serve-media":
+        serve_media(args.directory, args.port)
+    elif args.command == "serve-app":
+        serve_app(args.port, args.media_url, args.state_dir)
+    elif args.command == "compare":
+        if not args.baseline:
+            parser.error("compare needs --baseline")
+        with open(args.results) as f:
+            sys.exit(gate(json.load(f), args))
+    else:
+        sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
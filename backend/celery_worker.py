@@ -0,0 +1,47 @@
+"""
+Optional Celery backend for render jobs (JOB_BACKEND=celery).
+
+Run next to the API, on the same host or with RENDER_CACHE_DIR, PCM_CACHE_DIR and
+JOB_STORE_PATH on a shared volume:
+
+    celery -A celery_worker worker --concurrency=1
+
+Each Celery worker process runs jobs with the same code path as the local job workers. Celery
+already provides the process-level parallelism, so DSP runs on threads inside each worker.
+"""
+import asyncio
+
+from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+
+import config
+
+celery_app = Celery("lambro_radio", broker=config.CELERY_BROKER_URL)
+
+
+@worker_process_init.connect
+def _start_worker(**kwargs):
+    from dsp_executor import dsp_executor
+    from info_cache import audio_info_cache
+    from jobs import job_manager
+    from pcm_cache import pcm_cache
+    from render_cache import render_cache
+
+    dsp_executor.mode = "thread"  # Pool processes are daemonic and can't spawn DSP workers of their own
+    dsp_executor.start()
+    render_cache.load()
+    pcm_cache.load()
+    audio_info_cache.load()
+    job_manager.store.open()
+
+
+@worker_process_shutdown.connect
+def _stop_worker(**kwargs):
+    from dsp_executor import dsp_executor
+    dsp_executor.shutdown()
+
+
+@celery_app.task(name="render_job", acks_late=True)
+def render_job(job_id: str):
+    from main import run_render_job
+    asyncio.run(run_render_job(job_id))
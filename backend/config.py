@@ -0,0 +1,104 @@
+"""
+Runtime settings for the backend, read once from the environment at import time.
+"""
+import os
+import tempfile
+
+
+def _available_cores() -> int:
+    # sched_getaffinity respects container CPU pinning; cpu_count() does not
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+# --- DSP execution ---
+# "process" runs CPU-bound stages in a process pool (PCM is exchanged through shared memory),
+# "thread" runs them in a thread pool (cheaper to start, relies on Pedalboard releasing the GIL).
+DSP_EXECUTOR = os.environ.get("DSP_EXECUTOR", "process").lower()
+DSP_WORKERS = int(os.environ.get("DSP_WORKERS", "0")) or _available_cores()
+# Pitch-shift tier for requests that don't ask for one: "fast", "standard" or "high" (see dsp.PITCH_SHIFT_QUALITIES)
+PITCH_SHIFT_QUALITY = os.environ.get("PITCH_SHIFT_QUALITY", "standard").lower()
+
+# --- Render cache ---
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lambro-radio", "renders"))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(2 * 1024**3)))
+# Target frequencies are rounded to this many decimals before keying (0.1 Hz is ~0.4 cents at 440 Hz)
+RENDER_CACHE_FREQUENCY_DECIMALS = int(os.environ.get("RENDER_CACHE_FREQUENCY_DECIMALS", "1"))
+
+# --- Decoded PCM cache ---
+# Float32 stereo at 44.1kHz is ~10 MB per minute of audio
+PCM_CACHE_DIR = os.environ.get("PCM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lambro-radio", "pcm"))
+PCM_CACHE_MAX_BYTES = int(os.environ.get("PCM_CACHE_MAX_BYTES", str(2 * 1024**3)))
+
+# --- Waveform peaks cache ---
+# Min/max peaks of each decoded source at several resolutions, ~3 MB per hour of audio
+WAVEFORM_CACHE_DIR = os.environ.get("WAVEFORM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lambro-radio", "waveforms"))
+WAVEFORM_CACHE_MAX_BYTES = int(os.environ.get("WAVEFORM_CACHE_MAX_BYTES", str(256 * 1024**2)))
+# A /waveform cache miss waits this long for the decode, then answers 202 while it carries on in the background
+WAVEFORM_MISS_WAIT_SECONDS = float(os.environ.get("WAVEFORM_MISS_WAIT_SECONDS", "10"))
+
+# --- Audio info cache ---
+# Persistent, shared by all worker processes. SQLite file by default; set a redis:// URL to use Redis instead.
+AUDIO_INFO_CACHE_URL = os.environ.get("AUDIO_INFO_CACHE_URL", "")
+AUDIO_INFO_CACHE_PATH = os.environ.get("AUDIO_INFO_CACHE_PATH", os.path.join(tempfile.gettempdir(), "lambro-radio", "audio_info.sqlite3"))
+# Lifetime of entries whose stream URL carries no `expire=` timestamp
+AUDIO_INFO_DEFAULT_TTL_SECONDS = int(os.environ.get("AUDIO_INFO_DEFAULT_TTL_SECONDS", str(6 * 3600)))
+# Entries stop being served this long before their stream URL expires, leaving time to play the track
+AUDIO_INFO_EXPIRY_MARGIN_SECONDS = int(os.environ.get("AUDIO_INFO_EXPIRY_MARGIN_SECONDS", "900"))
+# Entries this close to that point are still served but refreshed in the background
+AUDIO_INFO_REFRESH_AHEAD_SECONDS = int(os.environ.get("AUDIO_INFO_REFRESH_AHEAD_SECONDS", "1800"))
+
+# --- yt-dlp extraction ---
+# Overall deadline for one /get_audio_info extraction, across all strategies
+EXTRACTION_TIME_BUDGET_SECONDS = float(os.environ.get("EXTRACTION_TIME_BUDGET_SECONDS", "20"))
+# Start the next-best strategy in parallel once the current one has run this long without a
+# result (until per-strategy latencies have been learned)
+EXTRACTION_HEDGE_SECONDS = float(os.environ.get("EXTRACTION_HEDGE_SECONDS", "4"))
+
+# --- Render admission control ---
+# Renders running at once; the rest wait in a bounded queue and get a 503 + Retry-After beyond it
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "0")) or DSP_WORKERS + 1
+RENDER_QUEUE_MAX = int(os.environ.get("RENDER_QUEUE_MAX", "16"))
+RENDER_QUEUE_MAX_WAIT_SECONDS = float(os.environ.get("RENDER_QUEUE_MAX_WAIT_SECONDS", "30"))
+
+# --- Memory bounds ---
+# Output of each in-flight render kept in memory for requests that join it; the rest spills to a temp file
+RENDER_MEMORY_BUDGET_BYTES = int(os.environ.get("RENDER_MEMORY_BUDGET_BYTES", str(32 * 1024**2)))
+RENDER_SPOOL_DIR = os.environ.get("RENDER_SPOOL_DIR") or None  # Defaults to the system temp dir
+# Longest track accepted for rendering (0 = no limit); longer ones are rejected with a 422
+MAX_TRACK_SECONDS = float(os.environ.get("MAX_TRACK_SECONDS", str(3 * 3600)))
+
+# --- Render jobs (POST /jobs) ---
+# "local" runs jobs on in-process worker tasks; "celery" hands them to Celery workers (celery_worker.py),
+# which must share this host's cache and job store directories
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "local").lower()
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "100"))
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "lambro-radio", "jobs.sqlite3"))
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", str(24 * 3600)))
+# Unfinished jobs nobody has renewed for this long (e.g. their worker crashed or restarted) are marked failed
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
+
+# --- Source downloads ---
+# Sources are fetched as parallel HTTP Range segments into a memory-mapped spool file
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "4"))  # Parallel connections per source
+DOWNLOAD_SEGMENT_BYTES = int(os.environ.get("DOWNLOAD_SEGMENT_BYTES", str(1024 * 1024)))
+DOWNLOAD_SEGMENT_RETRIES = int(os.environ.get("DOWNLOAD_SEGMENT_RETRIES", "3"))
+DOWNLOAD_POOL_SIZE = int(os.environ.get("DOWNLOAD_POOL_SIZE", "64"))  # Connections kept open across all sources
+DOWNLOAD_SPOOL_DIR = os.environ.get("DOWNLOAD_SPOOL_DIR") or None  # Defaults to the system temp dir
+
+# --- Speculative prefetch ---
+# After /get_audio_info resolves a stream URL, pre-render these frequencies (Hz) into the render
+# cache while render slots are idle; real requests preempt this work. Off by default.
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+PREFETCH_FREQUENCIES = [float(f) for f in os.environ.get("PREFETCH_FREQUENCIES", "432,528").split(",") if f.strip()]
+PREFETCH_MAX_SOURCES = int(os.environ.get("PREFETCH_MAX_SOURCES", "2"))  # Sources being prefetched at once
+
+# --- Profiling ---
+# Requests sending this token in an X-Debug-Profile header are profiled (see profiler.py); empty disables profiling
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "lambro-radio", "profiles"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))  # Newest profiles kept on disk
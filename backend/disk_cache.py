@@ -0,0 +1,158 @@
+import os
+import stat
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Optional
+
+STALE_PART_SECONDS = 3600  # Temp files this old belong to producers that died with their process
+
+
+class DiskCache:
+    """
+    Size-bounded, content-addressed cache of files on local disk.
+
+    Entries are files named by their key. An entry is written to a private temp file while
+    its producer streams and is only os.replace()d into place once the stream has completed,
+    so readers never see a partial file; concurrent producers of the same key simply race to
+    the same atomic rename. The LRU order lives in memory and is rebuilt from file access
+    times on startup, so the cache survives restarts. Entries other processes commit into the
+    same directory later are indexed the first time they are looked up.
+    """
+
+    def __init__(self, name: str, directory: str, max_bytes: int):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._tmp_directory = os.path.join(directory, "tmp")
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self):
+        """Creates the cache directory and indexes existing entries. Called once at app startup."""
+        os.makedirs(self._tmp_directory, exist_ok=True)
+        now = time.time()
+        for entry in os.scandir(self._tmp_directory):
+            # Other workers may be mid-render into this directory, so only clear out old leftovers
+            if now - entry.stat().st_mtime > STALE_PART_SECONDS:
+                os.remove(entry.path)
+        self._entries.clear()
+        self._total_bytes = 0
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat_result = entry.stat()
+                entries.append((stat_result.st_atime, entry.name, stat_result.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+        print(f"{self.name}: {len(self._entries)} entries, {self._total_bytes} bytes in {self.directory}")
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))  # Readers holding the file open keep their copy
+            except FileNotFoundError:
+                pass
+            print(f"{self.name}: evicted {key} ({size} bytes)")
+
+    def _adopt(self, key: str, path: str) -> bool:
+        """
+        Whether `key` has an entry on disk, indexing it if another process (a second uvicorn
+        worker, a Celery worker) committed it into the shared directory after our load().
+        """
+        if key in self._entries:
+            return os.path.exists(path)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return False
+        if not stat.S_ISREG(stat_result.st_mode):
+            return False
+        size = stat_result.st_size
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+        return key in self._entries
+
+    def lookup(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        if not self._adopt(key, path):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        stat_result = os.stat(path)
+        os.utime(path, (time.time(), stat_result.st_mtime))  # Persist recency without touching mtime (ETag)
+        self.hits += 1
+        return path
+
+    def peek(self, key: str) -> Optional[str]:
+        """Like lookup(), without counting towards hit rates or refreshing the entry's recency."""
+        path = self._path(key)
+        return path if self._adopt(key, path) else None
+
+    def put(self, key: str, data: bytes):
+        """Stores a small entry that is already in memory."""
+        tmp_path = os.path.join(self._tmp_directory, f"{key}.{uuid.uuid4().hex}.part")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        self._commit(key, tmp_path)
+
+    def _commit(self, key: str, tmp_path: str):
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        self._total_bytes += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict()
+
+    async def record(
+        self,
+        key: str,
+        stream: AsyncIterator[Any],
+        to_bytes: Optional[Callable[[Any], bytes]] = None,
+        finalize: Optional[Callable] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Passes `stream` through while teeing it into the cache.
+
+        Items are written as-is, or through `to_bytes` for streams of non-bytes (e.g. arrays).
+        The entry is committed only if the stream runs to completion; `finalize(file, total_bytes)`
+        gets a chance to patch the file first (e.g. to fill in real WAV chunk sizes).
+        """
+        tmp_path = os.path.join(self._tmp_directory, f"{key}.{uuid.uuid4().hex}.part")
+        completed = False
+        total_bytes = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                async for item in stream:
+                    data = item if to_bytes is None else to_bytes(item)
+                    f.write(data)
+                    total_bytes += len(data)
+                    yield item
+                if finalize is not None:
+                    finalize(f, total_bytes)
+            completed = True
+            self._commit(key, tmp_path)
+            print(f"{self.name}: stored {key} ({total_bytes} bytes)")
+        finally:
+            if not completed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            await stream.aclose()
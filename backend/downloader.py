@@ -0,0 +1,216 @@
+import asyncio
+import mmap
+import re
+import tempfile
+import time
+from typing import AsyncIterator, Optional
+
+import aiohttp
+from fastapi import HTTPException
+
+import config
+from metrics import BYTES_IN, DOWNLOAD_SECONDS
+
+READ_CHUNK_BYTES = 64 * 1024
+MAX_YIELD_BYTES = 1024 * 1024  # Upper bound on one chunk handed to the consumer
+CONTENT_RANGE_TOTAL = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+class _RetryableSegmentError(Exception):
+    pass
+
+
+class _Spool:
+    """
+    A source being downloaded as parallel Range segments into a memory-mapped temp file.
+
+    Segments are written wherever they land; the reader consumes the file strictly in order,
+    up to the end of the contiguous downloaded prefix, and waits when it catches up.
+    """
+
+    def __init__(self, total_size: int, segment_bytes: int, spool_dir: Optional[str]):
+        self.total_size = total_size
+        self.segments = [(start, min(start + segment_bytes, total_size)) for start in range(0, total_size, segment_bytes)]
+        self.filled = [0] * len(self.segments)
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._file = tempfile.TemporaryFile(dir=spool_dir)  # Unlinked already; gone once closed
+        self._file.truncate(total_size)
+        self._map = mmap.mmap(self._file.fileno(), total_size)
+        self._next_segment = 0
+        self._read_segment = 0
+
+    def claim_segment(self) -> Optional[int]:
+        if self._next_segment >= len(self.segments):
+            return None
+        index = self._next_segment
+        self._next_segment += 1
+        return index
+
+    def write(self, index: int, data: bytes):
+        start, _ = self.segments[index]
+        offset = start + self.filled[index]
+        self._map[offset:offset + len(data)] = data
+        self.filled[index] += len(data)
+        self.notify()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def fail(self, error: BaseException):
+        if self.error is None:
+            self.error = error
+        self.notify()
+
+    def _contiguous_end(self) -> int:
+        while self._read_segment < len(self.segments):
+            start, end = self.segments[self._read_segment]
+            if start + self.filled[self._read_segment] < end:
+                return start + self.filled[self._read_segment]
+            self._read_segment += 1
+        return self.total_size
+
+    async def read(self) -> AsyncIterator[bytes]:
+        position = 0
+        while position < self.total_size:
+            changed = self._changed
+            end = min(self._contiguous_end(), position + MAX_YIELD_BYTES)
+            if end > position:
+                yield self._map[position:end]
+                position = end
+                continue
+            if self.error is not None:
+                raise self.error
+            await changed.wait()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class SourceDownloader:
+    """
+    Fetches source audio over an app-lifetime connection pool.
+
+    Sources larger than one segment are split into `segment_bytes` HTTP Range requests that run
+    over `connections` parallel connections (googlevideo throttles each connection, not the
+    client), each retried from where it broke off up to `retries` times. Segments land in a
+    memory-mapped spool file that stream() reads back in order, so the decoder starts on the
+    first segment while the rest are still downloading. Servers that ignore Range get a plain
+    single-connection stream.
+    """
+
+    def __init__(self, connections: int, segment_bytes: int, retries: int, pool_size: int, spool_dir: Optional[str] = None):
+        self.connections = connections
+        self.segment_bytes = segment_bytes
+        self.retries = retries
+        self.pool_size = pool_size
+        self.spool_dir = spool_dir
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        # A session belongs to one event loop (Celery workers run each job in a fresh one)
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300, enable_cleanup_closed=True)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._loop = loop
+        return self._session
+
+    async def start(self):
+        self.session()
+        print(f"Source downloader: {self.connections} connections per source, {self.segment_bytes // 1024} KiB segments")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def stream(self, url: str) -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        chunks = self._stream(url)
+        try:
+            async for chunk in chunks:
+                BYTES_IN.inc(len(chunk))
+                yield chunk
+            DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            await chunks.aclose()
+
+    async def _stream(self, url: str) -> AsyncIterator[bytes]:
+        session = self.session()
+        ranged = self.connections > 1
+        first = await session.get(url, headers={"Range": f"bytes=0-{self.segment_bytes - 1}"} if ranged else None)
+        try:
+            if first.status not in (200, 206):
+                raise HTTPException(status_code=first.status, detail=f"Failed to fetch audio: {url}")
+            match = CONTENT_RANGE_TOTAL.match(first.headers.get("Content-Range", ""))
+            total_size = int(match.group(1)) if ranged and first.status == 206 and match else None
+            if total_size is None or total_size <= self.segment_bytes:
+                # Whole file in this response (or no Range support): just stream it
+                async for chunk in first.content.iter_chunked(READ_CHUNK_BYTES):
+                    yield chunk
+                return
+
+            spool = _Spool(total_size, self.segment_bytes, self.spool_dir)
+            spool.claim_segment()  # Segment 0 is the response we already have
+            workers = [asyncio.create_task(self._segment_worker(session, url, spool, first_response=first))]
+            workers += [asyncio.create_task(self._segment_worker(session, url, spool)) for _ in range(self.connections - 1)]
+            try:
+                async for chunk in spool.read():
+                    yield chunk
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                spool.close()
+        finally:
+            first.release()
+
+    async def _segment_worker(self, session: aiohttp.ClientSession, url: str, spool: _Spool, first_response: Optional[aiohttp.ClientResponse] = None):
+        try:
+            if first_response is not None:
+                await self._fetch_segment(session, url, spool, 0, first_response)
+            while (index := spool.claim_segment()) is not None:
+                await self._fetch_segment(session, url, spool, index)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            spool.fail(e)
+
+    async def _fetch_segment(self, session: aiohttp.ClientSession, url: str, spool: _Spool, index: int, response: Optional[aiohttp.ClientResponse] = None):
+        start, end = spool.segments[index]
+        for attempt in range(self.retries + 1):
+            try:
+                if response is None:
+                    # Resume from whatever the previous attempt got
+                    response = await session.get(url, headers={"Range": f"bytes={start + spool.filled[index]}-{end - 1}"})
+                async with response:
+                    if response.status != 206:
+                        if response.status < 500:
+                            raise HTTPException(status_code=502, detail=f"Range request for audio failed with {response.status}: {url}")
+                        raise _RetryableSegmentError(f"HTTP {response.status}")
+                    async for chunk in response.content.iter_chunked(READ_CHUNK_BYTES):
+                        spool.write(index, chunk[:end - start - spool.filled[index]])
+                if start + spool.filled[index] >= end:
+                    return
+                raise _RetryableSegmentError("connection closed early")
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableSegmentError) as e:
+                response = None
+                if attempt == self.retries:
+                    raise HTTPException(status_code=502, detail=f"Downloading audio failed after {self.retries + 1} attempts ({e}): {url}")
+                print(f"Source downloader: segment {index} attempt {attempt + 1} failed ({e}), retrying")
+                await asyncio.sleep(0.25 * 2 ** attempt)
+
+
+# Process-wide downloader; its connection pool is opened and closed by the app lifespan in main.py
+source_downloader = SourceDownloader(
+    connections=config.DOWNLOAD_CONNECTIONS,
+    segment_bytes=config.DOWNLOAD_SEGMENT_BYTES,
+    retries=config.DOWNLOAD_SEGMENT_RETRIES,
+    pool_size=config.DOWNLOAD_POOL_SIZE,
+    spool_dir=config.DOWNLOAD_SPOOL_DIR,
+)
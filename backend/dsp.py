@@ -0,0 +1,353 @@
+import asyncio
+import math
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from pedalboard import Pedalboard, PitchShift, Resample
+from pedalboard.io import StreamResampler
+
+from dsp_executor import DSPExecutor, SharedBlockBuffer, dsp_executor
+
+
+def calculate_pitch_factor(target_hz: Optional[float], base_hz: float = 440.0) -> Optional[float]:
+    if target_hz is None or target_hz <= 0 or base_hz <= 0:
+        return None # No change
+    return target_hz / base_hz
+
+
+def needs_pitch_shift(pitch_factor: Optional[float]) -> bool:
+    return pitch_factor is not None and abs(pitch_factor - 1.0) > 1e-4
+
+
+class PCM16Converter:
+    """
+    Converts (frames, channels) float32 blocks to interleaved little-endian PCM_16 bytes.
+
+    Clipping, scaling and the integer cast all run in place on buffers reused across blocks,
+    so the only allocation per block is the bytes object handed to the response.
+    """
+
+    def __init__(self):
+        self._scaled: Optional[np.ndarray] = None
+        self._pcm: Optional[np.ndarray] = None
+
+    def __call__(self, block: np.ndarray) -> bytes:
+        frames = len(block)
+        if self._scaled is None or len(self._scaled) < frames or self._scaled.shape[1:] != block.shape[1:]:
+            self._scaled = np.empty(block.shape, dtype=np.float32)
+            self._pcm = np.empty(block.shape, dtype='<i2')
+        scaled = self._scaled[:frames]
+        pcm = self._pcm[:frames]
+        np.clip(block, -1.0, 1.0, out=scaled)
+        scaled *= 32767.0
+        np.copyto(pcm, scaled, casting='unsafe')  # Truncates toward zero, like astype()
+        return pcm.tobytes()
+
+
+def pitch_shift_block(block: np.ndarray, semitones: float, sample_rate: float) -> np.ndarray:
+    """
+    Pitch shifts a (frames, channels) block in one go. Runs inside DSP workers.
+
+    A fresh board is built per call (a few microseconds) so that concurrent calls in
+    thread mode never share plugin state.
+    """
+    board = Pedalboard([PitchShift(semitones=semitones)])
+    # Pedalboard expects (num_channels, num_samples)
+    return board(block.T, sample_rate=sample_rate).T
+
+
+class BlockPitchShifter:
+    """
+    Pitch shifts an audio stream block by block.
+
+    Pedalboard's PitchShift drops out when it is fed blocks shorter than its internal latency
+    with reset=False, so each block is rendered with reset=True instead. To hide the block
+    seams, the shifter carries state between calls:
+      - the last `context_frames` of input, prepended to the next block so the phase vocoder
+        is warmed up by the time it reaches new samples, and
+      - the last `crossfade_frames` of rendered output, which is crossfaded into the start of
+        the next block.
+    Output therefore lags input by `crossfade_frames`; call flush() once the input is exhausted.
+    Whatever is carried over is copied, since input blocks may be buffers an earlier stage reuses.
+    Blocks are (frames, channels) float32, as produced by the decoder. The rendering itself
+    runs on the DSP executor, so the event loop stays free while a block is being shifted.
+    """
+
+    def __init__(self, pitch_factor: float, sample_rate: int, executor: DSPExecutor = dsp_executor, context_frames: int = 8192, crossfade_frames: int = 1024):
+        self.sample_rate = float(sample_rate)
+        self.semitones = 12 * math.log2(pitch_factor)
+        self.executor = executor
+        self.context_frames = context_frames
+        self.crossfade_frames = crossfade_frames
+        self._buffer = SharedBlockBuffer()
+        self._context: Optional[np.ndarray] = None
+        self._pending: Optional[np.ndarray] = None
+        self._tail: Optional[np.ndarray] = None
+        self._fade_in: Optional[np.ndarray] = None
+        self._channels = 2
+
+    def _crossfade(self, out: np.ndarray) -> np.ndarray:
+        if self._tail is None:
+            return out
+        k = min(len(self._tail), len(out))
+        if k == 0:
+            return out
+        if self._fade_in is None or len(self._fade_in) != k:
+            self._fade_in = np.linspace(0.0, 1.0, k, dtype=np.float32)[:, None]
+        out[:k] = self._tail[:k] * (1.0 - self._fade_in) + out[:k] * self._fade_in
+        return out
+
+    async def _emit(self, buf: np.ndarray, emit_frames: int) -> np.ndarray:
+        context_len = 0 if self._context is None else len(self._context)
+        window = buf if self._context is None else np.concatenate((self._context, buf))
+        rendered = await self.executor.run(pitch_shift_block, np.ascontiguousarray(window, dtype=np.float32), self.semitones, self.sample_rate, buffer=self._buffer)
+        seg = rendered[context_len:]
+        out = self._crossfade(seg[:emit_frames])
+        self._tail = seg[emit_frames:emit_frames + self.crossfade_frames]
+        self._context = window[:context_len + emit_frames][-self.context_frames:].copy()
+        return out
+
+    async def process(self, block: np.ndarray) -> np.ndarray:
+        self._channels = block.shape[1]
+        buf = block if self._pending is None else np.concatenate((self._pending, block))
+        emit_frames = len(buf) - self.crossfade_frames
+        if emit_frames <= 0:
+            self._pending = buf.copy()
+            return buf[:0]
+        out = await self._emit(buf, emit_frames)
+        self._pending = buf[emit_frames:].copy()
+        return out
+
+    async def flush(self) -> np.ndarray:
+        pending = self._pending
+        self._pending = None
+        if pending is None or len(pending) == 0:
+            return np.zeros((0, self._channels), dtype=np.float32)
+        out = await self._emit(pending, len(pending))
+        self._tail = None
+        return out
+
+    def close(self):
+        self._buffer.close()
+
+
+class BlockVarispeed:
+    """
+    The "fast" pitch-shift tier: varispeed, i.e. resampling, like playing a tape faster or slower.
+
+    The stream is treated as if it had been recorded at `sample_rate * pitch_factor` and
+    resampled to `sample_rate` with Pedalboard's streaming windowed-sinc resampler (16 taps,
+    clean up to ~12 kHz), so the pitch moves by exactly `pitch_factor` while the tempo moves
+    with it; for our ratios (432/440 is 1.8%) that is barely noticeable. There is no phase
+    vocoder, so no smearing of transients either. The output is 1/pitch_factor times as long
+    as the input, so frames no longer line up with source frames. The resampler releases the
+    GIL, so blocks run on a thread to keep the event loop free.
+    """
+
+    def __init__(self, pitch_factor: float, sample_rate: int, channels: int = 2):
+        self._resampler = StreamResampler(sample_rate * pitch_factor, sample_rate, channels, Resample.Quality.WindowedSinc16)
+        self._channels = channels
+
+    async def process(self, block: np.ndarray) -> np.ndarray:
+        out = await asyncio.to_thread(self._resampler.process, np.ascontiguousarray(block.T, dtype=np.float32))
+        return out.T
+
+    async def flush(self) -> np.ndarray:
+        return (await asyncio.to_thread(self._resampler.process)).T.reshape(-1, self._channels)
+
+    def close(self):
+        pass
+
+
+class BlockRubberBand:
+    """
+    The "high" pitch-shift tier: the Rubber Band library at its highest pitch quality
+    (`pitchq=quality`, channels processed together so the stereo image holds).
+
+    Rubber Band runs inside a streaming ffmpeg subprocess (ffmpeg's librubberband filter), so
+    it keeps its state across blocks with no seams to hide and does its work off the event
+    loop and outside our process. process() hands ffmpeg a block and returns whatever output
+    is ready so far; flush() drains the rest. Output is the same length as the input.
+    """
+
+    def __init__(self, pitch_factor: float, sample_rate: int, channels: int = 2):
+        self.pitch_factor = pitch_factor
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._stderr_reader: Optional[asyncio.Task] = None
+        self._output = bytearray()
+
+    async def _start(self):
+        self._process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'f32le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', 'pipe:0',
+            '-af', f"rubberband=pitch={self.pitch_factor:.10f}:pitchq=quality:channels=together",
+            '-f', 'f32le', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read_output())
+        self._stderr_reader = asyncio.create_task(self._process.stderr.read())
+
+    async def _read_output(self):
+        while True:
+            chunk = await self._process.stdout.read(256 * 1024)
+            if not chunk:
+                break
+            self._output += chunk
+
+    def _take_output(self) -> np.ndarray:
+        usable = len(self._output) - len(self._output) % (4 * self.channels)
+        out = np.frombuffer(bytes(self._output[:usable]), dtype=np.float32).reshape(-1, self.channels)
+        del self._output[:usable]
+        return out
+
+    async def process(self, block: np.ndarray) -> np.ndarray:
+        if self._process is None:
+            await self._start()
+        self._process.stdin.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        await self._process.stdin.drain()
+        return self._take_output()
+
+    async def flush(self) -> np.ndarray:
+        if self._process is None:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        self._process.stdin.close()
+        await self._reader
+        returncode = await self._process.wait()
+        if returncode != 0:
+            stderr_str = (await self._stderr_reader).decode(errors='ignore').strip()
+            print(f"ffmpeg rubberband stderr:\n{stderr_str}")
+            raise HTTPException(status_code=500, detail=f"Pitch shifting failed (ffmpeg code {returncode})")
+        return self._take_output()
+
+    def close(self):
+        for task in (self._reader, self._stderr_reader):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+
+
+class BlockEcho:
+    """
+    Feed-forward echo over a stream of (frames, channels) float32 blocks.
+
+    Same arithmetic as ffmpeg's aecho with a single tap,
+    out = (in * in_gain + in[t - delay] * decay) * out_gain, so it matches the old
+    `aecho=in_gain:out_gain:delay_ms:decay` preset to float32 rounding. Input runs through a
+    preallocated delay line and the result is written into a reused output buffer, which is
+    only valid until the next call. flush() returns the echo tail that rings on after the
+    input ends (as aecho does). Cheap enough to run inline on the event loop.
+    """
+
+    def __init__(self, in_gain: float, out_gain: float, delay_ms: float, decay: float, sample_rate: int, channels: int = 2):
+        self.in_gain = np.float32(in_gain)
+        self.out_gain = np.float32(out_gain)
+        self.decay = np.float32(decay)
+        self.delay_frames = int(delay_ms * sample_rate / 1000.0)  # Truncated, like aecho
+        self.channels = channels
+        self._line = np.zeros((self.delay_frames, channels), dtype=np.float32)  # History, then the current block
+        self._out = np.empty((0, channels), dtype=np.float32)
+        self._echo = np.empty((0, channels), dtype=np.float32)
+
+    def _reserve(self, frames: int):
+        if len(self._out) >= frames:
+            return
+        line = np.zeros((self.delay_frames + frames, self.channels), dtype=np.float32)
+        line[:self.delay_frames] = self._line[:self.delay_frames]
+        self._line = line
+        self._out = np.empty((frames, self.channels), dtype=np.float32)
+        self._echo = np.empty((frames, self.channels), dtype=np.float32)
+
+    async def process(self, block: np.ndarray) -> np.ndarray:
+        frames = len(block)
+        delay = self.delay_frames
+        self._reserve(frames)
+        self._line[delay:delay + frames] = block
+        out = self._out[:frames]
+        echo = self._echo[:frames]
+        np.multiply(block, self.in_gain, out=out)
+        np.multiply(self._line[:frames], self.decay, out=echo)
+        out += echo
+        out *= self.out_gain
+        self._line[:delay] = self._line[frames:frames + delay]  # Slide the history (overlap-safe)
+        return out
+
+    async def flush(self) -> np.ndarray:
+        tail = self._line[:self.delay_frames] * self.decay * self.out_gain
+        self._line[:self.delay_frames] = 0.0
+        return tail
+
+    def close(self):
+        pass
+
+
+# Effects a ProcessingGraph can be compiled from: name -> factory(sample_rate, channels, **params)
+EFFECTS = {
+    "echo": lambda sample_rate, channels, **params: BlockEcho(**params, sample_rate=sample_rate, channels=channels),
+    "pitch_shift": lambda sample_rate, channels, pitch_factor: BlockPitchShifter(pitch_factor, sample_rate),
+    "varispeed": lambda sample_rate, channels, pitch_factor: BlockVarispeed(pitch_factor, sample_rate, channels),
+    "rubberband": lambda sample_rate, channels, pitch_factor: BlockRubberBand(pitch_factor, sample_rate, channels),
+}
+
+# Pitch-shift quality tiers (the `quality` request parameter) -> the effect implementing them.
+# Throughput of each is measured by benchmark_pitch_tiers.py; see DEPLOYMENT.md.
+PITCH_SHIFT_QUALITIES = {
+    "fast": "varispeed",  # Resampling: exact pitch, tempo changes with it, cheapest
+    "standard": "pitch_shift",  # Pedalboard's phase vocoder, block by block on the DSP executor
+    "high": "rubberband",  # Rubber Band at its finest settings, via ffmpeg
+}
+
+
+class ProcessingGraph:
+    """
+    The per-request effect chain, compiled from a declarative list of (effect, params).
+
+    Every stage is a streaming block processor with the same interface, async process(block)
+    and flush() plus close(), so each decoded block passes through the whole chain once,
+    while it is still hot in cache, instead of the track going through one full-length pass
+    per effect. Stages may reuse their output buffers: a block returned by process() is only
+    valid until the next call. New effects plug in by adding a factory to EFFECTS.
+    """
+
+    def __init__(self, stages: list):
+        self.stages = stages
+
+    @classmethod
+    def compile(cls, effects: list[tuple[str, dict]], sample_rate: int, channels: int) -> "ProcessingGraph":
+        stages = []
+        for name, params in effects:
+            if name not in EFFECTS:
+                raise ValueError(f"Unknown effect '{name}'")
+            stages.append(EFFECTS[name](sample_rate, channels, **params))
+        return cls(stages)
+
+    async def process(self, block: np.ndarray) -> np.ndarray:
+        for stage in self.stages:
+            if not len(block):
+                break
+            block = await stage.process(block)
+        return block
+
+    async def flush(self) -> AsyncIterator[np.ndarray]:
+        """Drains the chain: each stage's tail is fed through the stages after it before they flush."""
+        for i, stage in enumerate(self.stages):
+            block = await stage.flush()
+            for later in self.stages[i + 1:]:
+                if not len(block):
+                    break
+                block = await later.process(block)
+            if len(block):
+                yield block
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+import config
+
+
+def _run_on_shared_block(func: Callable[..., np.ndarray], shm_name: str, shape: tuple, dtype: str, args: tuple):
+    """Worker-side half of DSPExecutor.run: processes a block in place inside a shared memory segment."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = None
+    try:
+        block = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        block[...] = func(block, *args)
+    finally:
+        del block  # The segment cannot be closed while a view into it is alive
+        shm.close()
+
+
+def _warm_up():
+    """Imports the DSP stack in a fresh worker so the first real block doesn't pay for it."""
+    import dsp  # noqa: F401
+
+
+class SharedBlockBuffer:
+    """
+    A shared memory segment reused for every block of one stream.
+
+    Grows (by reallocating) when a larger block comes along; otherwise the same segment is
+    handed to the workers over and over, so a stream costs one allocation rather than one per block.
+    """
+
+    def __init__(self):
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    def view(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self._shm is None or self._shm.size < nbytes:
+            self.close()
+            self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class DSPExecutor:
+    """
+    Runs CPU-bound DSP stages off the event loop.
+
+    `run(func, block, *args)` calls `func(block, *args)` in a worker and returns its result.
+    `func` must be a module-level function (so it can be referenced from another process)
+    that returns an array of the same shape and dtype as `block`.
+
+    In "process" mode blocks never get pickled: they are copied into a SharedBlockBuffer and
+    processed in place by the worker. In "thread" mode the function is simply run in a thread pool.
+    """
+
+    def __init__(self, mode: str = config.DSP_EXECUTOR, workers: int = config.DSP_WORKERS):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unknown DSP executor mode: {mode!r} (expected 'process' or 'thread')")
+        self.mode = mode
+        self.workers = workers
+        self._pool: Optional[Executor] = None
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.mode == "process":
+            # spawn: workers must not inherit the event loop and its threads
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            for _ in range(self.workers):
+                self._pool.submit(_warm_up)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dsp")
+        print(f"DSP executor started: {self.workers} {self.mode} worker(s)")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def worker_pids(self) -> list[int]:
+        """PIDs of the pool's worker processes, in the order they were started (none in thread mode)."""
+        if self.mode != "process" or self._pool is None:
+            return []
+        return [process.pid for process in list(self._pool._processes.values())]
+
+    async def run(self, func: Callable[..., np.ndarray], block: np.ndarray, *args: Any, buffer: Optional[SharedBlockBuffer] = None) -> np.ndarray:
+        self.start()
+        loop = asyncio.get_running_loop()
+        if self.mode == "thread":
+            return await loop.run_in_executor(self._pool, func, block, *args)
+
+        owns_buffer = buffer is None
+        buffer = buffer or SharedBlockBuffer()
+        shared = None
+        try:
+            shared = buffer.view(block.shape, block.dtype)
+            shared[...] = block
+            await loop.run_in_executor(self._pool, _run_on_shared_block, func, buffer.name, block.shape, block.dtype.str, args)
+            return shared.copy()
+        finally:
+            del shared  # Release the view so the buffer can be resized or closed
+            if owns_buffer:
+                buffer.close()
+
+
+# Process-wide executor; started by the app lifespan in main.py
+dsp_executor = DSPExecutor()
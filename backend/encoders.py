@@ -0,0 +1,161 @@
+import asyncio
+from typing import NamedTuple, Optional
+
+import numpy as np
+from fastapi import HTTPException
+
+from streaming import OUTPUT_CHANNELS, OUTPUT_SAMPLE_RATE
+
+
+class OutputFormat(NamedTuple):
+    name: str
+    media_type: str
+    codec: Optional[str]  # ffmpeg encoder; None for the in-process WAV path
+    container: Optional[str]  # ffmpeg muxer; all of these can be written to a pipe
+    default_bitrate_kbps: Optional[int]  # None for lossless formats
+
+
+OUTPUT_FORMATS = {
+    "wav": OutputFormat("wav", "audio/wav", None, None, None),
+    "opus": OutputFormat("opus", "audio/ogg", "libopus", "ogg", 96),
+    "aac": OutputFormat("aac", "audio/aac", "aac", "adts", 160),
+    "mp3": OutputFormat("mp3", "audio/mpeg", "libmp3lame", "mp3", 192),
+    "flac": OutputFormat("flac", "audio/flac", "flac", "flac", None),
+}
+
+# Media types clients may put in Accept, mapped to the format that satisfies them
+ACCEPT_MEDIA_TYPES = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav", "audio/vnd.wave": "wav",
+    "audio/ogg": "opus", "audio/opus": "opus",
+    "audio/aac": "aac", "audio/mp4": "aac", "audio/x-m4a": "aac",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+    "audio/flac": "flac", "audio/x-flac": "flac",
+    "audio/*": "wav", "*/*": "wav",  # Anything goes, so the default
+}
+
+MIN_BITRATE_KBPS = 32
+MAX_BITRATE_KBPS = 320
+
+
+def negotiate_output_format(requested: Optional[str], accept_header: Optional[str]) -> OutputFormat:
+    """
+    Picks the output format: an explicit `output_format` payload field wins, then the
+    highest-q audio type in the Accept header (the first listed on a tie), then WAV (what
+    every client got before).
+    """
+    if requested:
+        output_format = OUTPUT_FORMATS.get(str(requested).lower())
+        if output_format is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported output_format '{requested}'. Supported: {', '.join(OUTPUT_FORMATS)}")
+        return output_format
+
+    best_name, best_q = None, 0.0
+    for entry in (accept_header or "").split(","):
+        media_type, *params = [part.strip() for part in entry.split(";")]
+        name = ACCEPT_MEDIA_TYPES.get(media_type.lower())
+        if name is None:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best_name, best_q = name, q
+    return OUTPUT_FORMATS[best_name or "wav"]
+
+
+def resolve_bitrate(output_format: OutputFormat, bitrate_kbps) -> Optional[int]:
+    if output_format.default_bitrate_kbps is None:
+        return None  # Lossless; any requested bitrate is meaningless
+    if bitrate_kbps is None:
+        return output_format.default_bitrate_kbps
+    try:
+        bitrate = int(bitrate_kbps)
+    except (ValueError, TypeError):
+        bitrate = 0
+    if not MIN_BITRATE_KBPS <= bitrate <= MAX_BITRATE_KBPS:
+        raise HTTPException(status_code=400, detail=f"Invalid bitrate_kbps. Must be between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS}.")
+    return bitrate
+
+
+class StreamEncoder:
+    """
+    Encodes a stream of float32 blocks with an ffmpeg subprocess, block by block.
+
+    encode() hands a block to ffmpeg and returns whatever encoded bytes are ready so far
+    (possibly none, encoders have some lookahead); finish() flushes the rest. A reader task
+    drains ffmpeg's stdout continuously so neither pipe can deadlock.
+    """
+
+    def __init__(self, output_format: OutputFormat, bitrate_kbps: Optional[int], sample_rate: int = OUTPUT_SAMPLE_RATE, channels: int = OUTPUT_CHANNELS):
+        self.output_format = output_format
+        self.bitrate_kbps = bitrate_kbps
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._stderr_reader: Optional[asyncio.Task] = None
+        self._output: list[bytes] = []
+
+    async def _start(self):
+        command = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'f32le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', 'pipe:0',
+            '-c:a', self.output_format.codec,
+        ]
+        if self.bitrate_kbps:
+            command += ['-b:a', f"{self.bitrate_kbps}k"]
+        command += ['-f', self.output_format.container, 'pipe:1']
+        self._process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read_output())
+        self._stderr_reader = asyncio.create_task(self._process.stderr.read())
+
+    async def _read_output(self):
+        while True:
+            chunk = await self._process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            self._output.append(chunk)
+
+    def _take_output(self) -> bytes:
+        data = b"".join(self._output)
+        self._output.clear()
+        return data
+
+    async def encode(self, block: np.ndarray) -> bytes:
+        if self._process is None:
+            await self._start()
+        self._process.stdin.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+        await self._process.stdin.drain()
+        return self._take_output()
+
+    async def finish(self) -> bytes:
+        if self._process is None:
+            await self._start()
+        self._process.stdin.close()
+        await self._reader
+        returncode = await self._process.wait()
+        if returncode != 0:
+            stderr_str = (await self._stderr_reader).decode(errors='ignore').strip()
+            print(f"ffmpeg encoder stderr:\n{stderr_str}")
+            raise HTTPException(status_code=500, detail=f"Audio encoding failed (ffmpeg code {returncode})")
+        return self._take_output()
+
+    async def close(self):
+        for task in (self._reader, self._stderr_reader):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+            await self._process.wait()
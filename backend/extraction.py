@@ -0,0 +1,269 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import yt_dlp
+
+import config
+
+LATENCY_SMOOTHING = 0.3  # EWMA weight of the newest attempt
+MAX_IDLE_EXTRACTORS = 2  # Warm YoutubeDL instances kept per strategy
+
+
+def _proxy_url() -> Optional[str]:
+    # Proxy configuration for bypassing IP blocks (for cloud hosting environments)
+    proxy_url = os.environ.get('PROXY_URL')
+    if proxy_url and os.environ.get('PROXY_USER') and os.environ.get('PROXY_PASS'):
+        return f"http://{os.environ.get('PROXY_USER')}:{os.environ.get('PROXY_PASS')}@{proxy_url.replace('http://', '')}"
+    return proxy_url
+
+
+def build_strategies() -> list["Strategy"]:
+    """The yt-dlp configurations to try, in their default order of preference."""
+    # See https://github.com/yt-dlp/yt-dlp#format-selection-examples for format selection
+    # We want a direct audio URL, preferring opus or aac (m4a).
+    # 'bestaudio[ext=opus]/bestaudio[ext=m4a]/bestaudio/best' should prioritize these.
+    # If yt-dlp has to extract, it will be slower, but this aims for direct links.
+    enhanced = {
+        'format': 'bestaudio[ext=opus]/bestaudio[ext=m4a]/bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'discard_in_playlist',
+        # Anti-bot detection bypass options
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'referer': 'https://www.youtube.com/',
+        'http_headers': {
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'none',
+            'Sec-Fetch-User': '?1',
+            'Cache-Control': 'max-age=0',
+        },
+        'proxy': _proxy_url(),
+        # YouTube-specific options for better compatibility
+        'extractor_args': {
+            'youtube': {
+                'skip': ['hls', 'dash'],  # Skip adaptive formats that might be harder to access
+                'player_client': ['android_creator', 'android_music', 'android', 'web'],  # Try different player clients in order
+                'player_skip': ['configs'],  # Skip player config checks
+                'innertube_host': 'studio.youtube.com',  # Use alternate API host
+                'innertube_key': None,  # Let yt-dlp auto-detect
+                'po_token': None,  # Proof of origin token (auto-detect)
+                'visitor_data': None,  # Visitor data (auto-detect)
+            }
+        },
+        # Additional bypass options
+        'force_json': False,
+        'simulate': False,
+        'listformats': False,
+        # A single quick retry: falling over to another strategy (or racing one) is cheaper than
+        # retrying the same one, and the engine's time budget bounds the total anyway
+        'retries': 1,
+        'extractor_retries': 1,
+        'file_access_retries': 1,
+        # Additional headers and options
+        'cookiefile': None,  # No cookies initially
+        'age_limit': None,   # No age limit
+        'geo_bypass': True,  # Try to bypass geo-restrictions
+        'geo_bypass_country': 'US',  # Pretend to be from US
+    }
+    minimal = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android_creator'],  # Often works when others fail
+            }
+        },
+        'user_agent': 'com.google.android.youtube/19.09.36 (Linux; U; Android 11) gzip',  # Android YouTube app
+    }
+    web = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['web'],
+            }
+        },
+    }
+    return [Strategy("enhanced", enhanced), Strategy("android", minimal), Strategy("web", web)]
+
+
+class StrategyStats:
+    """Running success rate and attempt latency of one strategy."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.latency_ewma: Optional[float] = None
+
+    def record(self, ok: bool, seconds: float):
+        self.attempts += 1
+        self.successes += ok
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += LATENCY_SMOOTHING * (seconds - self.latency_ewma)
+
+    @property
+    def success_rate(self) -> float:
+        # Laplace prior: an untried strategy counts as 50%, a single failure doesn't write it off
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def expected_seconds(self, default_latency: float) -> float:
+        """Expected time until this strategy produces a result, counting failed attempts."""
+        latency = self.latency_ewma if self.latency_ewma is not None else default_latency
+        return latency / self.success_rate
+
+    def as_dict(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "success_rate": round(self.success_rate, 3),
+            "latency_ewma_seconds": None if self.latency_ewma is None else round(self.latency_ewma, 3),
+        }
+
+
+class Strategy:
+    """A yt-dlp configuration plus a pool of warm YoutubeDL instances built from it."""
+
+    def __init__(self, name: str, options: dict):
+        self.name = name
+        self.options = options
+        self.stats = StrategyStats()
+        self._idle: list[yt_dlp.YoutubeDL] = []
+        self._lock = threading.Lock()
+
+    def _borrow(self) -> yt_dlp.YoutubeDL:
+        # YoutubeDL instances are not thread-safe, so each concurrent extraction gets its own
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return yt_dlp.YoutubeDL(self.options)
+
+    def _release(self, ydl: yt_dlp.YoutubeDL):
+        with self._lock:
+            if len(self._idle) < MAX_IDLE_EXTRACTORS:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+    def warm_up(self):
+        self._release(self._borrow())
+
+    def extract(self, url: str) -> Optional[dict]:
+        """Blocking; runs on a worker thread. Stats are recorded here so abandoned (raced) attempts still count."""
+        ydl = self._borrow()
+        start = time.perf_counter()
+        ok = False
+        try:
+            info = ydl.extract_info(url, download=False)
+            ok = bool(info)
+            return info
+        finally:
+            self.stats.record(ok, time.perf_counter() - start)
+            self._release(ydl)
+
+
+class ExtractionEngine:
+    """
+    Runs yt-dlp extraction across several strategies, fastest-expected first.
+
+    Strategies are ranked by expected time to a result (attempt latency divided by success
+    rate, both learned from live traffic). The best one starts immediately; if it fails, or is
+    still running after the hedge delay (about twice its usual latency), the next one is
+    started alongside it and whichever succeeds first wins. Everything is bounded by one
+    overall time budget rather than per-strategy sleeps and retries. yt-dlp calls can't be
+    interrupted, so losing attempts finish in the background and only update the stats.
+    """
+
+    def __init__(self, strategies: list[Strategy], time_budget: float, hedge_delay: float):
+        self.strategies = strategies
+        self.time_budget = time_budget
+        self.hedge_delay = hedge_delay
+
+    def ranked(self) -> list[Strategy]:
+        # sorted() is stable, so untried strategies keep their configured order
+        return sorted(self.strategies, key=lambda s: s.stats.expected_seconds(self.hedge_delay))
+
+    def _hedge_after(self, strategy: Strategy) -> float:
+        if strategy.stats.latency_ewma is None:
+            return self.hedge_delay
+        return min(max(2 * strategy.stats.latency_ewma, 1.0), self.hedge_delay * 2)
+
+    async def warm_up(self):
+        """Builds one extractor per strategy (loads yt-dlp's extractor classes) off the event loop."""
+        if self.strategies and self.strategies[0].options.get('proxy'):
+            print(f"Using proxy: {self.strategies[0].options['proxy']}")
+        for strategy in self.strategies:
+            await asyncio.to_thread(strategy.warm_up)
+        print(f"Extraction engine: {len(self.strategies)} strategies warmed up")
+
+    async def extract(self, url: str) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.time_budget
+        order = self.ranked()
+        running: dict[asyncio.Future, Strategy] = {}
+        error_messages = []
+
+        def launch():
+            strategy = order[len(error_messages) + len(running)]
+            print(f"Attempting extraction strategy '{strategy.name}' ({strategy.stats.success_rate:.0%} success, {len(running)} already running)...")
+            future = asyncio.ensure_future(asyncio.to_thread(strategy.extract, url))
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())  # Losers are never awaited
+            running[future] = strategy
+
+        launch()
+        while running:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            launched = len(error_messages) + len(running)
+            timeout = remaining if launched >= len(order) else min(remaining, self._hedge_after(order[launched - 1]))
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                strategy = running.pop(future)
+                try:
+                    info = future.result()
+                except Exception as e:
+                    error_msg = f"Strategy '{strategy.name}' failed: {str(e)}"
+                    print(error_msg)
+                    error_messages.append(error_msg)
+                    continue
+                if info:
+                    print(f"Strategy '{strategy.name}' succeeded!")
+                    return info
+                error_messages.append(f"Strategy '{strategy.name}' returned no info")
+            # Everything in `done` failed: replace each failed attempt, or hedge if the leader is just slow
+            for _ in range(min(len(done) or 1, len(order) - len(error_messages) - len(running))):
+                launch()
+
+        if running:
+            combined_errors = " | ".join(error_messages) or "no strategy finished"
+            raise Exception(f"Extraction timed out after {self.time_budget:.0f}s. Errors: {combined_errors}")
+        combined_errors = " | ".join(error_messages)
+        raise Exception(f"All extraction strategies failed. Errors: {combined_errors}")
+
+    def stats(self) -> dict[str, Any]:
+        return {strategy.name: strategy.stats.as_dict() for strategy in self.strategies}
+
+
+# Process-wide engine; warmed up by the app lifespan in main.py
+extraction_engine = ExtractionEngine(
+    build_strategies(),
+    time_budget=config.EXTRACTION_TIME_BUDGET_SECONDS,
+    hedge_delay=config.EXTRACTION_HEDGE_SECONDS,
+)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import config
+
+# googlevideo stream URLs carry their expiry as a unix timestamp, either as a query parameter
+# (`...&expire=1718000000&...`) or as a path segment (`.../expire/1718000000/...`)
+EXPIRE_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+REFRESH_LEASE_SECONDS = 60  # How long one worker may own a refresh before another can retry it
+
+
+def stream_url_expiry(audio_stream_url: str) -> Optional[float]:
+    match = EXPIRE_PATTERN.search(audio_stream_url or "")
+    return float(match.group(1)) if match else None
+
+
+class SQLiteInfoStore:
+    """
+    Audio-info entries in a local SQLite file; WAL mode lets every worker process share it.
+
+    sqlite3 blocks, and waits up to 5 s for another process's write lock, so every call runs on
+    one thread dedicated to the connection rather than on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS audio_info ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, refresh_lease REAL NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("DELETE FROM audio_info WHERE expires_at <= ?", (time.time(),))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-info-sqlite")
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        row = self._db.execute("SELECT value, expires_at FROM audio_info WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    async def get(self, key: str) -> Optional[tuple[Any, float]]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: Any, expires_at: float):
+        await self._run(
+            self._db.execute,
+            "INSERT OR REPLACE INTO audio_info (key, value, expires_at, refresh_lease) VALUES (?, ?, ?, 0)",
+            (key, json.dumps(value), expires_at),
+        )
+
+    async def delete(self, key: str):
+        await self._run(self._db.execute, "DELETE FROM audio_info WHERE key = ?", (key,))
+
+    def _claim_refresh(self, key: str) -> bool:
+        # Atomic across processes: only the worker whose UPDATE matched owns the refresh
+        now = time.time()
+        cursor = self._db.execute(
+            "UPDATE audio_info SET refresh_lease = ? WHERE key = ? AND refresh_lease <= ?",
+            (now + REFRESH_LEASE_SECONDS, key, now),
+        )
+        return cursor.rowcount == 1
+
+    async def claim_refresh(self, key: str) -> bool:
+        return await self._run(self._claim_refresh, key)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._executor.shutdown()
+            self._db = None
+            self._executor = None
+
+
+class RedisInfoStore:
+    """Audio-info entries in Redis, for deployments running more than one host. Needs the `redis` package."""
+
+    def __init__(self, url: str, prefix: str = "lambro:audio_info:"):
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+
+    def open(self):
+        import redis.asyncio as redis  # Optional dependency, only needed when this backend is configured
+        self._redis = redis.from_url(self.url)
+
+    async def get(self, key: str) -> Optional[tuple[Any, float]]:
+        raw = await self._redis.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["value"], entry["expires_at"]
+
+    async def set(self, key: str, value: Any, expires_at: float):
+        ttl = max(1, int(expires_at - time.time()))
+        await self._redis.set(self.prefix + key, json.dumps({"value": value, "expires_at": expires_at}), ex=ttl)
+        await self._redis.delete(self.prefix + key + ":refresh")
+
+    async def delete(self, key: str):
+        await self._redis.delete(self.prefix + key)
+
+    async def claim_refresh(self, key: str) -> bool:
+        return bool(await self._redis.set(self.prefix + key + ":refresh", "1", nx=True, ex=REFRESH_LEASE_SECONDS))
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+class AudioInfoCache:
+    """
+    Persistent cache of /get_audio_info responses whose lifetime follows the stream URL's expiry.
+
+    An entry stops being served `expiry_margin` seconds before its stream URL expires (so
+    playback started from it doesn't hit a 403 part-way through). Within `refresh_ahead` seconds
+    of that point, get() still returns it but flags it for a background refresh, so a
+    frequently requested track never falls through to a blocking extraction. URLs without an
+    expiry live for `default_ttl` seconds.
+    """
+
+    def __init__(self, store, default_ttl: float, expiry_margin: float, refresh_ahead: float):
+        self.store = store
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = refresh_ahead
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Opens the backing store. Called once at app startup."""
+        self.store.open()
+        print(f"Audio info cache: using {type(self.store).__name__}")
+
+    async def close(self):
+        await self.store.close()
+
+    def _expires_at(self, value: dict) -> float:
+        expiry = stream_url_expiry(value.get("audio_stream_url", ""))
+        if expiry is None:
+            return time.time() + self.default_ttl
+        return expiry - self.expiry_margin
+
+    async def get(self, key: str) -> tuple[Optional[dict], bool]:
+        """Returns (value, refresh_due). `refresh_due` is True for the one caller that should refresh it."""
+        entry = await self.store.get(key)
+        now = time.time()
+        if entry is None or entry[1] <= now:
+            self.misses += 1
+            return None, False
+        self.hits += 1
+        value, expires_at = entry
+        refresh_due = expires_at - now <= self.refresh_ahead and await self.store.claim_refresh(key)
+        return value, refresh_due
+
+    async def peek(self, key: str) -> Optional[dict]:
+        """Like get(), without counting towards hit rates or triggering refreshes."""
+        entry = await self.store.get(key)
+        return entry[0] if entry is not None and entry[1] > time.time() else None
+
+    async def put(self, key: str, value: dict):
+        expires_at = self._expires_at(value)
+        if expires_at <= time.time():
+            return  # Already too close to expiry to be worth serving again
+        await self.store.set(key, value, expires_at)
+
+
+def _store_from_config():
+    if config.AUDIO_INFO_CACHE_URL.startswith(("redis://", "rediss://", "unix://")):
+        return RedisInfoStore(config.AUDIO_INFO_CACHE_URL)
+    return SQLiteInfoStore(config.AUDIO_INFO_CACHE_PATH)
+
+
+# Process-wide instance; the store is opened by the app lifespan in main.py
+audio_info_cache = AudioInfoCache(
+    _store_from_config(),
+    default_ttl=config.AUDIO_INFO_DEFAULT_TTL_SECONDS,
+    expiry_margin=config.AUDIO_INFO_EXPIRY_MARGIN_SECONDS,
+    refresh_ahead=config.AUDIO_INFO_REFRESH_AHEAD_SECONDS,
+)
@@ -0,0 +1,251 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+import config
+
+ACTIVE_STATUSES = ("queued", "running")
+INTERRUPTED_ERROR = "Interrupted: the server running this job stopped before it finished; please resubmit."
+
+
+class JobStore:
+    """
+    Render job records in a local SQLite file.
+
+    Needs no external service, and since every worker process (and Celery workers on the same
+    host) opens the same file, a job can be polled from any of them. Finished jobs are purged
+    after `ttl` seconds; their output lives on in the render cache. sqlite3 blocks, and waits up
+    to 5 s for another process's write lock, so every call runs on one thread dedicated to the
+    connection rather than on the event loop.
+
+    Whoever holds an unfinished job renews it (see JobManager) at least every `lease` seconds.
+    One nobody has renewed for longer than that was lost with a crashed or restarted process:
+    it is marked failed the next time it is read, so resubmissions start a new job instead of
+    attaching to one that will never finish. Several processes share the store, so a lease is
+    used rather than failing every unfinished job when one of them starts.
+    """
+
+    def __init__(self, path: str, ttl: float, lease: float):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, cache_key TEXT NOT NULL, status TEXT NOT NULL,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (cache_key, status)")
+        self._purge()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    def close(self):
+        if self._db is not None:
+            self._executor.shutdown()
+            self._db.close()
+            self._db = None
+            self._executor = None
+
+    async def _run(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _purge(self):
+        self._db.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?", (*ACTIVE_STATUSES, time.time() - self.ttl))
+
+    def _create(self, cache_key: str, params: dict, media_type: str, status: str) -> dict:
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": status,
+            "stage": status,
+            "progress": 1.0 if status == "done" else 0.0,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": now if status == "done" else None,
+            "cache_key": cache_key,
+            "media_type": media_type,
+            "params": params,
+        }
+        self._db.execute(
+            "INSERT INTO jobs (id, cache_key, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (job["job_id"], cache_key, status, now, now, json.dumps(job)),
+        )
+        return job
+
+    async def create(self, cache_key: str, params: dict, media_type: str, status: str = "queued") -> dict:
+        return await self._run(self._create, cache_key, params, media_type, status)
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        row = self._db.execute("SELECT data, updated_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        if job["status"] in ACTIVE_STATUSES and row[1] < time.time() - self.lease:
+            print(f"Render job {job_id}: lease expired while {job['status']}, marking it failed")
+            job = self._update(job_id, {"status": "failed", "stage": "failed", "error": INTERRUPTED_ERROR, "finished_at": time.time()})
+        if job["status"] == "queued":
+            (ahead,) = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job["created_at"],)
+            ).fetchone()
+            job["queue_position"] = ahead + 1
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self._run(self._get, job_id)
+
+    def _find_active(self, cache_key: str) -> Optional[dict]:
+        rows = self._db.execute(
+            "SELECT id FROM jobs WHERE cache_key = ? AND status IN (?, ?) ORDER BY created_at",
+            (cache_key, *ACTIVE_STATUSES),
+        ).fetchall()
+        for (job_id,) in rows:
+            job = self._get(job_id)
+            if job is not None and job["status"] in ACTIVE_STATUSES:
+                return job
+        return None
+
+    async def find_active(self, cache_key: str) -> Optional[dict]:
+        """An unfinished job producing the same render, so resubmissions don't duplicate work."""
+        return await self._run(self._find_active, cache_key)
+
+    def _update(self, job_id: str, fields: dict) -> dict:
+        row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        job = json.loads(row[0])
+        job.pop("queue_position", None)
+        job.update(fields)
+        self._db.execute(
+            "UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+            (job["status"], time.time(), json.dumps(job), job_id),
+        )
+        return job
+
+    async def update(self, job_id: str, **fields) -> dict:
+        return await self._run(self._update, job_id, fields)
+
+    def update_soon(self, job_id: str, **fields):
+        """update() without waiting for it, for callers that can't await (e.g. progress callbacks). Still applied in order."""
+        self._executor.submit(self._update, job_id, fields)
+
+    def _renew(self, job_ids: list[str]) -> set[str]:
+        now = time.time()
+        placeholders = ", ".join("?" * len(job_ids))
+        self._db.execute(f"UPDATE jobs SET updated_at = ? WHERE id IN ({placeholders}) AND status IN (?, ?)", (now, *job_ids, *ACTIVE_STATUSES))
+        rows = self._db.execute(f"SELECT id FROM jobs WHERE id IN ({placeholders}) AND status IN (?, ?)", (*job_ids, *ACTIVE_STATUSES))
+        return {job_id for (job_id,) in rows}
+
+    async def renew(self, job_ids: list[str]) -> set[str]:
+        """Extends the lease of the given jobs; returns the ones that are still unfinished."""
+        if not job_ids:
+            return set()
+        return await self._run(self._renew, job_ids)
+
+
+class JobManager:
+    """
+    Accepts render jobs and runs them in the background.
+
+    The default backend is a pool of `workers` asyncio tasks in this process, fed by a bounded
+    queue. With JOB_BACKEND=celery, jobs are handed to Celery workers instead (see
+    celery_worker.py). Either way the job runner itself is supplied by the app (main.py), so
+    this module only deals with bookkeeping. The manager renews the lease of every job it has
+    dispatched until that job finishes, and the runner holds a lease of its own while it runs
+    one (see hold), so a job is only given up on once the process responsible for it is gone.
+    """
+
+    def __init__(self, store: JobStore, backend: str, workers: int, max_queue: int):
+        self.store = store
+        self.backend = backend
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._run: Optional[Callable[[str], Awaitable[None]]] = None
+        self._dispatched: set[str] = set()
+
+    def start(self, run: Callable[[str], Awaitable[None]]):
+        """Opens the store and, for the local backend, starts the worker tasks. Called by the app lifespan."""
+        self.store.open()
+        self._run = run
+        if self.backend == "local":
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._renew_dispatched()))
+        print(f"Render jobs: {self.backend} backend" + (f" with {self.workers} worker(s)" if self.backend == "local" else ""))
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.store.close()
+
+    def queue_depth(self) -> int:
+        """Jobs waiting for a local worker (Celery queues its jobs elsewhere)."""
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def has_capacity(self) -> bool:
+        return self._queue is None or not self._queue.full()
+
+    def dispatch(self, job_id: str):
+        self._dispatched.add(job_id)
+        if self.backend == "celery":
+            from celery_worker import render_job  # Optional dependency, only needed for this backend
+            render_job.delay(job_id)
+        else:
+            self._queue.put_nowait(job_id)
+
+    async def _renew_dispatched(self):
+        while True:
+            await asyncio.sleep(self.store.lease / 3)
+            try:
+                self._dispatched &= await self.store.renew(list(self._dispatched))
+            except sqlite3.Error as e:
+                print(f"Render jobs: could not renew leases: {e}")
+
+    @contextlib.asynccontextmanager
+    async def hold(self, job_id: str):
+        """Keeps renewing `job_id`'s lease while the block runs it, in whichever process that is."""
+        async def renew():
+            while True:
+                await asyncio.sleep(self.store.lease / 3)
+                try:
+                    await self.store.renew([job_id])
+                except sqlite3.Error as e:
+                    print(f"Render job {job_id}: could not renew lease: {e}")
+
+        task = asyncio.create_task(renew())
+        try:
+            yield
+        finally:
+            task.cancel()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Render job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+# Process-wide job manager; started by the app lifespan in main.py
+job_manager = JobManager(
+    JobStore(config.JOB_STORE_PATH, ttl=config.JOB_TTL_SECONDS, lease=config.JOB_LEASE_SECONDS),
+    backend=config.JOB_BACKEND,
+    workers=config.JOB_WORKERS,
+    max_queue=config.JOB_QUEUE_MAX,
+)
@@ -1,22 +1,79 @@
-from fastapi import FastAPI, HTTPException, Body
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import yt_dlp
-import io
-import math
 import asyncio
 import traceback
-import subprocess
+import json
+import time
 import os
+import math
+from contextlib import asynccontextmanager
 from cachetools import LRUCache
-from typing import Optional, Any
-import soundfile as sf
-from pedalboard import Pedalboard, PitchShift, Reverb
-import numpy as np
-import aiohttp
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import config
+from dsp import PITCH_SHIFT_QUALITIES, PCM16Converter, ProcessingGraph, calculate_pitch_factor, needs_pitch_shift
+from downloader import source_downloader
+from dsp_executor import dsp_executor
+from encoders import OUTPUT_FORMATS, OutputFormat, StreamEncoder, negotiate_output_format, resolve_bitrate
+from extraction import extraction_engine
+from info_cache import audio_info_cache
+from jobs import job_manager
+from metrics import (
+    AUDIO_INFO_SECONDS, BYTES_OUT, DECODE_SECONDS, DSP_SECONDS, ENCODE_SECONDS, EXTRACT_SECONDS,
+    RENDER_FIRST_BYTE_SECONDS, RENDER_SECONDS, RENDERS_IN_FLIGHT, AppStateCollector,
+    monitor_event_loop, register_collector, timed_blocks, unregister_collector,
+)
+from media_identity import STREAM_KEY_PREFIX, canonical_media_id, media_id_from_info
+from prefetch import prefetcher
+from profiler import profiler
+from pcm_cache import cached_frame_count, pcm_blocks, pcm_cache, pcm_chunks, pcm_key, read_pcm_blocks
+from scheduler import RenderSlot, render_scheduler
+from server_timing import PROFILE_HEADER, ServerTimingMiddleware, record_stage
+from singleflight import SingleFlight, StreamFanout
+from waveform import load_peaks, peaks_dat, peaks_from_pcm, peaks_json, record_peaks, waveform_cache, waveform_key
+from render_cache import CachedFileResponse, render_cache, render_key, source_identity
+from streaming import (
+    OUTPUT_CHANNELS, OUTPUT_SAMPLE_RATE, STREAM_BLOCK_FRAMES, WAV_HEADER_BYTES,
+    decode_audio_blocks, parse_byte_range, patch_wav_sizes, prime_stream, probe_duration, wav_header,
+)
 
-app = FastAPI(title="Lambro Radio Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start DSP workers up front so the first render doesn't pay for spawning them
+    dsp_executor.start()
+    profiler.start()
+    render_cache.load()
+    pcm_cache.load()
+    waveform_cache.load()
+    audio_info_cache.load()
+    warm_up = asyncio.create_task(extraction_engine.warm_up())
+    await source_downloader.start()
+    job_manager.start(run_render_job)
+    prefetcher.start(prefetch_source)
+    app_state = AppStateCollector(
+        caches={"render": render_cache, "pcm": pcm_cache, "waveform": waveform_cache, "audio_info": audio_info_cache},
+        flights={"audio_info": audio_info_flights, "render": render_flights, "decode": decode_flights, "waveform": waveform_flights},
+        scheduler=render_scheduler,
+        job_manager=job_manager,
+        dsp_executor=dsp_executor,
+    )
+    register_collector(app_state)
+    loop_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    loop_monitor.cancel()
+    unregister_collector(app_state)
+    warm_up.cancel()
+    await prefetcher.shutdown()
+    await job_manager.shutdown()
+    await source_downloader.close()
+    await audio_info_cache.close()
+    dsp_executor.shutdown()
+
+app = FastAPI(title="Lambro Radio Backend", lifespan=lifespan)
 
 # CORS configuration
 origins = [
@@ -37,9 +94,17 @@ app.add_middleware(
     expose_headers=["*"],
     max_age=600
 )
+app.add_middleware(ServerTimingMiddleware)
 
-# Cache for /get_audio_info responses
-audio_info_cache = LRUCache(maxsize=128)
+# Background tasks (e.g. refresh-ahead of audio info) are referenced here until they finish
+background_tasks = set()
+# In-flight deduplication: identical concurrent requests attach to the running extraction / render
+audio_info_flights = SingleFlight("Audio info")
+render_flights = StreamFanout("Render", config.RENDER_MEMORY_BUDGET_BYTES, config.RENDER_SPOOL_DIR)
+# Renders of one source at different frequencies (or presets) share its download and decode
+decode_flights = StreamFanout("Decode", config.RENDER_MEMORY_BUDGET_BYTES, config.RENDER_SPOOL_DIR)
+# Waveform peaks being computed for a cache miss, which outlive the request that started them
+waveform_flights = SingleFlight("Waveform")
 
 @app.get("/")
 async def read_root():
@@ -73,136 +138,52 @@ async def get_audio_info(payload: dict):
     if not url:
         print("Error: URL is required but not provided")
         raise HTTPException(status_code=400, detail="URL is required")
+    started = time.perf_counter()
+
+    # Equivalent links (youtu.be/X, m.youtube.com/watch?v=X&t=30, ...) share one cache entry
+    cache_key = await asyncio.to_thread(canonical_media_id, url) or url
 
     # Check cache first
-    if url in audio_info_cache:
+    cached, refresh_due = await audio_info_cache.get(cache_key)
+    if cached:
         print(f"Cache hit for URL: {url}")
-        return audio_info_cache[url]
-    
+        if refresh_due:
+            # Stream URL expires soon: serve this one, fetch a fresh one for the next caller
+            print(f"Refreshing audio info ahead of expiry for URL: {url}")
+            task = asyncio.create_task(refresh_audio_info(url, cache_key))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        check_track_length(cached.get("duration"))
+        prefetcher.schedule(cached["audio_stream_url"])
+        AUDIO_INFO_SECONDS.labels("hit").observe(time.perf_counter() - started)
+        return cached
+
+    # Concurrent requests for the same media share one extraction
+    try:
+        response_data = await audio_info_flights.do(cache_key, lambda: extract_audio_info(url, cache_key))
+    except Exception:
+        AUDIO_INFO_SECONDS.labels("error").observe(time.perf_counter() - started)
+        raise
+    AUDIO_INFO_SECONDS.labels("miss").observe(time.perf_counter() - started)
+    check_track_length(response_data.get("duration"))
+    # A /process_audio for this source usually follows: get a head start on it while slots are idle
+    prefetcher.schedule(response_data["audio_stream_url"])
+    return response_data
+
+async def refresh_audio_info(url: str, cache_key: str):
+    try:
+        await audio_info_flights.do(cache_key, lambda: extract_audio_info(url, cache_key))
+    except Exception as e:
+        print(f"Background refresh failed for URL {url}: {e}")
+
+async def extract_audio_info(url: str, cache_key: str) -> dict:
     print(f"Cache miss for URL: {url}. Fetching from yt-dlp...")
 
-    # See https://github.com/yt-dlp/yt-dlp#format-selection-examples for format selection
-    # We want a direct audio URL, preferring opus or aac (m4a).
-    # 'bestaudio[ext=opus]/bestaudio[ext=m4a]/bestaudio/best' should prioritize these.
-    # If yt-dlp has to extract, it will be slower, but this aims for direct links.
-    ydl_opts = {
-        'format': 'bestaudio[ext=opus]/bestaudio[ext=m4a]/bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': 'discard_in_playlist',
-        # Anti-bot detection bypass options
-        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'referer': 'https://www.youtube.com/',
-        'http_headers': {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Cache-Control': 'max-age=0',
-        },
-        # Proxy configuration for bypassing IP blocks
-        'proxy': proxy_url if proxy_url else None,
-        # YouTube-specific options for better compatibility
-        'extractor_args': {
-            'youtube': {
-                'skip': ['hls', 'dash'],  # Skip adaptive formats that might be harder to access
-                'player_client': ['android_creator', 'android_music', 'android', 'web'],  # Try different player clients in order
-                'player_skip': ['configs'],  # Skip player config checks
-                'innertube_host': 'studio.youtube.com',  # Use alternate API host
-                'innertube_key': None,  # Let yt-dlp auto-detect
-                'po_token': None,  # Proof of origin token (auto-detect)
-                'visitor_data': None,  # Visitor data (auto-detect)
-            }
-        },
-        # Additional bypass options
-        'force_json': False,
-        'simulate': False,
-        'listformats': False,
-        # Retry options
-        'retries': 5,
-        'fragment_retries': 5,
-        'extractor_retries': 5,
-        'file_access_retries': 3,
-        # Sleep between requests to avoid rate limiting
-        'sleep_interval': 2,
-        'max_sleep_interval': 10,
-        'sleep_interval_subtitles': 1,
-        # Additional headers and options
-        'cookiefile': None,  # No cookies initially
-        'age_limit': None,   # No age limit
-        'geo_bypass': True,  # Try to bypass geo-restrictions
-        'geo_bypass_country': 'US',  # Pretend to be from US
-    }
-    
-    # Add proxy configuration if available (for cloud hosting environments)
-    proxy_url = os.environ.get('PROXY_URL')
-    if proxy_url:
-        print(f"Using proxy: {proxy_url}")
-        ydl_opts['proxy'] = proxy_url
-        if os.environ.get('PROXY_USER') and os.environ.get('PROXY_PASS'):
-            ydl_opts['proxy'] = f"http://{os.environ.get('PROXY_USER')}:{os.environ.get('PROXY_PASS')}@{proxy_url.replace('http://', '')}"
-    }
     try:
-        # Primary attempt with enhanced anti-bot configuration
-        info = None
-        error_messages = []
-        
-        # Try multiple extraction strategies
-        strategies = [
-            # Strategy 1: Enhanced configuration with multiple player clients
-            ydl_opts,
-            # Strategy 2: Minimal configuration (fallback)
-            {
-                'format': 'bestaudio/best',
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android_creator'],  # Often works when others fail
-                    }
-                },
-                'user_agent': 'com.google.android.youtube/19.09.36 (Linux; U; Android 11) gzip',  # Android YouTube app
-            },
-            # Strategy 3: Web-based with minimal headers
-            {
-                'format': 'bestaudio/best',
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['web'],
-                    }
-                },
-            }
-        ]
-        
-        for i, strategy_opts in enumerate(strategies):
-            try:
-                print(f"Attempting extraction strategy {i + 1}...")
-                with yt_dlp.YoutubeDL(strategy_opts) as ydl:
-                    info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                    if info:
-                        print(f"Strategy {i + 1} succeeded!")
-                        break
-            except Exception as strategy_error:
-                error_msg = f"Strategy {i + 1} failed: {str(strategy_error)}"
-                print(error_msg)
-                error_messages.append(error_msg)
-                continue
-        
-        if not info:
-            # All strategies failed
-            combined_errors = " | ".join(error_messages)
-            raise Exception(f"All extraction strategies failed. Errors: {combined_errors}")
+        # Strategies are ranked, raced and time-boxed by the extraction engine (see extraction.py)
+        extract_started = time.perf_counter()
+        info = await extraction_engine.extract(url)
+        EXTRACT_SECONDS.observe(time.perf_counter() - extract_started)
 
         # We are calling extract_info with download=False, so it should only fetch metadata.
         # The format string primarily influences which URL is chosen from the available formats.
@@ -232,22 +213,28 @@ async def get_audio_info(payload: dict):
                 print(f"Selected audio URL from formats list: {audio_url} (ext: {selected_format.get('ext')})")
 
 
-            # Return info or raise error
-            if audio_url:
-                # Extract thumbnail URL (use the last one, usually highest quality)
-                thumbnails = info.get('thumbnails', [])
-                thumbnail_url = thumbnails[-1]['url'] if thumbnails else None
-                response_data = {
-                    "message": "Audio info retrieved successfully",
-                    "audio_stream_url": audio_url,
-                    "title": info.get('title', 'Unknown Title'),
-                    "duration": info.get('duration', 0),
-                    "thumbnail_url": thumbnail_url
-                }
-                audio_info_cache[url] = response_data # Store successful response in cache
-                return response_data
-            else:
-                raise HTTPException(status_code=404, detail="Suitable audio stream not found.")
+        # Return info or raise error
+        if audio_url:
+            # Extract thumbnail URL (use the last one, usually highest quality)
+            thumbnails = info.get('thumbnails', [])
+            thumbnail_url = thumbnails[-1]['url'] if thumbnails else None
+            response_data = {
+                "message": "Audio info retrieved successfully",
+                "audio_stream_url": audio_url,
+                "title": info.get('title', 'Unknown Title'),
+                "duration": info.get('duration', 0),
+                "thumbnail_url": thumbnail_url
+            }
+            media_id = media_id_from_info(info)
+            if media_id:
+                response_data["media_id"] = media_id
+            await audio_info_cache.put(cache_key, response_data) # Store successful response in cache
+            if media_id:
+                # Lets /process_audio and /render key their caches on the media, not the signed stream URL
+                await audio_info_cache.put(STREAM_KEY_PREFIX + source_identity(audio_url), {"audio_stream_url": audio_url, "media_id": media_id, "duration": response_data["duration"]})
+            return response_data
+        else:
+            raise HTTPException(status_code=404, detail="Suitable audio stream not found.")
 
     except yt_dlp.utils.DownloadError as e:
         error_msg = str(e)
@@ -279,147 +266,227 @@ async def get_audio_info(payload: dict):
             
         raise HTTPException(status_code=500, detail=detail)
 
-def calculate_pitch_factor(target_hz: Optional[float], base_hz: float = 440.0) -> Optional[float]:
-    if target_hz is None or target_hz <= 0 or base_hz <= 0:
-        return None # No change
-    return target_hz / base_hz
+AI_PRESET_ECHO = dict(in_gain=0.8, out_gain=0.9, delay_ms=500, decay=0.3) # Simplified echo (formerly ffmpeg aecho=0.8:0.9:500:0.3)
+RANGE_PREROLL_SECONDS = 1.0 # Decoded ahead of a seek target (and discarded) so the DSP is warmed up
+BYTES_PER_FRAME = OUTPUT_CHANNELS * 2 # s16 output
+PREVIEW_SAMPLE_RATE = 22050 # Previews are processed at half rate: pitch shifting costs about half as much
+PREVIEW_SECONDS = 10.0 # Default preview length
+PREVIEW_MAX_SECONDS = 30.0
+BATCH_MAX_VARIANTS = 16 # Renders a single /batch_render may ask for
+WAVEFORM_DEFAULT_PIXELS = 1000 # Points a /waveform request gets at least, unless it asks for a number
+WAVEFORM_RETRY_AFTER_SECONDS = 5 # Polling interval suggested to a /waveform request still waiting for its decode
+
+# Total frame count per source identity, so every Range request for a track agrees on its size
+source_frame_counts = LRUCache(maxsize=256)
+
+def check_track_length(seconds: Optional[float]):
+    """Rejects tracks longer than MAX_TRACK_SECONDS; an unknown length (None or 0) passes."""
+    if config.MAX_TRACK_SECONDS and seconds and seconds > config.MAX_TRACK_SECONDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Track is too long ({seconds / 60:.0f} min); the maximum is {config.MAX_TRACK_SECONDS / 60:.0f} min.",
+        )
 
-async def process_and_stream_audio_generator(audio_url: str, target_frequency: Optional[float], ai_preset: bool = False):
-    ffmpeg_process = None
-    temp_output_file = None # Not used anymore, pedalboard works in memory
+async def check_source_length(audio_stream_url: str, duration_hint: Optional[float] = None):
+    """check_track_length for a stream URL, using the duration /get_audio_info recorded for it, else the client's hint."""
+    mapping = await audio_info_cache.peek(STREAM_KEY_PREFIX + source_identity(audio_stream_url))
+    check_track_length((mapping or {}).get("duration") or duration_hint)
+
+async def resolve_source(audio_stream_url: str) -> str:
+    """
+    Cache identity of a stream URL: the canonical media ID recorded when /get_audio_info
+    resolved it (so re-extracting a track keeps its cached decodes and renders), otherwise
+    the URL's own normalized form.
+    """
+    mapping = await audio_info_cache.peek(STREAM_KEY_PREFIX + source_identity(audio_stream_url))
+    if mapping and mapping.get("media_id"):
+        return mapping["media_id"]
+    return source_identity(audio_stream_url)
 
+def parse_target_frequency(target_frequency: Any) -> Optional[float]:
+    if target_frequency is None:
+        return None
     try:
-        y_processed = None
-        sample_rate = 44100 # Target sample rate
-
-        pitch_factor = calculate_pitch_factor(target_frequency)
-        apply_pitch_shift = pitch_factor is not None and abs(pitch_factor - 1.0) > 1e-4
-
-        if ai_preset:
-            # Step 1 (AI Preset): Use ffmpeg to apply AI echo and get PCM audio
-            print(f"ffmpeg: Applying AI preset for {audio_url}")
-            ffmpeg_command_parts = [
-                'ffmpeg', '-i', audio_url,
-                '-af', "aecho=0.8:0.9:500:0.3", # Simplified echo
-                '-vn', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-ac', '2', '-f', 'wav', '-'
-            ]
-            print(f"Executing ffmpeg command (AI preset): {' '.join(ffmpeg_command_parts)}")
-            ffmpeg_process = await asyncio.create_subprocess_exec(
-                *ffmpeg_command_parts,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout_data, stderr_data = await ffmpeg_process.communicate()
-            ffmpeg_stderr_str = stderr_data.decode(errors='ignore').strip()
-            if ffmpeg_stderr_str:
-                print(f"ffmpeg stderr (AI preset):\n{ffmpeg_stderr_str}")
-            
-            if ffmpeg_process.returncode != 0:
-                raise HTTPException(status_code=500, detail=f"ffmpeg AI preset processing failed (code {ffmpeg_process.returncode})")
-            if not stdout_data:
-                raise HTTPException(status_code=500, detail="ffmpeg AI preset produced no output.")
-
-            # Convert PCM data from ffmpeg to NumPy array
-            with io.BytesIO(stdout_data) as pcm_buffer:
-                y_audio, sr_orig = sf.read(pcm_buffer, dtype='float32')
-            print(f"Soundfile: Read AI-preset audio. SR: {sr_orig}, Shape: {y_audio.shape}")
-            if sr_orig != sample_rate:
-                # This shouldn't happen if ffmpeg -ar is set correctly, but as a fallback
-                print(f"Warning: Sample rate from ffmpeg AI step ({sr_orig}) doesn't match target ({sample_rate}). Resampling may be needed or quality affected.")
-            
-            y_processed = y_audio
-
-        # Step 2: Apply Pitch Shifting with Pedalboard (if needed)
-        # If AI preset was applied, y_processed is already populated.
-        # If no AI preset, load audio directly.
-        if apply_pitch_shift:
-            if y_processed is None: # No AI preset, load audio directly for pitch shifting
-                print(f"aiohttp/soundfile: Fetching and decoding for pitch shift: {audio_url}")
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(audio_url) as response:
-                        if response.status != 200:
-                            raise HTTPException(status_code=response.status, detail=f"Failed to fetch audio for pitch shift: {audio_url}")
-                        audio_bytes = await response.read()
-                with io.BytesIO(audio_bytes) as audio_buffer:
-                    y_audio, sr_orig = sf.read(audio_buffer, dtype='float32')
-                print(f"Soundfile: Read direct audio. SR: {sr_orig}, Shape: {y_audio.shape}")
-                # Note: Pedalboard will use its own sample_rate setting or the board's.
-                # We ensure output sample rate with sf.write later.
-                # For Pedalboard, it's best to process at original SR if possible, then resample output if needed.
-                # However, our ffmpeg step standardizes to `sample_rate` (44100).
-                # For consistency, if direct loading, Pedalboard should also aim for this.
-                # For simplicity, pedalboard will use `sr_orig` and `sf.write` will handle final rate if different.
-                y_processed = y_audio
-                sample_rate = sr_orig # Use original sample rate for pedalboard processing if loaded directly
-
-            print(f"Pedalboard: Applying pitch shift with factor: {pitch_factor} (Target SR for Pedalboard: {sample_rate})")
-            
-            # Pedalboard expects (num_channels, num_samples) or (num_samples,)
-            # soundfile reads as (num_samples, num_channels)
-            y_to_shift = y_processed.T if y_processed.ndim == 2 else y_processed
-            
-            board = Pedalboard([PitchShift(semitones=12 * math.log2(pitch_factor))], sample_rate=float(sample_rate))
-            y_shifted_pb = board(y_to_shift, sample_rate=float(sample_rate)) # Process with specified sample rate
-            
-            y_processed = y_shifted_pb.T if y_shifted_pb.ndim == 2 else y_shifted_pb
-            print("Pedalboard: Pitch shift applied.")
-
-        # Step 3: Ensure audio is loaded if no AI and no Pitch Shift (just transcode to WAV)
-        if y_processed is None:
-            print(f"aiohttp/soundfile: Fetching and decoding for WAV conversion: {audio_url}")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(audio_url) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=response.status, detail=f"Failed to fetch audio for WAV conversion: {audio_url}")
-                    audio_bytes = await response.read()
-            with io.BytesIO(audio_bytes) as audio_buffer:
-                y_processed, sr_orig = sf.read(audio_buffer, dtype='float32')
-            print(f"Soundfile: Read direct audio for WAV. SR: {sr_orig}, Shape: {y_processed.shape}")
-            sample_rate = sr_orig # Use original sample rate for writing
-
-        # Step 4: Stream the processed audio (y_processed) as WAV
-        if y_processed is None:
-            raise HTTPException(status_code=500, detail="Audio processing resulted in no audio data.")
-
-        # Ensure stereo output for sf.write
-        if y_processed.ndim == 1:
-            print("Processed audio is mono, converting to stereo for WAV output.")
-            y_processed = np.stack((y_processed, y_processed), axis=-1)
-        elif y_processed.ndim == 2 and y_processed.shape[1] == 1: # Mono but shape (N,1)
-             print("Processed audio is mono (N,1), converting to stereo (N,2) for WAV output.")
-             y_processed = np.concatenate((y_processed, y_processed), axis=1)
-
-
-        print(f"Soundfile: Writing final audio to WAV stream. Target SR for sf.write: {sample_rate}")
-        # Output WAV at 44.1kHz stereo, s16 PCM
-        output_target_sr = 44100
-        
-        # Resample with Pedalboard if original/processing SR was different from final output SR
-        # This step is crucial if sr_orig from direct load was used and is not 44100
-        if sample_rate != output_target_sr:
-            print(f"Pedalboard: Resampling from {sample_rate} Hz to {output_target_sr} Hz before encoding.")
-            # Pedalboard resamples. board(audio_array, sample_rate_of_array)
-            # To resample, we can pass it through an empty board or a board with Resample effect
-            # For simplicity, let's use sf.write's capability if it's efficient enough or implement Resample effect
-            # sf.write does not resample. We need to resample y_processed.
-            resampler_board = Pedalboard([], sample_rate=float(sample_rate))
-            y_processed_resampled = resampler_board.resample(y_processed, output_target_sr)
-            y_to_write = y_processed_resampled
-            final_sr_for_sf = output_target_sr
+        target_freq_float = float(target_frequency)
+        if target_freq_float <= 0:
+             raise ValueError("Frequency must be positive")
+    except (ValueError, TypeError):
+         raise HTTPException(status_code=400, detail="Invalid target_frequency value. Must be a positive number.")
+    return target_freq_float
+
+def source_audio_blocks(audio_url: str, source: str, start_frame: int = 0):
+    """
+    Decoded source audio as float32 blocks, from the PCM cache when possible.
+
+    On a miss the live decode is teed into the cache, so the next request for the same source
+    (e.g. at another frequency) skips the download and decode entirely; requests arriving
+    while it runs join it through decode_flights rather than starting their own. The decode
+    also leaves the source's waveform peaks in the waveform cache. Decodes that start part-way
+    in (seeks) are neither cached nor shared, since they don't cover the whole track.
+    """
+    key = pcm_key(source, OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS)
+    cached_path = pcm_cache.lookup(key)
+    if cached_path:
+        print(f"PCM cache hit for {source}")
+        return read_pcm_blocks(cached_path, STREAM_BLOCK_FRAMES, OUTPUT_CHANNELS, start_frame)
+    if start_frame > 0:
+        print(f"ffmpeg: Seeking decode of {audio_url} to frame {start_frame}")
+        return decode_audio_blocks(audio_url, start_seconds=start_frame / OUTPUT_SAMPLE_RATE)
+    stream, joined = decode_flights.subscribe(key, lambda: pcm_cache.record(key, pcm_chunks(record_peaks(
+        waveform_cache, waveform_key(source, OUTPUT_SAMPLE_RATE), decode_audio_blocks(audio_url), OUTPUT_CHANNELS,
+    ))))
+    if not joined:
+        print(f"ffmpeg: Streaming decode of {audio_url}")
+    return pcm_blocks(stream, OUTPUT_CHANNELS)
+
+def preview_source_blocks(audio_url: str, start_seconds: float, seconds: float):
+    """
+    Just the preview window of the source, decoded at PREVIEW_SAMPLE_RATE as a single block.
+
+    ffmpeg seeks and reads only the bytes covering the window, and with one block the pitch
+    shifter renders it in a single pass with no block seams.
+    """
+    print(f"ffmpeg: Preview decode of {audio_url} ({seconds:g}s from {start_seconds:g}s)")
+    return decode_audio_blocks(
+        audio_url,
+        block_frames=math.ceil(seconds * PREVIEW_SAMPLE_RATE),
+        sample_rate=PREVIEW_SAMPLE_RATE,
+        start_seconds=start_seconds,
+        duration_seconds=seconds,
+    )
+
+def render_effects(target_frequency: Optional[float], ai_preset: bool, quality: str = "standard") -> list[tuple[str, dict]]:
+    """The effect chain for a render, in processing order. `quality` picks the pitch-shift tier."""
+    effects = []
+    if ai_preset:
+        effects.append(("echo", AI_PRESET_ECHO))
+    pitch_factor = calculate_pitch_factor(target_frequency)
+    if needs_pitch_shift(pitch_factor):
+        effects.append((PITCH_SHIFT_QUALITIES[quality], {"pitch_factor": pitch_factor}))
+    return effects
+
+async def processed_audio_blocks(
+    audio_url: str,
+    source: str,
+    target_frequency: Optional[float],
+    ai_preset: bool,
+    start_frame: int = 0,
+    preview: Optional[tuple[float, float]] = None,
+    quality: str = "standard",
+):
+    """
+    Yields the fully processed audio as float32 blocks, starting at `start_frame` of the source.
+
+    Output frames line up one-to-one with source frames, so callers can slice by frame index.
+    With the AI preset the echo tail (AI_PRESET_ECHO delay) follows after the last source frame.
+    Each block is only valid until the next one is requested. With a `preview` window
+    (start_seconds, seconds) only that excerpt is rendered, at PREVIEW_SAMPLE_RATE. The "fast"
+    `quality` tier changes the length of the output, so frames only line up with "standard"
+    and "high". Sources longer than MAX_TRACK_SECONDS are cut off with a 422 once the limit is
+    passed, for the ones whose length wasn't known up front.
+    """
+    graph = None
+    source_blocks = None
+    max_frames = config.MAX_TRACK_SECONDS * OUTPUT_SAMPLE_RATE if preview is None else 0
+    frames = start_frame
+    try:
+        effects = render_effects(target_frequency, ai_preset, quality)
+        print(f"DSP: Effect chain {[name for name, _ in effects] or 'passthrough'} (target frequency: {target_frequency})")
+        # Echo runs in-process, pitch shifting on the DSP executor; the decode (and its PCM cache
+        # entry) is the same for every chain
+        if preview is None:
+            graph = ProcessingGraph.compile(effects, OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS)
+            source_blocks = source_audio_blocks(audio_url, source, start_frame)
         else:
-            y_to_write = y_processed
-            final_sr_for_sf = sample_rate
+            graph = ProcessingGraph.compile(effects, PREVIEW_SAMPLE_RATE, OUTPUT_CHANNELS)
+            source_blocks = preview_source_blocks(audio_url, *preview)
 
-        output_buffer = io.BytesIO()
-        sf.write(output_buffer, y_to_write, samplerate=int(final_sr_for_sf), format='WAV', subtype='PCM_16')
-        output_buffer.seek(0)
-        
-        chunk_size = 8192
-        while True:
-            chunk = output_buffer.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
+        async for block in timed_blocks(source_blocks, DECODE_SECONDS):
+            frames += len(block)
+            if max_frames and frames > max_frames:
+                raise HTTPException(status_code=422, detail=f"Track is longer than the maximum of {config.MAX_TRACK_SECONDS / 60:.0f} min.")
+            started = time.perf_counter()
+            block = await graph.process(block)
+            DSP_SECONDS.observe(time.perf_counter() - started)
+            if len(block):
+                yield block
+        async for block in timed_blocks(graph.flush(), DSP_SECONDS):
+            yield block
+    finally:
+        if source_blocks is not None:
+            await source_blocks.aclose()
+        if graph is not None:
+            graph.close()
+
+async def process_and_stream_audio_generator(
+    audio_url: str,
+    target_frequency: Optional[float],
+    ai_preset: bool = False,
+    source: Optional[str] = None,
+    output_format: OutputFormat = OUTPUT_FORMATS["wav"],
+    bitrate_kbps: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    preview: Optional[tuple[float, float]] = None,
+    quality: str = "standard",
+):
+    """
+    Streams the processed audio as soon as the first block is ready.
+
+    The source is downloaded and decoded incrementally (see streaming.decode_audio_blocks),
+    or read back from the PCM cache, pitch shifted block by block, and each block is encoded
+    and yielded immediately, so time-to-first-byte is roughly one block of work and memory
+    stays bounded. WAV is converted to PCM_16 in-process; compressed formats are encoded by a
+    streaming ffmpeg encoder. `progress` is called with the frame count of every processed block.
+    A `preview` window renders just that excerpt at PREVIEW_SAMPLE_RATE (see processed_audio_blocks).
+    """
+    blocks = None
+    encoder = None
+    started = time.perf_counter()
+    first_byte = True
+    RENDERS_IN_FLIGHT.inc()
+    try:
+        blocks = processed_audio_blocks(audio_url, source or source_identity(audio_url), target_frequency, ai_preset, preview=preview, quality=quality)
+        sample_rate = OUTPUT_SAMPLE_RATE if preview is None else PREVIEW_SAMPLE_RATE
+
+        if output_format.codec is None:
+            # The header goes out together with the first block of audio
+            header = wav_header(sample_rate, OUTPUT_CHANNELS)
+            to_pcm16 = PCM16Converter()
+            async for block in blocks:
+                if progress is not None:
+                    progress(len(block))
+                encode_started = time.perf_counter()
+                chunk = to_pcm16(block)
+                ENCODE_SECONDS.observe(time.perf_counter() - encode_started)
+                if header is not None:
+                    chunk = header + chunk
+                    header = None
+                    RENDER_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started)
+                BYTES_OUT.inc(len(chunk))
+                yield chunk
+            if header is not None:
+                raise HTTPException(status_code=500, detail="Audio processing resulted in no audio data.")
+        else:
+            print(f"ffmpeg: Encoding output as {output_format.name} ({bitrate_kbps or 'lossless'} kbps)")
+            encoder = StreamEncoder(output_format, bitrate_kbps, sample_rate=sample_rate)
+            async for block in blocks:
+                if progress is not None:
+                    progress(len(block))
+                encode_started = time.perf_counter()
+                chunk = await encoder.encode(block)
+                ENCODE_SECONDS.observe(time.perf_counter() - encode_started)
+                if chunk:
+                    if first_byte:
+                        first_byte = False
+                        RENDER_FIRST_BYTE_SECONDS.observe(time.perf_counter() - started)
+                    BYTES_OUT.inc(len(chunk))
+                    yield chunk
+            chunk = await encoder.finish()
+            if chunk:
+                BYTES_OUT.inc(len(chunk))
+                yield chunk
+
+        RENDER_SECONDS.observe(time.perf_counter() - started)
         print("Streaming processed audio completed.")
 
     except HTTPException: # Re-raise HTTPExceptions
@@ -427,57 +494,607 @@ async def process_and_stream_audio_generator(audio_url: str, target_frequency: O
     except Exception as e:
         print(f"Error during audio processing and streaming generator: {e}")
         traceback.print_exc()
-        # Proper cleanup for ffmpeg if it was used
-        if ffmpeg_process and ffmpeg_process.returncode is None:
-            try:
-                ffmpeg_process.terminate()
-                await ffmpeg_process.wait(timeout=1.0)
-            except ProcessLookupError: pass
-            except asyncio.TimeoutError: ffmpeg_process.kill()
-            except Exception as term_e: print(f"Error terminating ffmpeg: {term_e}")
-        
         raise HTTPException(status_code=500, detail=f"Internal server error during audio processing: {str(e)}")
     finally:
-        if ffmpeg_process and ffmpeg_process.returncode is None: # Ensure ffmpeg is cleaned up
-            print("Terminating ffmpeg process in finally block (if generator error)...")
-            try:
-                ffmpeg_process.terminate()
-                await ffmpeg_process.wait(timeout=1.0)
-            except ProcessLookupError: pass # Process already finished
-            except asyncio.TimeoutError:
-                print("ffmpeg process did not terminate gracefully, killing.")
-                ffmpeg_process.kill()
-                await ffmpeg_process.wait()
-            except Exception as e_finally:
-                print(f"Error during ffmpeg cleanup in finally: {e_finally}")
+        RENDERS_IN_FLIGHT.dec()
+        if blocks is not None:
+            await blocks.aclose()
+        if encoder is not None:
+            await encoder.close()
         print("process_and_stream_audio_generator finished.")
 
+async def source_frame_count(audio_url: str, source: str, duration_hint: Optional[float]) -> int:
+    """Total frames of the source at the output rate: exact from the PCM cache, else probed, else the client's hint."""
+    if source in source_frame_counts:
+        return source_frame_counts[source]
+    cached_path = pcm_cache.lookup(pcm_key(source, OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS))
+    if cached_path:
+        frames = cached_frame_count(cached_path, OUTPUT_CHANNELS)
+    else:
+        duration = await probe_duration(audio_url) or duration_hint
+        if not duration:
+            raise HTTPException(status_code=502, detail="Could not determine the duration of the source audio.")
+        frames = round(duration * OUTPUT_SAMPLE_RATE)
+    source_frame_counts[source] = frames
+    return frames
+
+async def wav_byte_window(audio_url: str, source: str, target_frequency: Optional[float], ai_preset: bool, total_frames: int, byte_start: int, byte_end: int, quality: str = "standard"):
+    """
+    Yields bytes byte_start..byte_end (inclusive) of the WAV this render would produce.
+
+    Only the frames covering that byte window are decoded and processed, plus a pre-roll that
+    is thrown away. If the source turns out shorter than advertised the tail is padded with
+    silence, so the response always matches its Content-Length.
+    """
+    if byte_start < WAV_HEADER_BYTES:
+        yield wav_header(OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS, data_size=total_frames * BYTES_PER_FRAME)[byte_start:byte_end + 1]
+    if byte_end < WAV_HEADER_BYTES:
+        return
+
+    data_start = max(byte_start, WAV_HEADER_BYTES) - WAV_HEADER_BYTES
+    data_end = byte_end + 1 - WAV_HEADER_BYTES # Exclusive
+    start_frame = data_start // BYTES_PER_FRAME
+    end_frame = -(-data_end // BYTES_PER_FRAME)
+    skip_bytes = data_start - start_frame * BYTES_PER_FRAME # Ranges need not be frame aligned
+    remaining = data_end - data_start
+
+    position = start_frame - min(start_frame, int(RANGE_PREROLL_SECONDS * OUTPUT_SAMPLE_RATE))
+    to_pcm16 = PCM16Converter()
+    blocks = processed_audio_blocks(audio_url, source, target_frequency, ai_preset, start_frame=position, quality=quality)
+    try:
+        async for block in blocks:
+            lo = max(start_frame - position, 0)
+            hi = min(end_frame - position, len(block))
+            position += len(block)
+            if hi <= lo:
+                continue
+            chunk = to_pcm16(block[lo:hi])[skip_bytes:skip_bytes + remaining]
+            skip_bytes = 0
+            remaining -= len(chunk)
+            yield chunk
+            if remaining <= 0:
+                break
+    finally:
+        await blocks.aclose()
+    if remaining > 0:
+        yield bytes(remaining)
+
+def parse_quality(quality: Optional[str]) -> str:
+    """The pitch-shift tier to render with: the requested one, else PITCH_SHIFT_QUALITY."""
+    quality = (quality or config.PITCH_SHIFT_QUALITY).lower()
+    if quality not in PITCH_SHIFT_QUALITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid quality '{quality}'. Must be one of: {', '.join(PITCH_SHIFT_QUALITIES)}.")
+    return quality
+
+def parse_render_request(payload: dict, request: Request) -> tuple[str, Optional[float], bool, OutputFormat, Optional[int], str]:
+    """Validates a /process_audio or /jobs payload."""
+    audio_stream_url = payload.get("audio_stream_url")
+    if not audio_stream_url:
+        print("Error: audio_stream_url is required but not provided")
+        raise HTTPException(status_code=400, detail="audio_stream_url is required")
+    target_freq_float = parse_target_frequency(payload.get("target_frequency"))
+    ai_preset = bool(payload.get("ai_preset", False))
+    # Output codec: `output_format` in the payload, else negotiated from Accept, else WAV
+    output_format = negotiate_output_format(payload.get("output_format"), request.headers.get("accept"))
+    bitrate_kbps = resolve_bitrate(output_format, payload.get("bitrate_kbps"))
+    quality = parse_quality(payload.get("quality"))
+    return audio_stream_url, target_freq_float, ai_preset, output_format, bitrate_kbps, quality
+
+def parse_preview_request(payload: dict) -> Optional[tuple[float, float]]:
+    """
+    The (start_seconds, seconds) window of a `preview` request, or None for a full render.
+    The window is the first `preview_seconds`, or centered on `preview_position` if given.
+    """
+    if not payload.get("preview"):
+        return None
+    try:
+        seconds = float(payload.get("preview_seconds") or PREVIEW_SECONDS)
+        position = payload.get("preview_position")
+        position = float(position) if position is not None else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid preview_seconds or preview_position value. Must be numbers.")
+    if not 0 < seconds <= PREVIEW_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"preview_seconds must be between 0 and {PREVIEW_MAX_SECONDS:g}.")
+    start_seconds = 0.0 if position is None else max(position - seconds / 2, 0.0)
+    return start_seconds, seconds
+
+async def start_render(
+    flight_key: str,
+    render: Callable[[], AsyncIterator[bytes]],
+    admit: Optional[Callable[[], Awaitable[RenderSlot]]] = None,
+) -> tuple[AsyncIterator[bytes], dict]:
+    """
+    Joins the in-flight render for `flight_key`, or takes a render slot (queueing for one, or
+    failing fast with 503) and starts it. Returns the primed stream plus response headers
+    describing how the request was served. `admit` replaces the scheduler's admission, e.g.
+    with admit_render_job's retries.
+    """
+    slot = None
+    if not render_flights.in_flight(flight_key):
+        queued = time.perf_counter()
+        slot = await (admit or render_scheduler.admit)()
+        record_stage("queue", time.perf_counter() - queued)
+    stream, joined = render_flights.subscribe(flight_key, lambda: render_scheduler.hold(slot, render()))
+    headers = {}
+    if joined:
+        headers["X-Render-Cache"] = "coalesced"
+        render_scheduler.promote(flight_key) # In case we joined a speculative render
+        if slot is not None:
+            slot.release(completed=False) # Someone started the same render while we queued
+    elif slot is not None:
+        headers.update(slot.headers())
+    return await prime_stream(stream), headers
+
+async def prefetch_source(audio_stream_url: str):
+    """
+    Speculatively renders a freshly resolved source at the configured popular frequencies
+    (WAV, no AI preset, the same cache keys /process_audio uses), one at a time and only on
+    idle render slots. The first render tees the decode into the PCM cache, so the others skip
+    the download; with no frequencies configured the source is just decoded. A /process_audio
+    for a render in progress joins it, and any other request that needs the slot preempts
+    (cancels) this whole task.
+    """
+    source = await resolve_source(audio_stream_url)
+    quality = parse_quality(None)
+    task = asyncio.current_task()
+    if not prefetcher.frequencies:
+        key = pcm_key(source, OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS)
+        if pcm_cache.peek(key) is None:
+            slot = render_scheduler.try_admit_speculative(f"decode:{key}", task.cancel)
+            if slot is not None:
+                print(f"Speculative prefetch: decoding {source}")
+                blocks = source_audio_blocks(audio_stream_url, source)
+                try:
+                    async for _ in blocks:
+                        pass
+                finally:
+                    await blocks.aclose()
+                    slot.release(completed=False) # Not a render; keep it out of the wait estimates
+        return
+
+    for target_frequency in prefetcher.frequencies:
+        cache_key = render_key(source, target_frequency, False, quality=quality)
+        if render_cache.peek(cache_key) is not None or render_flights.in_flight(cache_key):
+            continue
+        slot = render_scheduler.try_admit_speculative(cache_key, task.cancel)
+        if slot is None:
+            return # No idle capacity: real traffic comes first
+        print(f"Speculative prefetch: pre-rendering {source} at {target_frequency} Hz")
+        stream, joined = render_flights.subscribe(cache_key, lambda: render_scheduler.hold(slot, render_cache.record(
+            cache_key,
+            process_and_stream_audio_generator(audio_stream_url, target_frequency, False, source, quality=quality),
+            finalize=patch_wav_sizes,
+        )))
+        if joined:
+            slot.release(completed=False)
+        async for _ in stream:
+            pass
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, bytes in/out, renders, queues, caches, event-loop lag and RSS."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """
+    A request profile taken with the X-Debug-Profile header (its ID comes back as X-Profile-Id),
+    as folded stacks for flamegraph.pl, speedscope or inferno. X-Profiled-Server-Timing has the
+    profiled request's full stage timings. Needs the same X-Debug-Profile token.
+    """
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        raise HTTPException(status_code=403, detail=f"A valid {PROFILE_HEADER} token is required.")
+    path, server_timing = await asyncio.to_thread(profiler.load, profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded", headers={"X-Profiled-Server-Timing": server_timing})
+
+@app.get("/queue")
+async def queue_status():
+    """Render slots and queue length, with the wait a new render request would currently face."""
+    return render_scheduler.status()
+
 @app.post("/process_audio")
 async def stream_processed_audio_endpoint(
+    request: Request,
     payload: dict = Body(...)
 ):
     print(f"Received process_audio request with payload: {payload}")
-    audio_stream_url = payload.get("audio_stream_url")
-    target_frequency = payload.get("target_frequency")
-    ai_preset = payload.get("ai_preset", False)
+    audio_stream_url, target_freq_float, ai_preset, output_format, bitrate_kbps, quality = parse_render_request(payload, request)
+    preview = parse_preview_request(payload)
 
-    if not audio_stream_url:
-        print("Error: audio_stream_url is required but not provided")
-        raise HTTPException(status_code=400, detail="audio_stream_url is required")
+    source = await resolve_source(audio_stream_url)
+    cache_key = render_key(source, target_freq_float, ai_preset, output_format.name, bitrate_kbps, quality)
+    if preview is not None:
+        # Quick reduced-quality excerpt while the user is still picking a frequency; not cached,
+        # the client switches to the full render once it has settled
+        start_seconds, seconds = preview
+        stream, render_headers = await start_render(f"{cache_key}:preview:{start_seconds:g}+{seconds:g}", lambda: process_and_stream_audio_generator(
+            audio_stream_url, target_freq_float, ai_preset, source, output_format, bitrate_kbps, preview=preview, quality=quality,
+        ))
+        headers = {
+            "X-Render-Cache": "preview",
+            "X-Preview-Window": f"{start_seconds:g}-{start_seconds + seconds:g}",
+            "X-Preview-Sample-Rate": str(PREVIEW_SAMPLE_RATE),
+            "Vary": "Accept",
+            **render_headers,
+        }
+        return StreamingResponse(stream, media_type=output_format.media_type, headers=headers)
+
+    cached_path = render_cache.lookup(cache_key)
+    if cached_path:
+        print(f"Render cache hit: {cache_key}")
+        return CachedFileResponse(cached_path, media_type=output_format.media_type, headers={"X-Render-Cache": "hit", "Vary": "Accept"})
+
+    await check_source_length(audio_stream_url)
+    print(f"Render cache miss: {cache_key}. Rendering...")
+    stream, render_headers = await start_render(cache_key, lambda: render_cache.record(
+        cache_key,
+        process_and_stream_audio_generator(audio_stream_url, target_freq_float, ai_preset, source, output_format, bitrate_kbps, quality=quality),
+        finalize=patch_wav_sizes if output_format.codec is None else None,
+    ))
+    return StreamingResponse(stream, media_type=output_format.media_type, headers={"X-Render-Cache": "miss", "Vary": "Accept", **render_headers})
+
+@app.post("/batch_render")
+async def batch_render_endpoint(
+    request: Request,
+    payload: dict = Body(...)
+):
+    """
+    Renders one source in several variants into the render cache, e.g. a track at 432, 528 and
+    639 Hz. The payload is a /process_audio payload plus `variants`, a list of overrides of
+    target_frequency, ai_preset, quality, output_format and bitrate_kbps. Variants run
+    concurrently, on up to all render slots, and share a single download and decode (see
+    source_audio_blocks), so N variants cost one fetch plus N DSP passes. Responds once all
+    of them are done with the outcome of each, one per requested variant in request order;
+    the audio is then a cache hit on /process_audio with the same parameters.
+    """
+    print(f"Received batch_render request with payload: {payload}")
+    variants = payload.get("variants")
+    if not isinstance(variants, list) or not variants or not all(isinstance(variant, dict) for variant in variants):
+        raise HTTPException(status_code=400, detail="variants must be a non-empty list of objects")
+    if len(variants) > BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_VARIANTS} variants per batch.")
+    base = {key: value for key, value in payload.items() if key != "variants"}
+    # The source is shared: variants can't override it
+    renders = [parse_render_request({**variant, **base}, request) for variant in variants]
+    audio_stream_url = renders[0][0]
+    source = await resolve_source(audio_stream_url)
+    await check_source_length(audio_stream_url)
+
+    # The batch's own variants would only queue behind each other, so it never asks for more
+    # slots than there are, and waits out a busy server instead of failing variants with 503
+    concurrency = asyncio.Semaphore(render_scheduler.slots)
+
+    async def render_variant(cache_key, target_freq_float, ai_preset, output_format, bitrate_kbps, quality) -> dict:
+        cached_path = render_cache.lookup(cache_key)
+        if cached_path:
+            return {"render_cache": "hit", "bytes": os.path.getsize(cached_path)}
+        try:
+            async with concurrency:
+                stream, render_headers = await start_render(cache_key, lambda: render_cache.record(
+                    cache_key,
+                    process_and_stream_audio_generator(audio_stream_url, target_freq_float, ai_preset, source, output_format, bitrate_kbps, quality=quality),
+                    finalize=patch_wav_sizes if output_format.codec is None else None,
+                ), admit=admit_render_job)
+                total_bytes = 0
+                async for chunk in stream:
+                    total_bytes += len(chunk)
+        except HTTPException as e:
+            # One variant failing doesn't fail the others
+            return {"status_code": e.status_code, "detail": e.detail}
+        return {"render_cache": render_headers.get("X-Render-Cache", "miss"), "bytes": total_bytes}
+
+    # Variants that come down to the same render (duplicates) are rendered once
+    keys = [
+        render_key(source, target_freq_float, ai_preset, output_format.name, bitrate_kbps, quality)
+        for _, target_freq_float, ai_preset, output_format, bitrate_kbps, quality in renders
+    ]
+    unique = {key: render for key, render in zip(keys, renders)}
+    outcomes = dict(zip(unique, await asyncio.gather(*(
+        render_variant(key, *render[1:]) for key, render in unique.items()
+    ))))
+    # One result per requested variant, in request order
+    results = [
+        {
+            "target_frequency": target_freq_float,
+            "ai_preset": ai_preset,
+            "output_format": output_format.name,
+            "bitrate_kbps": bitrate_kbps,
+            "quality": quality,
+            **outcomes[key],
+        }
+        for key, (_, target_freq_float, ai_preset, output_format, bitrate_kbps, quality) in zip(keys, renders)
+    ]
+    return {"audio_stream_url": audio_stream_url, "source": source, "variants": results}
+
+async def source_waveform_path(audio_url: str, source: str) -> str:
+    """
+    Path of the source's cached waveform peaks. Without them the source is decoded (joining a
+    decode already under way, on a render slot otherwise), which records them on the way and
+    warms the PCM cache for the render that usually follows; from a cached decode they are
+    recomputed directly.
+    """
+    key = waveform_key(source, OUTPUT_SAMPLE_RATE)
+    decode_key = pcm_key(source, OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS)
+    if pcm_cache.peek(decode_key) is None:
+        await check_source_length(audio_url)
+        slot = None
+        if not decode_flights.in_flight(decode_key):
+            queued = time.perf_counter()
+            slot = await render_scheduler.admit()
+            record_stage("queue", time.perf_counter() - queued)
+        blocks = source_audio_blocks(audio_url, source)
+        try:
+            async for _ in timed_blocks(blocks, DECODE_SECONDS):
+                pass
+        finally:
+            await blocks.aclose()
+            if slot is not None:
+                slot.release(completed=False) # Not a render; keep it out of the wait estimates
+    path = waveform_cache.peek(key)
+    if path is None:
+        cached_path = pcm_cache.lookup(decode_key)
+        if cached_path is None:
+            raise HTTPException(status_code=502, detail="Could not decode the source audio for its waveform.")
+        waveform_cache.put(key, await asyncio.to_thread(peaks_from_pcm, cached_path, OUTPUT_CHANNELS))
+        path = waveform_cache.peek(key)
+    return path
+
+@app.get("/waveform")
+async def waveform_endpoint(audio_stream_url: str, pixels: int = WAVEFORM_DEFAULT_PIXELS, format: str = "json"):
+    """
+    Min/max peaks of a source for drawing its waveform without downloading any audio, in BBC
+    audiowaveform's JSON format (or its binary .dat format with format=dat). Peaks are stored
+    at several resolutions; the response uses the coarsest one with at least `pixels` points
+    (its `samples_per_pixel` says which). They are keyed by the canonical source, so every
+    frequency and every re-extraction of a track shares them, and come for free with the first
+    decode of the source (see source_audio_blocks).
 
-    target_freq_float: float | None = None
-    if target_frequency is not None:
+    A cache miss waits up to WAVEFORM_MISS_WAIT_SECONDS for the source to be decoded. If that
+    isn't enough, the decode carries on in the background and the answer is 202 with a
+    Retry-After; asking again later (or concurrently) joins the same decode.
+    """
+    if pixels <= 0:
+        raise HTTPException(status_code=400, detail="pixels must be a positive number.")
+    if format not in ("json", "dat"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'dat'.")
+    source = await resolve_source(audio_stream_url)
+    key = waveform_key(source, OUTPUT_SAMPLE_RATE)
+    path = waveform_cache.lookup(key)
+    headers = {"X-Waveform-Cache": "hit" if path else "miss"}
+    if path is None:
+        print(f"Waveform cache miss for {source}. Decoding...")
         try:
-            target_freq_float = float(target_frequency)
-            if target_freq_float <= 0:
-                 raise ValueError("Frequency must be positive")
-        except (ValueError, TypeError):
-             raise HTTPException(status_code=400, detail="Invalid target_frequency value. Must be a positive number.")
-
-    return StreamingResponse(
-        process_and_stream_audio_generator(audio_stream_url, target_freq_float, ai_preset),
-        media_type="audio/wav"
+            # The flight is shielded, so giving up on it here leaves the decode running
+            path = await asyncio.wait_for(waveform_flights.do(key, lambda: source_waveform_path(audio_stream_url, source)), timeout=config.WAVEFORM_MISS_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            headers["Retry-After"] = str(WAVEFORM_RETRY_AFTER_SECONDS)
+            return JSONResponse(status_code=202, content={"status": "processing", "detail": "Waveform is being computed; please retry."}, headers=headers)
+    frames, samples_per_pixel, peaks = load_peaks(path, pixels)
+    headers["X-Audio-Duration"] = f"{frames / OUTPUT_SAMPLE_RATE:.3f}"
+    if format == "dat":
+        return Response(peaks_dat(OUTPUT_SAMPLE_RATE, samples_per_pixel, peaks), media_type="application/octet-stream", headers=headers)
+    return JSONResponse(peaks_json(OUTPUT_SAMPLE_RATE, samples_per_pixel, peaks), headers=headers)
+
+@app.get("/render")
+async def render_endpoint(
+    request: Request,
+    audio_stream_url: str,
+    target_frequency: Optional[float] = None,
+    ai_preset: bool = False,
+    duration: Optional[float] = None,
+    quality: Optional[str] = None,
+):
+    """
+    GET-addressable version of /process_audio that can be used directly as an <audio> src.
+
+    Honors single `Range` requests: the requested byte window is mapped to sample offsets and
+    only that part of the track is fetched, decoded and processed, answered with
+    206 Partial Content. Seeking therefore never waits for a full render. `duration`
+    (seconds, as returned by /get_audio_info) is only used if the source can't be probed.
+    The "fast" quality tier isn't available here, since it changes the length of the track.
+    """
+    print(f"Received render request for {audio_stream_url} (range: {request.headers.get('range')})")
+    target_freq_float = parse_target_frequency(target_frequency)
+    requested_quality = quality
+    quality = parse_quality(quality)
+    if quality == "fast":
+        if requested_quality:
+            raise HTTPException(status_code=400, detail="quality 'fast' is not supported by /render; use /process_audio.")
+        quality = "standard" # Byte ranges map to source frames, which varispeed doesn't preserve
+
+    source = await resolve_source(audio_stream_url)
+    cache_key = render_key(source, target_freq_float, ai_preset, quality=quality)
+    cached_path = render_cache.lookup(cache_key)
+    if cached_path:
+        # FileResponse answers Range requests from the finished file
+        return CachedFileResponse(cached_path, media_type="audio/wav", headers={"X-Render-Cache": "hit"})
+
+    total_frames = await source_frame_count(audio_stream_url, source, duration)
+    check_track_length(total_frames / OUTPUT_SAMPLE_RATE)
+    total_size = WAV_HEADER_BYTES + total_frames * BYTES_PER_FRAME
+    byte_range = parse_byte_range(request.headers.get("range"), total_size)
+
+    headers = {"Accept-Ranges": "bytes", "X-Render-Cache": "miss"}
+    if byte_range is None:
+        status_code = 200
+        byte_start, byte_end = 0, total_size - 1
+    else:
+        status_code = 206
+        byte_start, byte_end = byte_range
+        headers["Content-Range"] = f"bytes {byte_start}-{byte_end}/{total_size}"
+    headers["Content-Length"] = str(byte_end - byte_start + 1)
+
+    # Players tend to fire the same Range request more than once; those share one window render
+    stream, render_headers = await start_render(
+        f"{cache_key}:{byte_start}-{byte_end}",
+        lambda: wav_byte_window(audio_stream_url, source, target_freq_float, ai_preset, total_frames, byte_start, byte_end, quality),
     )
+    headers.update(render_headers)
+    return StreamingResponse(stream, status_code=status_code, media_type="audio/wav", headers=headers)
+
+JOB_PROGRESS_INTERVAL_SECONDS = 0.5 # Throttles progress writes to the job store
+JOB_EVENTS_POLL_SECONDS = 0.5
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+async def admit_render_job():
+    """Background jobs don't give up on a busy server: they back off for Retry-After and try again."""
+    while True:
+        try:
+            return await render_scheduler.admit()
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise
+            await asyncio.sleep(min(float(e.headers.get("Retry-After", 5)), 30))
+
+async def run_render_job(job_id: str):
+    """Runs one queued render job to completion, recording per-stage progress in the job store."""
+    store = job_manager.store
+    job = await store.get(job_id)
+    if job is None or job["status"] != "queued":
+        return
+    params = job["params"]
+    cache_key = job["cache_key"]
+    audio_stream_url = params["audio_stream_url"]
+    output_format = OUTPUT_FORMATS[params["output_format"]]
+    async with job_manager.hold(job_id): # Keeps the job from being given up on while it runs
+        print(f"Render job {job_id}: starting")
+        await store.update(job_id, status="running", stage="waiting_for_slot", started_at=time.time())
+        try:
+            if render_cache.lookup(cache_key) is None:
+                source = await resolve_source(audio_stream_url)
+                try:
+                    total_frames = await source_frame_count(audio_stream_url, source, params.get("duration"))
+                except HTTPException:
+                    total_frames = None # Progress is reported as null rather than failing the job
+
+                slot = await admit_render_job()
+                done_frames = 0
+                last_report = time.monotonic()
+
+                def report_progress(frames: int):
+                    nonlocal done_frames, last_report
+                    done_frames += frames
+                    if total_frames and time.monotonic() - last_report >= JOB_PROGRESS_INTERVAL_SECONDS:
+                        last_report = time.monotonic()
+                        store.update_soon(job_id, progress=round(min(done_frames / total_frames, 0.99), 3))
+
+                stream, joined = render_flights.subscribe(cache_key, lambda: render_scheduler.hold(slot, render_cache.record(
+                    cache_key,
+                    process_and_stream_audio_generator(
+                        audio_stream_url, params["target_frequency"], params["ai_preset"], source,
+                        output_format, params["bitrate_kbps"], progress=report_progress, quality=params.get("quality", "standard"),
+                    ),
+                    finalize=patch_wav_sizes if output_format.codec is None else None,
+                )))
+                if joined:
+                    slot.release(completed=False) # Already being rendered for a streaming request
+                await store.update(job_id, stage="rendering", progress=0.0 if total_frames and not joined else None)
+                async for _ in stream:
+                    pass
+            await store.update(job_id, status="done", stage="done", progress=1.0, finished_at=time.time())
+            print(f"Render job {job_id}: done")
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Render job {job_id} failed: {detail}")
+            await store.update(job_id, status="failed", stage="failed", error=detail, finished_at=time.time())
+
+def job_view(job: dict) -> dict:
+    view = {k: v for k, v in job.items() if k != "cache_key"}
+    view["links"] = {
+        "status": f"/jobs/{job['job_id']}",
+        "events": f"/jobs/{job['job_id']}/events",
+        "result": f"/jobs/{job['job_id']}/result",
+    }
+    return view
+
+async def get_job_or_404(job_id: str) -> dict:
+    job = await job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def submit_render_job(
+    request: Request,
+    payload: dict = Body(...)
+):
+    """
+    Submits a render without holding the connection open. Takes the same payload as
+    /process_audio (plus an optional `duration`, used for progress if the source can't be
+    probed) and returns a job to poll (GET /jobs/{id}) or follow (GET /jobs/{id}/events, SSE)
+    until the result can be downloaded from GET /jobs/{id}/result. Resubmitting a render that
+    is already queued or running returns the existing job.
+    """
+    print(f"Received job submission with payload: {payload}")
+    audio_stream_url, target_freq_float, ai_preset, output_format, bitrate_kbps, quality = parse_render_request(payload, request)
+    source = await resolve_source(audio_stream_url)
+    cache_key = render_key(source, target_freq_float, ai_preset, output_format.name, bitrate_kbps, quality)
+    params = {
+        "audio_stream_url": audio_stream_url,
+        "target_frequency": target_freq_float,
+        "ai_preset": ai_preset,
+        "output_format": output_format.name,
+        "bitrate_kbps": bitrate_kbps,
+        "quality": quality,
+        "duration": payload.get("duration"),
+    }
+
+    store = job_manager.store
+    if render_cache.lookup(cache_key):
+        job = await store.create(cache_key, params, output_format.media_type, status="done")
+    else:
+        job = await store.find_active(cache_key)
+        if job is None:
+            await check_source_length(audio_stream_url, payload.get("duration"))
+            if not job_manager.has_capacity():
+                raise HTTPException(status_code=503, detail="Job queue is full; please retry.", headers={"Retry-After": "30"})
+            job = await store.create(cache_key, params, output_format.media_type)
+            job_manager.dispatch(job["job_id"])
+    return JSONResponse(status_code=202, content=job_view(job), headers={"Location": f"/jobs/{job['job_id']}"})
+
+@app.get("/jobs/{job_id}")
+async def get_render_job(job_id: str):
+    return job_view(await get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def render_job_events(job_id: str):
+    """Server-Sent Events: the job's state whenever it changes, until it is done or failed."""
+    await get_job_or_404(job_id)
+
+    async def events():
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            job = await job_manager.store.get(job_id)
+            if job is None:
+                return
+            view = job_view(job)
+            if view != last:
+                yield f"event: {job['status']}\ndata: {json.dumps(view)}\n\n"
+                last = view
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n" # Stops proxies from timing out an idle stream
+                last_sent = time.monotonic()
+            if job["status"] in ("done", "failed"):
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/result")
+async def render_job_result(job_id: str):
+    job = await get_job_or_404(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Render job failed: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Render job is {job['status']} ({job['stage']})", headers={"Retry-After": "2"})
+    cached_path = render_cache.lookup(job["cache_key"])
+    if not cached_path:
+        raise HTTPException(status_code=410, detail="Render result has expired from the cache; please resubmit.")
+    return CachedFileResponse(cached_path, media_type=job["media_type"], headers={"X-Render-Cache": "hit"})
 
 if __name__ == "__main__":
     import os
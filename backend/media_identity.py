@@ -0,0 +1,48 @@
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Cache keys for a resolved stream URL: maps it back to the media it was extracted from
+STREAM_KEY_PREFIX = "stream:"
+
+
+@lru_cache(maxsize=1)
+def _extractor_classes():
+    from yt_dlp.extractor import gen_extractor_classes
+    # YouTube first: it's nearly all the traffic, and matching it early skips ~1800 URL regexes.
+    # The generic extractor matches everything and has no stable ID, so it's left out.
+    classes = [ie for ie in gen_extractor_classes() if ie.ie_key() != "Generic"]
+    return sorted(classes, key=lambda ie: ie.ie_key() != "Youtube")
+
+
+def _without_playlist(url: str) -> str:
+    # Extraction runs with noplaylist, so `list=` never changes which media a watch URL resolves
+    # to; without stripping it, YouTube's playlist extractor would claim the URL instead
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in ("list", "index")]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+@lru_cache(maxsize=4096)
+def canonical_media_id(url: str) -> Optional[str]:
+    """
+    Resolves a page URL to `<extractor key>:<media id>` using yt-dlp's URL patterns, without
+    any network access, e.g. youtu.be/X, m.youtube.com/watch?v=X&t=30 and
+    music.youtube.com/watch?v=X all become `Youtube:X`. Returns None for URLs no extractor
+    recognizes or whose ID can't be read off the URL alone.
+    """
+    url = _without_playlist(url.strip())
+    for ie in _extractor_classes():
+        if ie.suitable(url):
+            media_id = ie.get_temp_id(url)
+            return f"{ie.ie_key()}:{media_id}" if media_id else None
+    return None
+
+
+def media_id_from_info(info: dict) -> Optional[str]:
+    """The same identity, read from an extracted yt-dlp info dict."""
+    extractor_key = info.get("extractor_key")
+    media_id = info.get("id")
+    if not extractor_key or not media_id or extractor_key == "Generic":
+        return None  # Generic IDs are just file names, not unique
+    return f"{extractor_key}:{media_id}"
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+from server_timing import record_stage
+
+EVENT_LOOP_PROBE_SECONDS = 0.5
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+# Pipeline stages. decode, dsp and encode are observed once per block (~1.5 s of audio), the
+# others once per call, so instrumentation stays a few microseconds per block.
+STAGE_SECONDS = Histogram(
+    "lambro_stage_seconds",
+    "Time spent in each processing stage: extract (yt-dlp), download (whole source), and per block decode, dsp and encode",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+
+class _Stage:
+    """One stage of STAGE_SECONDS; observations also count towards the current request's Server-Timing."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._histogram = STAGE_SECONDS.labels(name)
+
+    def observe(self, seconds: float):
+        self._histogram.observe(seconds)
+        record_stage(self.name, seconds)
+
+
+EXTRACT_SECONDS = _Stage("extract")
+DOWNLOAD_SECONDS = _Stage("download")
+DECODE_SECONDS = _Stage("decode")
+DSP_SECONDS = _Stage("dsp")
+ENCODE_SECONDS = _Stage("encode")
+
+AUDIO_INFO_SECONDS = Histogram(
+    "lambro_audio_info_seconds",
+    "/get_audio_info latency by outcome (hit: served from cache, miss: extracted, error)",
+    ["result"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+RENDER_FIRST_BYTE_SECONDS = Histogram(
+    "lambro_render_first_byte_seconds",
+    "Time from the start of a render to its first audio bytes",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+RENDER_SECONDS = Histogram(
+    "lambro_render_seconds",
+    "Duration of renders that ran to completion",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+BYTES = Counter(
+    "lambro_audio_bytes",
+    "Audio bytes downloaded from sources (in) and produced by renders (out, before fan-out to coalesced requests)",
+    ["direction"],
+)
+BYTES_IN = BYTES.labels("in")
+BYTES_OUT = BYTES.labels("out")
+RENDERS_IN_FLIGHT = Gauge("lambro_renders_in_flight", "Renders currently producing audio")
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "lambro_event_loop_lag_seconds",
+    f"How late a {EVENT_LOOP_PROBE_SECONDS}s timer on the event loop fires; high values mean something is blocking the loop",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+async def timed_blocks(blocks: AsyncIterator[Any], histogram) -> AsyncIterator[Any]:
+    """Passes `blocks` through, observing how long each one took to arrive. The caller still closes `blocks`."""
+    iterator = blocks.__aiter__()
+    while True:
+        started = time.perf_counter()
+        try:
+            block = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        histogram.observe(time.perf_counter() - started)
+        yield block
+
+
+async def monitor_event_loop():
+    """Runs for the app's lifetime, sampling event-loop lag."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(EVENT_LOOP_PROBE_SECONDS)
+        EVENT_LOOP_LAG_SECONDS.observe(max(time.monotonic() - started - EVENT_LOOP_PROBE_SECONDS, 0.0))
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None  # Not Linux, or the worker just exited
+
+
+def _cpu_times(pid: int) -> Optional[tuple[float, float]]:
+    """(own CPU seconds, CPU seconds of its exited and reaped children) of a process."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()  # The command name may contain spaces
+        utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+        return (utime + stime) / CLOCK_TICKS, (cutime + cstime) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class AppStateCollector:
+    """
+    Exposes counters the app already keeps (cache hits and sizes, render queue, in-flight
+    deduplication, DSP workers) by reading them at scrape time, so they cost nothing in between.
+    The main process's own RSS and CPU come from prometheus_client's default process collector.
+    """
+
+    def __init__(self, caches: dict[str, Any], flights: dict[str, Any], scheduler, job_manager, dsp_executor):
+        self.caches = caches
+        self.flights = flights
+        self.scheduler = scheduler
+        self.job_manager = job_manager
+        self.dsp_executor = dsp_executor
+
+    def collect(self):
+        hits = CounterMetricFamily("lambro_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("lambro_cache_misses", "Cache misses", labels=["cache"])
+        entries = GaugeMetricFamily("lambro_cache_entries", "Entries held (disk caches only)", labels=["cache"])
+        size = GaugeMetricFamily("lambro_cache_size_bytes", "Bytes held (disk caches only)", labels=["cache"])
+        for name, cache in self.caches.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            if hasattr(cache, "total_bytes"):
+                entries.add_metric([name], len(cache))
+                size.add_metric([name], cache.total_bytes)
+        yield from (hits, misses, entries, size)
+
+        coalesced = CounterMetricFamily("lambro_coalesced_requests", "Requests that joined identical in-flight work", labels=["flight"])
+        for name, flight in self.flights.items():
+            coalesced.add_metric([name], flight.coalesced)
+        yield coalesced
+
+        status = self.scheduler.status()
+        yield GaugeMetricFamily("lambro_render_slots", "Render slots", value=status["slots"])
+        yield GaugeMetricFamily("lambro_render_slots_active", "Render slots in use (including speculative work)", value=status["active"])
+        yield GaugeMetricFamily("lambro_render_slots_speculative", "Render slots held by preemptible speculative work", value=status["speculative"])
+        yield GaugeMetricFamily("lambro_render_queue_depth", "Renders waiting for a slot", value=status["queued"])
+        yield CounterMetricFamily("lambro_render_admitted", "Renders admitted by the scheduler", value=status["admitted"])
+        yield CounterMetricFamily("lambro_render_rejected", "Renders rejected with 503", value=status["rejected"])
+        yield GaugeMetricFamily("lambro_job_queue_depth", "Render jobs waiting for a local worker", value=self.job_manager.queue_depth())
+
+        # Labelled by worker slot (0..DSP_WORKERS-1), not PID, so a restarted pool doesn't mint new series
+        rss = GaugeMetricFamily("lambro_dsp_worker_rss_bytes", "Resident memory of each DSP worker process", labels=["worker"])
+        dsp_worker_cpu = 0.0
+        for worker, pid in enumerate(self.dsp_executor.worker_pids()):
+            value = _rss_bytes(pid)
+            if value is not None:
+                rss.add_metric([str(worker)], value)
+            cpu_times = _cpu_times(pid)
+            if cpu_times is not None:
+                dsp_worker_cpu += cpu_times[0]
+        yield rss
+
+        # Together with process_cpu_seconds_total this is the whole app's CPU use; "exited" is
+        # mostly ffmpeg decoders and encoders, counted once they finish
+        child_cpu = CounterMetricFamily("lambro_child_cpu_seconds", "CPU time of child processes", labels=["kind"])
+        child_cpu.add_metric(["dsp_workers"], dsp_worker_cpu)
+        own_cpu_times = _cpu_times(os.getpid())
+        if own_cpu_times is not None:
+            child_cpu.add_metric(["exited"], own_cpu_times[1])
+        yield child_cpu
+
+
+def register_collector(collector: AppStateCollector):
+    REGISTRY.register(collector)
+
+
+def unregister_collector(collector: AppStateCollector):
+    REGISTRY.unregister(collector)
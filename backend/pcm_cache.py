@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+import config
+from disk_cache import DiskCache
+
+PCM_FORMAT_VERSION = 1
+
+
+def pcm_key(source: str, sample_rate: int, channels: int, audio_filter: Optional[str] = None) -> str:
+    """Decoded audio depends only on the source and the decoder settings, never on the target frequency."""
+    parts = {
+        "v": PCM_FORMAT_VERSION,
+        "source": source,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "filter": audio_filter,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def block_to_bytes(block: np.ndarray) -> bytes:
+    return np.ascontiguousarray(block, dtype=np.float32).tobytes()
+
+
+async def pcm_chunks(blocks: AsyncIterator[np.ndarray]) -> AsyncIterator[bytes]:
+    """A decode as the raw float32 bytes the cache stores, one chunk per block."""
+    try:
+        async for block in blocks:
+            yield block_to_bytes(block)
+    finally:
+        await blocks.aclose()
+
+
+async def pcm_blocks(chunks: AsyncIterator[bytes], channels: int) -> AsyncIterator[np.ndarray]:
+    """The inverse of pcm_chunks: (frames, channels) float32 blocks, as read-only views of each chunk."""
+    try:
+        async for chunk in chunks:
+            yield np.frombuffer(chunk, dtype=np.float32).reshape(-1, channels)
+    finally:
+        await chunks.aclose()
+
+
+def cached_frame_count(path: str, channels: int) -> int:
+    return os.path.getsize(path) // (4 * channels)
+
+
+async def read_pcm_blocks(path: str, block_frames: int, channels: int, start_frame: int = 0) -> AsyncIterator[np.ndarray]:
+    """
+    Yields a cached decode as (frames, channels) float32 blocks straight out of a memory map,
+    optionally starting part-way in (seeking is free).
+
+    Blocks are views into the mapping, so only the pages actually touched by the DSP stage get
+    read from disk and nothing is copied up front. The mapping keeps the data alive even if
+    the entry is evicted mid-stream.
+    """
+    pcm = np.memmap(path, dtype=np.float32, mode="r")
+    pcm = pcm[: len(pcm) - len(pcm) % channels].reshape(-1, channels)
+    for start in range(start_frame, len(pcm), block_frames):
+        yield pcm[start:start + block_frames]
+
+
+# Process-wide cache of decoded float32 PCM; indexed by the app lifespan in main.py
+pcm_cache = DiskCache("PCM cache", config.PCM_CACHE_DIR, config.PCM_CACHE_MAX_BYTES)
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+import config
+
+
+class SpeculativePrefetcher:
+    """
+    Starts background work on a source as soon as /get_audio_info has resolved it, betting that
+    a /process_audio for one of a few popular frequencies follows right after.
+
+    This only keeps track of what is being prefetched: at most one task per stream URL and
+    `max_sources` at once, with further requests simply skipped. The work itself is supplied by
+    the app (main.py) and runs on idle render slots only, so it never delays real requests.
+    """
+
+    def __init__(self, enabled: bool, frequencies: list[float], max_sources: int):
+        self.enabled = enabled
+        self.frequencies = frequencies
+        self.max_sources = max_sources
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._run: Optional[Callable[[str], Awaitable[None]]] = None
+        self.started = 0
+        self.skipped = 0
+
+    def start(self, run: Callable[[str], Awaitable[None]]):
+        """Called by the app lifespan with the coroutine that prefetches one stream URL."""
+        self._run = run
+        if self.enabled:
+            print(f"Speculative prefetch: up to {self.max_sources} source(s), pre-rendering {self.frequencies or 'nothing'}")
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def schedule(self, audio_stream_url: str):
+        if not self.enabled or self._run is None or audio_stream_url in self._tasks:
+            return
+        if len(self._tasks) >= self.max_sources:
+            self.skipped += 1
+            return
+        self.started += 1
+        task = asyncio.create_task(self._run(audio_stream_url))
+        self._tasks[audio_stream_url] = task
+        task.add_done_callback(lambda t: self._finished(audio_stream_url, t))
+
+    def _finished(self, audio_stream_url: str, task: asyncio.Task):
+        self._tasks.pop(audio_stream_url, None)
+        if task.cancelled():
+            return  # Preempted by a real request (or shutting down)
+        if task.exception() is not None:
+            print(f"Speculative prefetch of {audio_stream_url} failed: {task.exception()}")
+
+
+# Process-wide prefetcher; started by the app lifespan in main.py
+prefetcher = SpeculativePrefetcher(
+    enabled=config.PREFETCH_ENABLED,
+    frequencies=config.PREFETCH_FREQUENCIES,
+    max_sources=config.PREFETCH_MAX_SOURCES,
+)
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import gc
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+import config
+
+PROFILE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+_active_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("active_profile", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _frame_stack(frame) -> list[str]:
+    """Root-first stack of a live thread."""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(awaitable) -> list[str]:
+    """Root-first chain of coroutines (and async generators) a suspended task is waiting in."""
+    stack = []
+    while awaitable is not None:
+        if type(awaitable).__name__ in ("async_generator_asend", "async_generator_athrow"):
+            # `async for` awaits a wrapper that doesn't expose its generator, except to the GC
+            awaitable = next((r for r in gc.get_referents(awaitable) if hasattr(r, "ag_frame")), None)
+            continue
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break  # A Future: the bottom of the chain
+        stack.append(_frame_name(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return stack
+
+
+class RequestProfile:
+    """Stack samples of one request, counted per distinct stack."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.tasks: list[asyncio.Task] = []
+        self.stacks: Counter = Counter()
+        self.started = time.monotonic()
+
+    def folded(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler:
+    """
+    Opt-in sampling profiler for single requests, for diagnosing slow renders in production.
+
+    A request carrying the configured token in the X-Debug-Profile header is profiled from
+    start to last byte. Every task it creates (including the render it starts and the download
+    and decode tasks under it) is tracked through a task factory, and a background thread
+    samples them every `interval` seconds: the task running on the event loop from the loop
+    thread's live stack ("on-cpu"), the others from the chain of coroutines they are suspended
+    in ("awaiting"). Work done in DSP worker processes or ffmpeg shows up as the await that is
+    waiting for it. Profiles are written to `directory` in the folded-stack format read by
+    flamegraph.pl, speedscope and inferno; only the newest `keep` are retained. Disabled
+    (with no task factory installed) when no token is configured.
+    """
+
+    def __init__(self, token: str, directory: str, interval: float, keep: int):
+        self.token = token
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._profiles: list[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def start(self):
+        """Hooks task creation on the running loop. Called once at app startup."""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        previous_factory = self._loop.get_task_factory()
+
+        def task_factory(loop, coro, **kwargs):
+            if previous_factory is not None:
+                task = previous_factory(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            profile = _active_profile.get()
+            if profile is not None:
+                with self._lock:
+                    profile.tasks.append(task)
+            return task
+
+        self._loop.set_task_factory(task_factory)
+        print(f"Profiler: enabled, sampling every {self.interval * 1000:g} ms into {self.directory}")
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return self.enabled and token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def begin(self) -> RequestProfile:
+        """Starts profiling the current task and everything it goes on to create."""
+        profile = RequestProfile()
+        profile.tasks.append(asyncio.current_task())
+        _active_profile.set(profile)
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    async def finish(self, profile: RequestProfile, server_timing: str):
+        """Stops sampling `profile` and stores it, with the request's final Server-Timing value alongside."""
+        with self._lock:
+            self._profiles.remove(profile)
+        elapsed = time.monotonic() - profile.started
+        await asyncio.to_thread(self._store, profile, server_timing)
+        print(f"Profiler: stored {profile.id} ({sum(profile.stacks.values())} samples over {elapsed:.2f}s)")
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:  # Also keeps finish() from storing a profile mid-sample
+                if not self._profiles:
+                    self._thread = None
+                    return
+                running = asyncio.current_task(self._loop)
+                frame = sys._current_frames().get(self._loop_thread)
+                for profile in self._profiles:
+                    profile.tasks = [task for task in profile.tasks if not task.done()]
+                    for task in profile.tasks:
+                        if task is running:
+                            stack = ["on-cpu", *_frame_stack(frame)]
+                        else:
+                            stack = ["awaiting", *_await_stack(task.get_coro())]
+                        profile.stacks[tuple(stack)] += 1
+                del frame
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _store(self, profile: RequestProfile, server_timing: str):
+        with open(self._path(profile.id, "folded"), "w") as f:
+            f.write(profile.folded())
+        with open(self._path(profile.id, "timing"), "w") as f:
+            f.write(server_timing)
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".folded")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in profiles[:-max(self.keep, 1)]:
+            for extension in ("folded", "timing"):
+                try:
+                    os.remove(self._path(entry.name.removesuffix(".folded"), extension))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id: str) -> tuple[Optional[str], str]:
+        """Path of a stored profile (None if unknown) and the Server-Timing value of its request."""
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id) or not os.path.exists(self._path(profile_id, "folded")):
+            return None, ""
+        try:
+            with open(self._path(profile_id, "timing")) as f:
+                server_timing = f.read()
+        except FileNotFoundError:
+            server_timing = ""
+        return self._path(profile_id, "folded"), server_timing
+
+
+profiler = SamplingProfiler(
+    config.PROFILE_TOKEN,
+    config.PROFILE_DIR,
+    config.PROFILE_INTERVAL_SECONDS,
+    config.PROFILE_KEEP,
+)
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+import config
+from disk_cache import DiskCache
+
+RENDER_FORMAT_VERSION = 2  # Bump when the rendered bytes change for the same inputs
+
+
+def source_identity(audio_url: str) -> str:
+    """
+    Normalizes a source URL to something stable across extractions.
+
+    Signed googlevideo URLs change on every extraction (expire, ip, sig, ...), but their `id`
+    and `itag` parameters identify the underlying media and format. Other URLs are keyed on
+    host, path and sorted query.
+    """
+    parts = urlsplit(audio_url)
+    query = parse_qs(parts.query)
+    if parts.hostname and parts.hostname.endswith("googlevideo.com") and "id" in query:
+        return f"googlevideo:{query['id'][0]}:{query.get('itag', [''])[0]}"
+    sorted_query = "&".join(f"{k}={v}" for k in sorted(query) for v in query[k])
+    return f"{(parts.hostname or '').lower()}{parts.path}?{sorted_query}"
+
+
+def render_key(
+    source: str,
+    target_frequency: Optional[float],
+    ai_preset: bool,
+    output_format: str = "wav",
+    bitrate_kbps: Optional[int] = None,
+    quality: str = "standard",
+) -> str:
+    frequency = None if target_frequency is None else round(float(target_frequency), config.RENDER_CACHE_FREQUENCY_DECIMALS)
+    parts = {
+        "v": RENDER_FORMAT_VERSION,
+        "source": source,
+        "frequency": frequency,
+        "ai_preset": bool(ai_preset),
+        "format": output_format,
+        "bitrate_kbps": bitrate_kbps,
+        "quality": quality,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class CachedFileResponse(FileResponse):
+    """
+    FileResponse for cache hits.
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers it and falls back
+    to Starlette's chunked reads, with larger chunks than the default, when it doesn't.
+    Range requests are handled by FileResponse as usual.
+    """
+
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" not in extensions or b"range" in dict(scope["headers"]):
+            await super().__call__(scope, receive, send)
+            return
+        with open(self.path, "rb") as file:
+            self.set_stat_headers(os.fstat(file.fileno()))
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"].upper() == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                await send({"type": "http.response.zerocopysend", "file": file, "more_body": False})
+
+
+# Process-wide cache of finished renders; indexed by the app lifespan in main.py
+render_cache = DiskCache("Render cache", config.RENDER_CACHE_DIR, config.RENDER_CACHE_MAX_BYTES)
@@ -0,0 +1,182 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi import HTTPException
+
+import config
+
+RENDER_SECONDS_SMOOTHING = 0.2  # EWMA weight of the latest render duration
+INITIAL_RENDER_SECONDS = 10.0  # Wait estimates before any render has finished
+
+
+class RenderSlot:
+    """A granted render slot. Released exactly once, when the render's stream ends."""
+
+    def __init__(self, scheduler: "RenderScheduler", position: int, waited: float, speculative_key: Optional[str] = None):
+        self.scheduler = scheduler
+        self.position = position  # Queue position on arrival, 0 if a slot was free
+        self.waited = waited
+        self.speculative_key = speculative_key  # Set while the slot may be taken back for a real request
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self, completed: bool = True):
+        if self._released:
+            return
+        self._released = True
+        self.scheduler._forget_speculative(self)
+        self.scheduler._release(time.monotonic() - self.started if completed else None)
+
+    def headers(self) -> dict:
+        return {"X-Queue-Position": str(self.position), "X-Queue-Wait": f"{self.waited:.3f}"}
+
+
+class RenderScheduler:
+    """
+    Admission control for renders: a fixed number of slots, a bounded FIFO queue in front of
+    them, and fast rejection beyond that.
+
+    A request that finds a free slot starts immediately. Otherwise it queues, unless
+    `max_queue` requests are already waiting, in which case it gets a 503 straight away with a
+    Retry-After estimate. A queued request that isn't admitted within `max_wait` seconds gets
+    the same 503. Admitted renders therefore only ever compete with `slots - 1` others, so
+    their latency stays flat under overload instead of every render slowing down together.
+    Wait estimates come from a moving average of render durations.
+
+    Speculative work (see prefetch.py) only gets a slot that is idle, and gives it back as soon
+    as a real request would otherwise have to queue.
+    """
+
+    def __init__(self, slots: int, max_queue: int, max_wait: float):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._speculative: dict[str, tuple[RenderSlot, Callable[[], None]]] = {}  # key -> (slot, preempt)
+        self.render_seconds = INITIAL_RENDER_SECONDS
+        self.admitted = 0
+        self.rejected = 0
+
+    def estimated_wait(self, position: int) -> float:
+        """Seconds until the request at queue `position` (1-based) should get a slot."""
+        return math.ceil(position / self.slots) * self.render_seconds
+
+    def status(self) -> dict:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "speculative": len(self._speculative),
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "average_render_seconds": round(self.render_seconds, 2),
+            "estimated_wait_seconds": round(self.estimated_wait(len(self._waiters) + 1), 1) if self.active >= self.slots else 0.0,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    def _reject(self, reason: str, position: int):
+        self.rejected += 1
+        retry_after = max(1, math.ceil(self.estimated_wait(position)))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy: {reason}. Estimated wait {retry_after}s; please retry.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def admit(self) -> RenderSlot:
+        if self.active < self.slots and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return RenderSlot(self, 0, 0.0)
+
+        position = len(self._waiters) + 1
+        if position > self.max_queue:
+            self._reject(f"render queue is full ({self.max_queue} waiting)", position)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        arrived = time.monotonic()
+        self._preempt_speculative()
+        print(f"Render scheduler: queued at position {position} (estimated wait {self.estimated_wait(position):.0f}s)")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self._release(None)  # Granted just as we gave up: pass the slot on
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(f"no render slot within {self.max_wait:.0f}s", position)
+        self.admitted += 1
+        return RenderSlot(self, position, time.monotonic() - arrived)
+
+    def try_admit_speculative(self, key: str, preempt: Callable[[], None]) -> Optional[RenderSlot]:
+        """
+        A slot for speculative work on `key`, or None unless one is idle right now. If a real
+        request needs the slot later, `preempt()` is called and the work must stop (releasing it).
+        """
+        if self.active >= self.slots or self._waiters:
+            return None
+        self.active += 1
+        slot = RenderSlot(self, 0, 0.0, speculative_key=key)
+        self._speculative[key] = (slot, preempt)
+        return slot
+
+    def promote(self, key: str):
+        """A real request now depends on the speculative work for `key`, so it can no longer be preempted."""
+        entry = self._speculative.pop(key, None)
+        if entry is not None:
+            entry[0].speculative_key = None
+            print(f"Render scheduler: speculative render {key} promoted by a real request")
+
+    def _forget_speculative(self, slot: RenderSlot):
+        if slot.speculative_key is not None and self._speculative.get(slot.speculative_key, (None,))[0] is slot:
+            del self._speculative[slot.speculative_key]
+
+    def _preempt_speculative(self):
+        # Real requests take precedence: the preempted work releases its slot, which _release()
+        # then hands to the longest waiting request
+        if self._speculative:
+            key, (slot, preempt) = self._speculative.popitem()
+            slot.speculative_key = None
+            print(f"Render scheduler: preempting speculative render {key}")
+            preempt()
+
+    def _release(self, render_seconds: Optional[float]):
+        if render_seconds is not None:
+            self.render_seconds += RENDER_SECONDS_SMOOTHING * (render_seconds - self.render_seconds)
+        # Hand the slot straight to the longest waiting request, so a newcomer can't jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def hold(self, slot: RenderSlot, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Passes `stream` through, keeping `slot` until it ends (completed, failed or abandoned)."""
+        completed = False
+        try:
+            async for chunk in stream:
+                yield chunk
+            completed = True
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                slot.release(completed)
+
+
+# Process-wide scheduler for /process_audio and /render
+render_scheduler = RenderScheduler(
+    slots=config.RENDER_SLOTS,
+    max_queue=config.RENDER_QUEUE_MAX,
+    max_wait=config.RENDER_QUEUE_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,78 @@
+import contextvars
+import time
+from typing import Optional
+
+from profiler import profiler
+
+PROFILE_HEADER = "X-Debug-Profile"
+
+_current_timings: contextvars.ContextVar[Optional["RequestTimings"]] = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Time spent in each stage on behalf of one request, summed over blocks."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self) -> str:
+        """Server-Timing value: each stage so far, plus `total`, the time since the request arrived."""
+        metrics = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in list(self.stages.items())]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+def record_stage(stage: str, seconds: float):
+    """Counts `seconds` of `stage` towards the current request, if there is one."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header with per-stage durations (extract, queue, download, decode,
+    dsp, encode) to every response, and profiles requests that carry the profiling token in
+    X-Debug-Profile (see profiler.SamplingProfiler).
+
+    Timings are collected through a context variable, so the tasks a request starts (e.g. its
+    render) report into it too; a request that joins someone else's render only sees its own
+    wait. Streamed renders send their headers once the first block is ready (see
+    start_render), so for them the header covers the work up to the first byte: there are no
+    trailers to carry the rest. The full render's timings are stored alongside its profile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        profile = None
+        debug_token = next((value for name, value in scope["headers"] if name == PROFILE_HEADER.lower().encode()), None)
+        # Fetching a profile sends the token too, but isn't worth a profile of its own
+        if debug_token is not None and not scope["path"].startswith("/debug/") and profiler.authorized(debug_token.decode("latin-1")):
+            profile = profiler.begin()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (b"server-timing", timings.header().encode("latin-1"))]
+                if profile is not None:
+                    headers.append((b"x-profile-id", profile.id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current_timings.reset(token)
+            if profile is not None:
+                await profiler.finish(profile, timings.header())
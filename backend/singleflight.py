@@ -0,0 +1,164 @@
+import asyncio
+import os
+import tempfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Union
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller starts the work; callers arriving while it is still running await the same
+    result (or exception) instead of repeating it. Nothing is kept once the call finishes, so
+    this only deduplicates work that is in flight; caching results is the caller's business.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            # If every caller went away, nobody else would retrieve the exception
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+            print(f"{self.name}: joined in-flight call for {key}")
+        # A caller that disconnects must not cancel the work the others are waiting on
+        return await asyncio.shield(task)
+
+
+class _ReplayBuffer:
+    """
+    Every chunk a broadcast has produced, so subscribers can read it from the start.
+
+    The first `memory_budget` bytes are kept in memory; everything after spills to an unlinked
+    temp file and is read back with pread, so a long render costs disk (and page cache) rather
+    than RSS. The file goes away with the buffer. A budget of None keeps everything in memory.
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None, spool_dir: Optional[str] = None):
+        self.memory_budget = memory_budget
+        self.spool_dir = spool_dir
+        self._chunks: list[Union[bytes, tuple[int, int]]] = []  # In memory, or (offset, length) in the file
+        self._memory_bytes = 0
+        self._file = None
+        self._file_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def append(self, chunk: bytes):
+        if self._file is None and (self.memory_budget is None or self._memory_bytes + len(chunk) <= self.memory_budget):
+            self._chunks.append(chunk)
+            self._memory_bytes += len(chunk)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.spool_dir)
+        os.pwrite(self._file.fileno(), chunk, self._file_bytes)
+        self._chunks.append((self._file_bytes, len(chunk)))
+        self._file_bytes += len(chunk)
+
+    def __getitem__(self, index: int) -> bytes:
+        chunk = self._chunks[index]
+        if isinstance(chunk, bytes):
+            return chunk
+        offset, length = chunk
+        return os.pread(self._file.fileno(), length, offset)
+
+
+class _Broadcast:
+    """One producer task pumping a byte stream into a replay buffer read by any number of subscribers."""
+
+    def __init__(self, stream: AsyncIterator[bytes], on_done: Callable[[], None], chunks: _ReplayBuffer):
+        self._stream = stream
+        self._on_done = on_done
+        self._chunks = chunks
+        self._changed = asyncio.Event()
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._task = asyncio.create_task(self._pump())
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self):
+        try:
+            async for chunk in self._stream:
+                self._chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._on_done()
+            self._notify()
+            await self._stream.aclose()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self._chunks):
+                    yield self._chunks[index]
+                    index += 1
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self._done:
+                # Everyone hung up: stop the work (and let the render cache discard the partial file)
+                self._on_done()
+                self._task.cancel()
+
+
+class StreamFanout:
+    """
+    Single-flight for streaming responses.
+
+    The first request for a key starts the stream; identical requests arriving while it is
+    still running subscribe to it and receive the same bytes from the beginning (already
+    produced chunks are replayed, so a render's output is held once per key rather than
+    computed once per request). Up to `memory_budget` bytes per stream are held in memory, the
+    rest in a temp file in `spool_dir` (see _ReplayBuffer), so long streams don't grow RSS. The
+    producer is cancelled when its last subscriber leaves.
+    """
+
+    def __init__(self, name: str, memory_budget: Optional[int] = None, spool_dir: Optional[str] = None):
+        self.name = name
+        self.memory_budget = memory_budget
+        self.spool_dir = spool_dir
+        self._broadcasts: dict[str, _Broadcast] = {}
+        self.coalesced = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._broadcasts
+
+    def subscribe(self, key: str, factory: Callable[[], AsyncIterator[bytes]]) -> tuple[AsyncIterator[bytes], bool]:
+        """Returns (stream, joined); `joined` is True if the stream was already in flight."""
+        broadcast = self._broadcasts.get(key)
+        joined = broadcast is not None
+        if broadcast is None:
+            def forget():
+                if self._broadcasts.get(key) is broadcast:
+                    del self._broadcasts[key]
+            broadcast = _Broadcast(factory(), forget, _ReplayBuffer(self.memory_budget, self.spool_dir))
+            self._broadcasts[key] = broadcast
+        else:
+            self.coalesced += 1
+            print(f"{self.name}: {broadcast.subscribers} subscriber(s) already on {key}, joining")
+        return broadcast.subscribe(), joined
@@ -0,0 +1,193 @@
+import asyncio
+import re
+import struct
+from typing import AsyncIterator, Optional
+
+import numpy as np
+from fastapi import HTTPException
+
+from downloader import source_downloader
+
+OUTPUT_SAMPLE_RATE = 44100  # Every stream is delivered at 44.1kHz stereo, s16 PCM
+OUTPUT_CHANNELS = 2
+STREAM_BLOCK_FRAMES = 65536  # ~1.5 s at 44.1kHz; the unit of work for decode -> DSP -> encode
+WAV_HEADER_BYTES = 44
+
+
+def wav_header(sample_rate: int, channels: int, data_size: Optional[int] = None, bits_per_sample: int = 16) -> bytes:
+    """
+    Builds a 44-byte PCM WAV header.
+
+    When the data size is not known up front (streaming), the RIFF and data chunk sizes are set
+    to the largest block-aligned value a 32-bit field can hold. Browsers and ffmpeg treat this
+    as "read until EOF".
+    """
+    block_align = channels * bits_per_sample // 8
+    if data_size is None:
+        data_size = (0xFFFFFFFF - 36) // block_align * block_align
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample,
+        b'data', data_size,
+    )
+
+
+def patch_wav_sizes(f, total_bytes: int):
+    """Replaces the streaming placeholder sizes in a finished WAV file with the real ones."""
+    data_size = total_bytes - WAV_HEADER_BYTES
+    f.seek(4)
+    f.write(struct.pack('<I', 36 + data_size))
+    f.seek(40)
+    f.write(struct.pack('<I', data_size))
+
+
+async def _feed_decoder(audio_url: str, stdin: asyncio.StreamWriter):
+    """Downloads the source (see downloader.py) and pipes it into the decoder as it arrives."""
+    chunks = source_downloader.stream(audio_url)
+    try:
+        async for chunk in chunks:
+            stdin.write(chunk)
+            await stdin.drain()  # Backpressure: the decoder only takes what it can handle
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # Decoder exited early; its return code tells the real story
+    finally:
+        await chunks.aclose()
+        if not stdin.is_closing():
+            stdin.close()
+
+
+async def decode_audio_blocks(
+    audio_url: str,
+    block_frames: int = STREAM_BLOCK_FRAMES,
+    sample_rate: int = OUTPUT_SAMPLE_RATE,
+    channels: int = OUTPUT_CHANNELS,
+    audio_filter: Optional[str] = None,
+    start_seconds: float = 0.0,
+    duration_seconds: Optional[float] = None,
+) -> AsyncIterator[np.ndarray]:
+    """
+    Yields the decoded source as (frames, channels) float32 blocks while it is still downloading.
+
+    The download is piped chunk by chunk into an ffmpeg decoder which also normalizes the
+    channel layout and sample rate, so no separate resample pass is needed. Peak memory is a
+    handful of blocks regardless of track length.
+
+    With a `start_seconds` offset ffmpeg opens the URL itself instead, so it can use HTTP Range
+    requests and the container index to jump straight to the requested position rather than
+    downloading everything before it. The seek is accurate to within the codec's priming
+    delay (a few milliseconds). The same goes for a `duration_seconds` limit, so a short excerpt
+    only fetches the bytes it covers.
+    """
+    direct = start_seconds > 0 or duration_seconds is not None
+    if direct:
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-ss', f"{start_seconds:.6f}", '-i', audio_url, '-vn']
+    else:
+        command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-vn']
+    if duration_seconds is not None:
+        command += ['-t', f"{duration_seconds:.6f}"]
+    if audio_filter:
+        command += ['-af', audio_filter]
+    command += ['-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(sample_rate), 'pipe:1']
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL if direct else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    feeder = None if direct else asyncio.create_task(_feed_decoder(audio_url, process.stdin))
+    stderr_reader = asyncio.create_task(process.stderr.read())
+    block_bytes = block_frames * channels * 4
+    try:
+        while True:
+            try:
+                data = await process.stdout.readexactly(block_bytes)
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+            usable = len(data) - len(data) % (channels * 4)
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, channels)
+            if len(data) < block_bytes:
+                break
+
+        if feeder is not None:
+            await feeder  # Surfaces fetch errors (e.g. a 403 from an expired stream URL)
+        returncode = await process.wait()
+        if returncode != 0:
+            stderr_str = (await stderr_reader).decode(errors='ignore').strip()
+            print(f"ffmpeg decoder stderr:\n{stderr_str}")
+            raise HTTPException(status_code=500, detail=f"Audio decoding failed (ffmpeg code {returncode})")
+    finally:
+        if feeder is not None and not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        if not stderr_reader.done():
+            stderr_reader.cancel()
+
+
+async def probe_duration(audio_url: str) -> Optional[float]:
+    """Reads the container duration with ffmpeg (which only fetches what it needs to parse the header)."""
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-i', audio_url,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr_data = await process.communicate()  # Exits non-zero (no output file); the banner is all we need
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", stderr_data.decode(errors='ignore'))
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def parse_byte_range(range_header: str, total_size: int) -> Optional[tuple[int, int]]:
+    """
+    Parses a single-range `Range: bytes=...` header into an inclusive (start, end) pair.
+
+    Returns None for headers this server doesn't honor (other units, multiple ranges), in
+    which case the whole resource should be sent. Raises 416 for unsatisfiable ranges.
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", range_header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), total_size - 1) if last else total_size - 1
+    else:  # Suffix range: the last N bytes
+        start = max(total_size - int(last), 0)
+        end = total_size - 1
+    if start >= total_size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={"Content-Range": f"bytes */{total_size}"})
+    return start, end
+
+
+async def prime_stream(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Runs a byte stream up to its first chunk before the response starts.
+
+    StreamingResponse sends its status line before consuming the iterator, so errors raised
+    later can only cut the stream short. Priming lets fetch/decode failures that happen
+    before the first block still surface as proper HTTP errors.
+    """
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=500, detail="Audio processing resulted in no audio data.")
+
+    async def resumed():
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    return resumed()
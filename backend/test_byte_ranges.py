@@ -0,0 +1,86 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import main
+from dsp import PCM16Converter
+from streaming import OUTPUT_CHANNELS, OUTPUT_SAMPLE_RATE, WAV_HEADER_BYTES, parse_byte_range, wav_header
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-499", (0, 499)),
+    ("bytes=500-", (500, 999)),  # Open-ended
+    ("bytes=-200", (800, 999)),  # Suffix
+    ("bytes=-5000", (0, 999)),  # Suffix longer than the resource
+    ("bytes=900-5000", (900, 999)),  # Ends past EOF
+    ("bytes=999-999", (999, 999)),
+    (" bytes = 10 - 20 ", (10, 20)),
+    ("bytes=0-1,5-9", None),  # Multiple ranges: send everything
+    ("items=0-10", None),
+    ("bytes=-", None),
+    ("", None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=500-400", "bytes=-0"])
+def test_unsatisfiable_range_is_416(header):
+    with pytest.raises(HTTPException) as unsatisfiable:
+        parse_byte_range(header, SIZE)
+    assert unsatisfiable.value.status_code == 416
+    assert unsatisfiable.value.headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+SOURCE = np.random.default_rng(0).uniform(-1.0, 1.0, (3 * OUTPUT_SAMPLE_RATE + 17, OUTPUT_CHANNELS)).astype(np.float32)
+BYTES_PER_FRAME = OUTPUT_CHANNELS * 2
+
+
+def _full_wav(frames: np.ndarray, total_frames: int) -> bytes:
+    header = wav_header(OUTPUT_SAMPLE_RATE, OUTPUT_CHANNELS, data_size=total_frames * BYTES_PER_FRAME)
+    return header + PCM16Converter()(frames) + bytes((total_frames - len(frames)) * BYTES_PER_FRAME)
+
+
+def _window(monkeypatch, frames: np.ndarray, total_frames: int, byte_start: int, byte_end: int) -> bytes:
+    async def fake_blocks(audio_url, source, target_frequency, ai_preset, start_frame=0, preview=None, quality="standard"):
+        for start in range(start_frame, len(frames), 10000):  # Blocks that don't line up with anything
+            yield frames[start:start + 10000]
+
+    monkeypatch.setattr(main, "processed_audio_blocks", fake_blocks)
+
+    async def scenario():
+        return b"".join([chunk async for chunk in main.wav_byte_window("url", "source", 432, False, total_frames, byte_start, byte_end)])
+
+    return asyncio.run(scenario())
+
+
+FULL_SIZE = WAV_HEADER_BYTES + len(SOURCE) * BYTES_PER_FRAME
+
+
+@pytest.mark.parametrize("byte_start, byte_end", [
+    (0, WAV_HEADER_BYTES - 1),  # Header only
+    (10, 20),  # Inside the header
+    (0, 99),  # Header and the first frames
+    (WAV_HEADER_BYTES, WAV_HEADER_BYTES + 3),  # Exactly one frame
+    (WAV_HEADER_BYTES + 1, WAV_HEADER_BYTES + 6),  # Starts and ends mid-frame
+    (WAV_HEADER_BYTES + 2 * OUTPUT_SAMPLE_RATE * BYTES_PER_FRAME + 3, WAV_HEADER_BYTES + 2 * OUTPUT_SAMPLE_RATE * BYTES_PER_FRAME + 40001),  # After the pre-roll
+    (FULL_SIZE - 5, FULL_SIZE - 1),  # The tail, as a suffix range would ask for
+    (0, FULL_SIZE - 1),
+])
+def test_wav_byte_window_matches_full_render(monkeypatch, byte_start, byte_end):
+    expected = _full_wav(SOURCE, len(SOURCE))[byte_start:byte_end + 1]
+    assert _window(monkeypatch, SOURCE, len(SOURCE), byte_start, byte_end) == expected
+
+
+def test_wav_byte_window_pads_a_short_source(monkeypatch):
+    # The source ends 100 frames before its advertised length; the response must still match Content-Length
+    total_frames = len(SOURCE)
+    short = SOURCE[:-100]
+    byte_start, byte_end = FULL_SIZE - 1000, FULL_SIZE - 1
+    window = _window(monkeypatch, short, total_frames, byte_start, byte_end)
+    assert window == _full_wav(short, total_frames)[byte_start:byte_end + 1]
+    assert window.endswith(bytes(100 * BYTES_PER_FRAME))
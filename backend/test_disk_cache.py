@@ -0,0 +1,28 @@
+from disk_cache import DiskCache
+
+
+def test_entry_committed_by_another_process_is_found(tmp_path):
+    # Two instances on one directory stand in for the API and a Celery worker (or two uvicorn workers)
+    writer = DiskCache("Writer", str(tmp_path), 1024**2)
+    reader = DiskCache("Reader", str(tmp_path), 1024**2)
+    writer.load()
+    reader.load()
+
+    writer.put("abc123", b"rendered audio")
+
+    assert reader.peek("abc123") is not None
+    path = reader.lookup("abc123")
+    assert path is not None
+    with open(path, "rb") as f:
+        assert f.read() == b"rendered audio"
+    assert len(reader) == 1
+    assert reader.total_bytes == len(b"rendered audio")
+
+
+def test_unknown_key_is_a_miss(tmp_path):
+    cache = DiskCache("Cache", str(tmp_path), 1024**2)
+    cache.load()
+
+    assert cache.lookup("missing") is None
+    assert cache.lookup("tmp") is None  # The temp directory is not an entry
+    assert cache.misses == 2
@@ -0,0 +1,83 @@
+import asyncio
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from dsp import BlockEcho, BlockPitchShifter, calculate_pitch_factor, pitch_shift_block
+from dsp_executor import DSPExecutor
+from streaming import STREAM_BLOCK_FRAMES
+
+SAMPLE_RATE = 44100
+
+
+def _fixture(seconds: float) -> np.ndarray:
+    """A steady three-partial tone, quieter on the right, so any level change is down to the shifter."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    mono = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.15 * np.sin(2 * np.pi * 330 * t) + 0.1 * np.sin(2 * np.pi * 1100 * t)
+    return np.stack((mono, 0.5 * mono), axis=1).astype(np.float32)
+
+
+def _shift_in_blocks(audio: np.ndarray, pitch_factor: float, block_frames: int) -> np.ndarray:
+    async def scenario():
+        executor = DSPExecutor("thread", 1)
+        shifter = BlockPitchShifter(pitch_factor, SAMPLE_RATE, executor=executor)
+        try:
+            out = [await shifter.process(audio[start:start + block_frames]) for start in range(0, len(audio), block_frames)]
+            out.append(await shifter.flush())
+        finally:
+            shifter.close()
+            executor.shutdown()
+        return np.concatenate(out)
+
+    return asyncio.run(scenario())
+
+
+def _rms(samples: np.ndarray) -> float:
+    return float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+
+
+@pytest.mark.parametrize("target_hz", [432, 528])
+@pytest.mark.parametrize("block_frames, max_seam_db", [(STREAM_BLOCK_FRAMES, 1.0), (4096, 1.5)])
+def test_block_seams_match_whole_buffer_level(target_hz, block_frames, max_seam_db):
+    # The phase vocoder's output phase depends on where it started, so blocks are not sample-identical
+    # to one whole-buffer render; what must hold is that the seams don't dip, bump or click.
+    audio = _fixture(6.0)
+    pitch_factor = calculate_pitch_factor(target_hz)
+    whole = pitch_shift_block(audio, 12 * np.log2(pitch_factor), SAMPLE_RATE)
+    blocks = _shift_in_blocks(audio, pitch_factor, block_frames)
+
+    assert blocks.shape == whole.shape
+    assert abs(20 * np.log10(_rms(blocks) / _rms(whole))) < 0.5
+
+    half_window = 2048
+    for boundary in range(block_frames, len(audio) - block_frames, block_frames):
+        seam = boundary - 1024  # Output lags input by the crossfade
+        window = slice(seam - half_window, seam + half_window)
+        level_db = 20 * np.log10(_rms(blocks[window]) / _rms(whole[window]))
+        assert abs(level_db) < max_seam_db, f"level off by {level_db:.2f} dB at frame {seam}"
+        largest_step = np.abs(np.diff(blocks[window], axis=0)).max()
+        assert largest_step < 1.1 * np.abs(np.diff(whole[window], axis=0)).max(), f"click at frame {seam}"
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_block_echo_matches_ffmpeg_aecho():
+    # The AI preset's echo used to be ffmpeg's aecho=0.8:0.9:500:0.3; BlockEcho must sound the same
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (2 * SAMPLE_RATE + 123, 2)).astype(np.float32)
+    aecho = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'f32le', '-ar', str(SAMPLE_RATE), '-ac', '2', '-i', 'pipe:0',
+         '-af', 'aecho=0.8:0.9:500:0.3', '-f', 'f32le', 'pipe:1'],
+        input=audio.tobytes(), capture_output=True, check=True,
+    )
+    expected = np.frombuffer(aecho.stdout, dtype=np.float32).reshape(-1, 2)
+
+    async def scenario():
+        echo = BlockEcho(0.8, 0.9, 500, 0.3, SAMPLE_RATE)
+        out = [(await echo.process(audio[start:start + 4096])).copy() for start in range(0, len(audio), 4096)]
+        out.append(await echo.flush())
+        return np.concatenate(out)
+
+    rendered = asyncio.run(scenario())
+    assert rendered.shape == expected.shape  # Including the tail that rings on after the input
+    assert np.abs(rendered - expected).max() < 2 / 32768  # Within 2 LSB of 16-bit output
@@ -0,0 +1,38 @@
+import pytest
+from fastapi import HTTPException
+
+from encoders import negotiate_output_format
+
+
+@pytest.mark.parametrize("requested, accept, expected", [
+    (None, None, "wav"),
+    (None, "", "wav"),
+    (None, "audio/mpeg", "mp3"),
+    (None, "audio/x-flac", "flac"),
+    (None, "AUDIO/OGG", "opus"),
+    (None, "audio/mpeg;q=0.5, audio/flac;q=0.9", "flac"),
+    (None, "audio/flac;q=0.9, audio/mpeg", "mp3"),  # No q means q=1
+    (None, "audio/mpeg; q=0.8, audio/aac; q=0.8", "mp3"),  # First listed wins a tie
+    (None, "audio/mpeg;q=0", "wav"),  # q=0 means not acceptable
+    (None, "audio/mpeg;q=oops, audio/aac;q=0.1", "aac"),  # A malformed q counts as 0
+    (None, "*/*", "wav"),
+    (None, "audio/*", "wav"),
+    (None, "audio/mpeg, */*", "mp3"),
+    (None, "audio/mpeg;q=0.5, */*", "wav"),  # Anything at q=1 beats mp3 at 0.5
+    (None, "*/*;q=0.1, audio/opus", "opus"),
+    (None, "text/html, application/xhtml+xml", "wav"),  # Browsers navigating to the URL
+    (None, "audio/webm", "wav"),  # Unsupported types are ignored
+    ("mp3", "audio/flac", "mp3"),  # The payload field wins over Accept
+    ("FLAC", "audio/mpeg", "flac"),
+    ("wav", "*/*", "wav"),
+])
+def test_negotiate_output_format(requested, accept, expected):
+    assert negotiate_output_format(requested, accept).name == expected
+
+
+@pytest.mark.parametrize("requested", ["webm", "ogg", "audio/mpeg"])
+def test_unsupported_output_format_is_400(requested):
+    with pytest.raises(HTTPException) as unsupported:
+        negotiate_output_format(requested, "audio/mpeg")
+    assert unsupported.value.status_code == 400
+    assert requested in unsupported.value.detail
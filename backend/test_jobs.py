@@ -0,0 +1,59 @@
+import asyncio
+import sqlite3
+
+from jobs import INTERRUPTED_ERROR, JobStore
+
+
+def _age(path: str, job_id: str, seconds: float):
+    """Backdates a job's last renewal, as if its process had stopped renewing it `seconds` ago."""
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("UPDATE jobs SET updated_at = updated_at - ? WHERE id = ?", (seconds, job_id))
+    db.close()
+
+
+def test_job_left_running_by_a_restart_is_not_reused(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def scenario():
+        store = JobStore(path, ttl=3600, lease=60)
+        store.open()
+        job = await store.create("render-key", {}, "audio/wav")
+        await store.update(job["job_id"], status="running", stage="rendering", progress=0.015)
+        store.close()  # The server is killed mid-render...
+
+        _age(path, job["job_id"], 120)
+        store = JobStore(path, ttl=3600, lease=60)  # ...and comes back
+        store.open()
+        try:
+            # The next submission for the same render must not attach to the dead job
+            assert await store.find_active("render-key") is None
+            stale = await store.get(job["job_id"])
+            assert stale["status"] == "failed"
+            assert stale["error"] == INTERRUPTED_ERROR
+            resubmitted = await store.create("render-key", {}, "audio/wav")
+            assert (await store.find_active("render-key"))["job_id"] == resubmitted["job_id"]
+        finally:
+            store.close()
+
+    asyncio.run(scenario())
+
+
+def test_renewed_job_stays_active(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def scenario():
+        store = JobStore(path, ttl=3600, lease=60)
+        store.open()
+        try:
+            job = await store.create("render-key", {}, "audio/wav")
+            _age(path, job["job_id"], 50)
+            assert await store.renew([job["job_id"]]) == {job["job_id"]}
+            _age(path, job["job_id"], 50)  # Past the lease since creation, but not since the renewal
+            assert (await store.find_active("render-key"))["job_id"] == job["job_id"]
+
+            await store.update(job["job_id"], status="done")
+            assert await store.renew([job["job_id"]]) == set()
+        finally:
+            store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from scheduler import INITIAL_RENDER_SECONDS, RenderScheduler
+
+
+async def _chunks():
+    yield b"first"
+    await asyncio.Event().wait()  # A render that never finishes on its own
+    yield b"never"
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=0, max_wait=5)
+        await scheduler.admit()
+        with pytest.raises(HTTPException) as rejected:
+            await scheduler.admit()
+        return scheduler, rejected.value
+
+    scheduler, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == str(int(INITIAL_RENDER_SECONDS))
+    assert scheduler.rejected == 1
+    assert scheduler.active == 1
+
+
+def test_queued_request_times_out_with_503():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=1, max_wait=0.05)
+        await scheduler.admit()
+        with pytest.raises(HTTPException) as rejected:
+            await scheduler.admit()
+        return scheduler, rejected.value
+
+    scheduler, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert "Retry-After" in rejected.headers
+    assert scheduler.status()["queued"] == 0
+
+
+def test_released_slot_goes_to_the_longest_waiting_request():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=2, max_wait=5)
+        slot = await scheduler.admit()
+        first = asyncio.create_task(scheduler.admit())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(scheduler.admit())
+        await asyncio.sleep(0)
+        slot.release()
+        granted = await first
+        assert not second.done()
+        granted.release()
+        await second
+        return scheduler, granted
+
+    scheduler, granted = asyncio.run(scenario())
+    assert granted.position == 1
+    assert scheduler.active == 1
+    assert scheduler.admitted == 3
+
+
+def test_real_request_preempts_speculative_work():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=1, max_wait=5)
+        preempted = []
+
+        def preempt():
+            preempted.append(True)
+            speculative.release(completed=False)
+
+        speculative = scheduler.try_admit_speculative("abc", preempt)
+        assert speculative is not None
+        assert scheduler.try_admit_speculative("def", lambda: None) is None  # No idle slot left
+        slot = await scheduler.admit()
+        return scheduler, preempted, slot
+
+    scheduler, preempted, slot = asyncio.run(scenario())
+    assert preempted == [True]
+    assert slot.position == 1
+    assert scheduler.active == 1
+    assert scheduler.status()["speculative"] == 0
+
+
+def test_promoted_speculative_work_is_not_preempted():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=1, max_wait=0.05)
+        preempted = []
+        scheduler.try_admit_speculative("abc", lambda: preempted.append(True))
+        scheduler.promote("abc")
+        with pytest.raises(HTTPException):
+            await scheduler.admit()
+        return preempted
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=1, max_wait=5)
+        slot = await scheduler.admit()
+        waiter = asyncio.create_task(scheduler.admit())
+        await asyncio.sleep(0)
+        assert scheduler.status()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.status()["queued"] == 0
+        slot.release()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.active == 0
+
+
+def test_abandoned_stream_releases_its_slot():
+    async def scenario():
+        scheduler = RenderScheduler(slots=1, max_queue=0, max_wait=5)
+        slot = await scheduler.admit()
+        received = []
+
+        async def consume():
+            async for chunk in scheduler.hold(slot, _chunks()):
+                received.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        assert scheduler.active == 1
+        task.cancel()  # The client disconnected mid-render
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return scheduler, received
+
+    scheduler, received = asyncio.run(scenario())
+    assert received == [b"first"]
+    assert scheduler.active == 0
+    assert scheduler.render_seconds == INITIAL_RENDER_SECONDS  # An abandoned render says nothing about durations
@@ -0,0 +1,139 @@
+import hashlib
+import io
+import json
+import struct
+from typing import AsyncIterator
+
+import numpy as np
+
+import config
+from disk_cache import DiskCache
+
+WAVEFORM_FORMAT_VERSION = 1
+BASE_SAMPLES_PER_PIXEL = 256  # ~5.8 ms at 44.1kHz, finer than any screen needs for a whole track
+LEVEL_FACTOR = 4  # Each level has a quarter of the pixels of the one below it
+LEVELS = 6  # 256 up to 262144 samples per pixel (~6 s at 44.1kHz)
+
+
+def waveform_key(source: str, sample_rate: int) -> str:
+    """Peaks depend only on the source and the rate it was decoded at, never on the target frequency."""
+    parts = {"v": WAVEFORM_FORMAT_VERSION, "source": source, "sample_rate": sample_rate}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class PeaksBuilder:
+    """
+    Min/max peaks of decoded audio at BASE_SAMPLES_PER_PIXEL, built block by block.
+
+    Each block is viewed as (pixels, samples_per_pixel * channels) and reduced with a single
+    vectorized min and max, which folds the channels into one envelope too. Frames that don't
+    fill a whole pixel are held back until the next block.
+    """
+
+    def __init__(self, channels: int):
+        self.channels = channels
+        self.frames = 0
+        self._pending = np.empty((0, channels), dtype=np.float32)
+        self._mins: list[np.ndarray] = []
+        self._maxs: list[np.ndarray] = []
+
+    def add(self, block: np.ndarray):
+        self.frames += len(block)
+        if len(self._pending):
+            block = np.concatenate((self._pending, block))
+        whole = len(block) - len(block) % BASE_SAMPLES_PER_PIXEL
+        pixels = np.ascontiguousarray(block[:whole]).reshape(-1, BASE_SAMPLES_PER_PIXEL * self.channels)
+        self._mins.append(pixels.min(axis=1))
+        self._maxs.append(pixels.max(axis=1))
+        self._pending = block[whole:].copy()  # Decoded blocks are only valid until the next one
+
+    def finish(self) -> bytes:
+        """Every level as 16-bit min/max pairs, serialized for the waveform cache."""
+        if len(self._pending):
+            self._mins.append(np.array([self._pending.min()]))
+            self._maxs.append(np.array([self._pending.max()]))
+            self._pending = self._pending[:0]
+        mins = _to_int16(np.concatenate(self._mins)) if self._mins else np.zeros(0, dtype=np.int16)
+        maxs = _to_int16(np.concatenate(self._maxs)) if self._maxs else np.zeros(0, dtype=np.int16)
+        levels = {}
+        for level in range(LEVELS):
+            levels[f"min{level}"] = mins
+            levels[f"max{level}"] = maxs
+            if len(mins):
+                starts = np.arange(0, len(mins), LEVEL_FACTOR)
+                mins = np.minimum.reduceat(mins, starts)
+                maxs = np.maximum.reduceat(maxs, starts)
+        f = io.BytesIO()
+        np.savez(f, frames=np.int64(self.frames), **levels)
+        return f.getvalue()
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    return np.round(np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+async def record_peaks(cache: DiskCache, key: str, blocks: AsyncIterator[np.ndarray], channels: int) -> AsyncIterator[np.ndarray]:
+    """Passes decoded blocks through, storing their peaks in `cache` once the whole source has gone by."""
+    builder = PeaksBuilder(channels)
+    try:
+        async for block in blocks:
+            builder.add(block)
+            yield block
+    finally:
+        await blocks.aclose()
+    try:
+        cache.put(key, builder.finish())
+    except OSError as e:
+        print(f"{cache.name}: could not store {key}: {e}") # Renders don't depend on it
+        return
+    print(f"{cache.name}: stored {key} ({builder.frames} frames)")
+
+
+def peaks_from_pcm(path: str, channels: int, block_frames: int = 1 << 20) -> bytes:
+    """The same peaks as record_peaks, computed from a cached decode. Blocking; run it in a thread."""
+    pcm = np.memmap(path, dtype=np.float32, mode="r")
+    pcm = pcm[: len(pcm) - len(pcm) % channels].reshape(-1, channels)
+    builder = PeaksBuilder(channels)
+    for start in range(0, len(pcm), block_frames):
+        builder.add(pcm[start:start + block_frames])
+    return builder.finish()
+
+
+def load_peaks(path: str, pixels: int) -> tuple[int, int, np.ndarray]:
+    """
+    (frames, samples_per_pixel, interleaved min/max) of the coarsest stored level that still
+    has at least `pixels` points, or of the finest level if none has that many.
+    """
+    with np.load(path) as data:
+        level = 0
+        while level + 1 < LEVELS and len(data[f"min{level + 1}"]) >= pixels:
+            level += 1
+        mins, maxs = data[f"min{level}"], data[f"max{level}"]
+        frames = int(data["frames"])
+    interleaved = np.empty(2 * len(mins), dtype=np.int16)
+    interleaved[0::2] = mins
+    interleaved[1::2] = maxs
+    return frames, BASE_SAMPLES_PER_PIXEL * LEVEL_FACTOR ** level, interleaved
+
+
+def peaks_json(sample_rate: int, samples_per_pixel: int, peaks: np.ndarray) -> dict:
+    """Peaks in the JSON format of BBC audiowaveform, as read by wavesurfer.js and peaks.js."""
+    return {
+        "version": 2,
+        "channels": 1,
+        "sample_rate": sample_rate,
+        "samples_per_pixel": samples_per_pixel,
+        "bits": 16,
+        "length": len(peaks) // 2,
+        "data": peaks.tolist(),
+    }
+
+
+def peaks_dat(sample_rate: int, samples_per_pixel: int, peaks: np.ndarray) -> bytes:
+    """Peaks in audiowaveform's binary .dat format (version 2, 16-bit, one channel)."""
+    header = struct.pack("<iIiiIi", 2, 0, sample_rate, samples_per_pixel, len(peaks) // 2, 1)
+    return header + peaks.astype("<i2").tobytes()
+
+
+# Process-wide cache of waveform peaks; indexed by the app lifespan in main.py
+waveform_cache = DiskCache("Waveform cache", config.WAVEFORM_CACHE_DIR, config.WAVEFORM_CACHE_MAX_BYTES)
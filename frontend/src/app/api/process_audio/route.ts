@@ -10,6 +10,8 @@ export async function POST(request: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        // Lets the backend negotiate a compressed output format (Opus/AAC/MP3/FLAC)
+        'Accept': request.headers.get('Accept') || 'audio/wav',
       },
       body: JSON.stringify(requestBody),
     });
@@ -30,14 +32,12 @@ export async function POST(request: NextRequest) {
       );
     }
     
-    // For streaming responses, we need to forward the response body
-    const responseBody = await backendResponse.arrayBuffer();
-    
-    // Create a new response with the same status and headers
-    return new NextResponse(responseBody, {
+    // Pipe the backend stream straight through instead of buffering the whole render
+    return new NextResponse(backendResponse.body, {
       status: backendResponse.status,
       headers: {
         'Content-Type': backendResponse.headers.get('Content-Type') || 'audio/wav',
+        'Vary': 'Accept',
       },
     });
   } catch (error) {